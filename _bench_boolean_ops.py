@@ -0,0 +1,57 @@
+import itertools
+import sys
+import time
+from postings_format import PostingsReader
+from postings_ops import intersect_many, union_many
+
+''' Micro-benchmark: set-based vs sorted-array method1/method2/method3 on high-frequency terms
+
+Usage: python _bench_boolean_ops.py [posting_list.idx] [number of terms]
+'''
+
+def set_methods(a1, a2, o):
+    ''' The previous implementation: sorted lists -> sets -> set algebra -> unordered lists '''
+    s1, s2, s3 = set(a1.tolist()), set(a2.tolist()), set(o.tolist())
+    return list(s1 | s2 | s3), list(s1 & s2 & s3), list((s1 | s2) & s3)
+
+def array_methods(a1, a2, o):
+    return (
+        union_many([a1, a2, o]),
+        intersect_many([a1, a2, o]),
+        intersect_many([union_many([a1, a2]), o]),
+    )
+
+def time_it(function, triples, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        for triple in triples:
+            function(*triple)
+        best = min(best, time.perf_counter() - start_time)
+    return best
+
+def main():
+    filename = sys.argv[1] if len(sys.argv) > 1 else "posting_list.idx"
+    num_terms = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    reader = PostingsReader(filename)
+
+    # Highest document frequency terms
+    doc_freqs = sorted(((reader.doc_freq(term), term) for term in reader.terms()), reverse=True)
+    terms = [term for _, term in doc_freqs[:num_terms]]
+    print(f"Terms: {', '.join(f'{term} ({reader.doc_freq(term)})' for term in terms)}")
+    postings = {term: reader.get_postings(term) for term in terms}
+    triples = [tuple(postings[term] for term in triple) for triple in itertools.combinations(terms, 3)]
+
+    # Both engines must agree
+    for triple in triples:
+        for set_result, array_result in zip(set_methods(*triple), array_methods(*triple)):
+            assert sorted(set_result) == array_result.tolist(), "Result mismatch"
+
+    set_time = time_it(set_methods, triples)
+    array_time = time_it(array_methods, triples)
+    print(f"{len(triples)} term triples, method1 + method2 + method3 each")
+    print(f"set-based:    {set_time * 1000:.2f} ms")
+    print(f"sorted-array: {array_time * 1000:.2f} ms ({set_time / max(array_time, 1e-12):.1f}x)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,293 @@
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import os
+import pickle
+import shutil
+import sys
+import time
+import numpy as np
+import pandas as pd
+from metrics import peak_rss_bytes
+from _synthetic_corpus import RATING_WEIGHTS, generate_corpus, parse_rating_weights
+
+''' Benchmark suite: index build and query latency on a synthetic corpus, checked against golden results
+
+Usage: python _bench_suite.py [--reviews 10000] [--seed 0] [--repeat 20] [--workdir bench_work]
+                              [--steps corpus,index,metadata,classifier,customers,queries]
+                              [--report bench_report.json] [--save-golden]
+
+Generates a synthetic reviews_segment.pkl (see _synthetic_corpus.py) in the work directory and
+runs the real pipeline on it, timing each step:
+
+    index       create_postings_list, then writing posting_list.idx
+    metadata    create_review_metadata, then the columnar review store with its sentiment
+                bitmaps and lexicon counts
+    classifier  classifier.main (training, artifacts and the prediction cache)
+    customers   customer.customer_generation
+    queries     the 12 example aspect/opinion/method queries, each run --repeat times with
+                the postings and result caches emptied first, so every run searches the index
+
+Build steps report reviews/sec, queries report p50/p95/p99 latency and queries/sec, and every
+step reports the process's resident and peak memory (worker processes' peaks separately).
+
+Every query's baseline, M1, M2, M3 and combined results are compared with bench_golden.json,
+which holds their sizes and digests per corpus; a difference fails the run with exit status 1.
+After an intended change of results, record the new ones with --save-golden.
+'''
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+GOLDEN_FILENAME = os.path.join(REPO_DIR, "bench_golden.json")
+LEXICON_FILES = ("positive-words.txt", "negative-words.txt")
+
+STEPS = ("corpus", "index", "metadata", "classifier", "customers", "queries")
+
+# The example queries listed in boolean_search_help.py
+QUERIES = [
+    (aspect1, aspect2, opinion, method)
+    for aspect1, aspect2, opinion in (("audio", "quality", "poor"), ("wifi", "signal", "strong"),
+                                      ("gps", "map", "useful"), ("image", "quality", "sharp"))
+    for method in ("method1", "method2", "method3")
+]
+
+GOLDEN_STAGES = ("result", "M1_result", "M2_result", "M3_result", "combined_result")
+
+def rss_bytes():
+    ''' Current resident memory of this process (None where /proc is unavailable) '''
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+def children_peak_rss_bytes():
+    ''' Largest peak resident memory of any finished worker process '''
+    try:
+        import resource
+    except ImportError:
+        return None
+    return resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024
+
+def timed(function, *args, **kwargs):
+    ''' function's return value and how long it took, with its printing suppressed '''
+    start_time = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        value = function(*args, **kwargs)
+    return value, time.perf_counter() - start_time
+
+def step_report(seconds, num_reviews=None):
+    report = {"seconds": seconds}
+    if num_reviews is not None:
+        report["reviews_per_sec"] = num_reviews / seconds if seconds > 0 else None
+    report["rss_bytes"] = rss_bytes()
+    report["peak_rss_bytes"] = peak_rss_bytes()
+    report["children_peak_rss_bytes"] = children_peak_rss_bytes()
+    return report
+
+def corpus_name(corpus):
+    ''' Key of a corpus's golden results: the parameters it was generated with '''
+    return " ".join(f"{name}={corpus[name]}" for name in sorted(corpus))
+
+def run_build(steps, reviews_segment_df, report):
+    ''' Run and time the build steps that were asked for, leaving the artifacts in the working directory '''
+    import classifier
+    import customer
+    from metadata_store import write_lexicon_counts, write_sentiment_bitmaps
+    from postings_format import write_postings_list
+    from postings_list_generator import RECORD_POSITIONS, create_postings_list, create_review_metadata, create_review_store
+
+    num_reviews = len(reviews_segment_df)
+    if "index" in steps:
+        (postings_list, positions_list), seconds = timed(create_postings_list, reviews_segment_df, positions=RECORD_POSITIONS)
+        report["create_postings_list"] = step_report(seconds, num_reviews)
+        _, seconds = timed(write_postings_list, postings_list, "posting_list.idx", positions_list)
+        report["write_postings_list"] = step_report(seconds, num_reviews)
+        del postings_list, positions_list
+
+    if "metadata" in steps:
+        review_metadata, seconds = timed(create_review_metadata, reviews_segment_df)
+        report["create_review_metadata"] = step_report(seconds, num_reviews)
+        with open("review_metadata.pkl", "wb") as f:
+            pickle.dump(review_metadata, f)
+        del review_metadata
+
+        def create_store():
+            create_review_store(reviews_segment_df)
+            write_sentiment_bitmaps()
+            write_lexicon_counts()
+        _, seconds = timed(create_store)
+        report["create_review_store"] = step_report(seconds, num_reviews)
+
+    if "classifier" in steps:
+        _, seconds = timed(classifier.main, ["--no-feature-cache"])
+        report["classifier.main"] = step_report(seconds, num_reviews)
+
+    if "customers" in steps:
+        customers, seconds = timed(customer.customer_generation)
+        report["customer_generation"] = step_report(seconds, num_reviews)
+        report["customer_generation"]["customers"] = len(customers)
+
+def result_digest(ids):
+    ids = np.asarray(ids, dtype=np.int64)
+    return {"count": len(ids), "sha1": hashlib.sha1(ids.tobytes()).hexdigest()}
+
+def run_queries(repeat, report):
+    """
+    Times the example queries and collects their results for the golden check.
+    Returns:
+        dict: Query name -> stage -> size and digest of its result.
+    """
+    # Importing it loads the working directory's artifacts
+    import boolean_search_help
+
+    results = {}
+    latencies = {}
+    for aspect1, aspect2, opinion, method in QUERIES:
+        name = f"{aspect1}_{aspect2}_{opinion}_{method}"
+        query = dict(aspect1=aspect1, aspect2=aspect2, opinion=opinion, method=method)
+        stage_outputs = boolean_search_help.run_query(**query, stage_outputs=True)
+        results[name] = {stage: result_digest(stage_outputs[stage]) for stage in GOLDEN_STAGES}
+
+        latencies[name] = []
+        for _ in range(repeat):
+            boolean_search_help.postings_cache.clear()
+            boolean_search_help.result_cache.clear()
+            start_time = time.perf_counter()
+            lazy = boolean_search_help.run_query(**query)
+            latencies[name].append(time.perf_counter() - start_time)
+        # The lazy pipeline must agree with running every filter on the whole baseline
+        if lazy["combined_result"] != stage_outputs["combined_result"]:
+            results[name]["lazy_combined_result"] = result_digest(lazy["combined_result"])
+
+    every_latency = np.concatenate([np.asarray(values) for values in latencies.values()])
+    p50, p95, p99 = np.percentile(every_latency, [50, 95, 99])
+    report["queries"] = {
+        "runs": len(every_latency),
+        "p50_seconds": p50,
+        "p95_seconds": p95,
+        "p99_seconds": p99,
+        "queries_per_sec": len(every_latency) / every_latency.sum(),
+        "per_query_p50_seconds": {name: float(np.median(values)) for name, values in latencies.items()},
+        "rss_bytes": rss_bytes(),
+        "peak_rss_bytes": peak_rss_bytes(),
+    }
+    return results
+
+def compare_golden(corpus, results, golden_filename):
+    ''' Differences between results and the stored golden results of this corpus (None if it has none) '''
+    golden = {}
+    if os.path.exists(golden_filename):
+        with open(golden_filename, "r", encoding="utf-8") as f:
+            golden = json.load(f)
+    expected = golden.get(corpus_name(corpus))
+    if expected is None:
+        return None
+    differences = []
+    for name in sorted(set(expected) | set(results)):
+        for stage in sorted(set(expected.get(name, {})) | set(results.get(name, {}))):
+            want, got = expected.get(name, {}).get(stage), results.get(name, {}).get(stage)
+            if want != got:
+                differences.append(f"{name} {stage}: expected {want}, got {got}")
+    return differences
+
+def save_golden(corpus, results, golden_filename):
+    golden = {}
+    if os.path.exists(golden_filename):
+        with open(golden_filename, "r", encoding="utf-8") as f:
+            golden = json.load(f)
+    golden[corpus_name(corpus)] = results
+    with open(golden_filename + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(golden, f, indent=1, sort_keys=True)
+    os.replace(golden_filename + ".tmp", golden_filename)
+
+def print_report(report):
+    for name, step in report["steps"].items():
+        throughput = f", {step['reviews_per_sec']:,.0f} reviews/sec" if step.get("reviews_per_sec") else ""
+        print(f"{name:24s} {step['seconds']:9.3f} s{throughput}, peak RSS {(step['peak_rss_bytes'] or 0) / 2**20:,.0f} MiB")
+    if "queries" in report:
+        queries = report["queries"]
+        print(f"{'queries':24s} p50 {queries['p50_seconds'] * 1000:.2f} ms, p95 {queries['p95_seconds'] * 1000:.2f} ms,"
+              f" p99 {queries['p99_seconds'] * 1000:.2f} ms, {queries['queries_per_sec']:,.0f} queries/sec"
+              f" ({queries['runs']} runs)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark index building and querying on a synthetic corpus.")
+    parser.add_argument("--reviews", type=int, default=10000, help="Reviews in the synthetic corpus")
+    parser.add_argument("--seed", type=int, default=0, help="Corpus random seed")
+    parser.add_argument("--vocabulary", type=int, default=50000, help="Distinct non-lexicon words")
+    parser.add_argument("--zipf", type=float, default=1.1, help="Zipf exponent of word frequencies")
+    parser.add_argument("--ratings", type=parse_rating_weights, default=RATING_WEIGHTS, help="Relative weights of ratings 1-5")
+    parser.add_argument("--repeat", type=int, default=20, help="Timed runs of each query")
+    parser.add_argument("--workdir", type=str, default="bench_work", help="Directory for the corpus and artifacts")
+    parser.add_argument("--steps", type=str, default=",".join(STEPS), help=f"Comma-separated steps to run: {', '.join(STEPS)}\
+                        (without corpus, the work directory's corpus is reused)")
+    parser.add_argument("--report", type=str, default=None, help="Also write the report to this JSON file")
+    parser.add_argument("--golden", type=str, default=GOLDEN_FILENAME, help="Golden results file")
+    parser.add_argument("--save-golden", action="store_true", help="Record this run's query results as the golden ones")
+    args = parser.parse_args()
+
+    steps = [step.strip() for step in args.steps.split(",") if step.strip()]
+    unknown = set(steps) - set(STEPS)
+    if unknown:
+        parser.error(f"Unknown steps {sorted(unknown)}: use {', '.join(STEPS)}")
+    golden_filename = os.path.abspath(args.golden)
+    report_filename = os.path.abspath(args.report) if args.report else None
+
+    # Everything reads and writes artifacts in the working directory
+    os.makedirs(args.workdir, exist_ok=True)
+    for filename in LEXICON_FILES:
+        shutil.copy(os.path.join(REPO_DIR, filename), os.path.join(args.workdir, filename))
+    os.chdir(args.workdir)
+
+    report = {"steps": {}}
+    if "corpus" in steps:
+        corpus = {"reviews": args.reviews, "seed": args.seed, "vocabulary": args.vocabulary, "zipf": args.zipf,
+                  "ratings": ",".join(f"{weight:g}" for weight in args.ratings)}
+        reviews_segment_df, seconds = timed(generate_corpus, args.reviews, args.seed, args.vocabulary, args.zipf, args.ratings)
+        report["steps"]["generate_corpus"] = step_report(seconds, args.reviews)
+        reviews_segment_df.to_pickle("reviews_segment.pkl")
+        with open("corpus.json", "w", encoding="utf-8") as f:
+            json.dump(corpus, f)
+    else:
+        with open("corpus.json", "r", encoding="utf-8") as f:
+            corpus = json.load(f)
+        reviews_segment_df = None
+    report["corpus"] = corpus
+
+    if set(steps) & {"index", "metadata", "classifier", "customers"}:
+        if reviews_segment_df is None:
+            reviews_segment_df = pd.read_pickle("reviews_segment.pkl")
+        run_build(steps, reviews_segment_df, report["steps"])
+    del reviews_segment_df
+
+    differences = None
+    if "queries" in steps:
+        results = run_queries(args.repeat, report)
+        if args.save_golden:
+            save_golden(corpus, results, golden_filename)
+        else:
+            differences = compare_golden(corpus, results, golden_filename)
+            report["golden"] = "missing" if differences is None else ("ok" if not differences else differences)
+
+    print_report(report)
+    if report_filename:
+        with open(report_filename, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report saved to {report_filename}")
+
+    if args.save_golden and "queries" in steps:
+        print(f"Golden results for '{corpus_name(corpus)}' saved to {golden_filename}")
+    elif differences is None and "queries" in steps:
+        print(f"No golden results for '{corpus_name(corpus)}' yet: record them with --save-golden")
+    elif differences:
+        print(f"!! {len(differences)} results differ from the golden ones !!")
+        for difference in differences:
+            print(f"    {difference}")
+        sys.exit(1)
+    elif differences is not None:
+        print("Results match the golden ones")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+import re
+import sys
+import time
+from metadata_store import has_review_store, load_review_metadata, ReviewStore
+from text_analysis import LexiconMatcher, load_lexicon
+
+''' Benchmark: the previous per-call-site tokenize-and-count loop vs the shared LexiconMatcher
+
+Usage: python _bench_text_analysis.py [number of reviews]
+
+Reports docs/sec for lexicon counting both ways. Restricted to single-word entries, the
+matcher must give exactly the previous counts; the full matcher also counts multi-word entries,
+each once in place of the words inside it.
+'''
+
+# Texts with multi-word entries and the (positive, negative) hits the full matcher must give
+MULTI_WORD_CASES = (
+    ("A cost-effective charger.", (1, 0)),
+    ("Cost effective, and effective.", (2, 0)),
+    ("Set up took a long time.", (0, 0)),
+    ("The set-up was a long-time pain.", (0, 3)),
+    ("High quality, high-quality.", (1, 0)),
+)
+
+def previous_counts(texts, positive_words, negative_words):
+    ''' The loop duplicated in get_ratioed, calc_avg_positivity and count_lexicon_hits '''
+    counts = []
+    for text in texts:
+        words = re.findall(r'\b\w+\b', text.lower())
+        positive_count = sum(1 for word in words if word in positive_words)
+        negative_count = sum(1 for word in words if word in negative_words)
+        counts.append((positive_count, negative_count))
+    return counts
+
+def matcher_counts(texts, matcher):
+    return [matcher.count(text) for text in texts]
+
+def time_it(function, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start_time)
+    return best, result
+
+def main():
+    limit = int(sys.argv[1]) if len(sys.argv) > 1 else None
+    if has_review_store():
+        store = ReviewStore()
+        texts = store.texts(store.ids()[:limit].tolist())
+    else:
+        texts = [data["text"] for data in load_review_metadata().values()][:limit]
+    positive_words = load_lexicon("positive-words.txt")
+    negative_words = load_lexicon("negative-words.txt")
+    matcher = LexiconMatcher(positive_words, negative_words)
+    single_word_matcher = LexiconMatcher(
+        [word for word in positive_words if " " not in word and "-" not in word],
+        [word for word in negative_words if " " not in word and "-" not in word]
+    )
+
+    previous_time, previous = time_it(lambda: previous_counts(texts, positive_words, negative_words))
+    single_time, single = time_it(lambda: matcher_counts(texts, single_word_matcher))
+    matcher_time, counted = time_it(lambda: matcher_counts(texts, matcher))
+    assert single == previous, "Single-word counts differ from the previous implementation"
+    for text, expected in MULTI_WORD_CASES:
+        assert matcher.count(text) == expected, f"{text!r} counts {matcher.count(text)}, expected {expected}"
+    multi_word_hits = sum(p + n for p, n in counted) - sum(p + n for p, n in previous)
+
+    print(f"{len(texts)} reviews, {len(matcher.phrases)} multi-word entry prefixes")
+    print(f"previous loop:        {len(texts) / previous_time:,.0f} docs/sec")
+    print(f"matcher, single-word: {len(texts) / single_time:,.0f} docs/sec ({previous_time / single_time:.1f}x)")
+    print(f"matcher, full:        {len(texts) / matcher_time:,.0f} docs/sec ({previous_time / matcher_time:.1f}x),"
+          f" {multi_word_hits:+d} hits from multi-word entries")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,27 @@
+import boolean_search_help
+
+''' Check: the polarity of free-form queries comes from their non-negated lexicon words only
+
+Usage: python _check_query_polarity.py (from a directory with the search artifacts, which
+importing boolean_search_help loads)
+'''
+
+# Queries and the polarity query_positivity must give them
+QUERY_CASES = (
+    ("screen AND good", True),
+    ("screen AND bad", False),
+    ("screen AND NOT bad", None),
+    ("screen AND good AND NOT bad", True),
+    ("NOT good AND screen AND bad", False),
+    ('"bad screen" OR NOT good', False),
+    ("screen OR NOT (good OR bad)", None),
+)
+
+def main():
+    for query, expected in QUERY_CASES:
+        polarity = boolean_search_help.query_positivity(query)
+        assert polarity == expected, f"{query!r} has polarity {polarity}, expected {expected}"
+    print(f"{len(QUERY_CASES)} query polarities ok")
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,10 @@
 import pickle
 import pandas as pd
 import os
+from postings_format import load_postings_dict
 
 def read_postings_list_sample(filename, sample_size=10):
-    with open(filename, "rb") as f:
-        postings_list = pickle.load(f)
+    postings_list = load_postings_dict(filename)
     
     # Display a sample of key-value pairs
     print(f"Displaying a sample of {sample_size} key-value pairs from the postings list:")
@@ -14,8 +14,7 @@ def read_postings_list_sample(filename, sample_size=10):
         print(f"{word}: {indices}")
 
 def read_postings_list_keys(filename, bool: sorted):
-    with open(filename, "rb") as f:
-        postings_list = pickle.load(f)
+    postings_list = load_postings_dict(filename)
     
     if sorted == True:
         # Extract and sort the keys alphabetically
@@ -33,9 +32,8 @@ def read_postings_list_keys(filename, bool: sorted):
     print(f"posting_list.pkl keys have been written to '{output_file}'")
 
 def search_postings_list_key(filename, search_term):
-    # Load the postings list from the pickle file
-    with open(filename, "rb") as f:
-        postings_list = pickle.load(f)
+    # Load the postings list from disk
+    postings_list = load_postings_dict(filename)
     
     # Search for the specified key and display the result
     if search_term in postings_list:
@@ -45,9 +43,8 @@ def search_postings_list_key(filename, search_term):
         print(f"'{search_term}' not found in the postings list.")
 
 def compare_set_vs_list(filename, search_term):
-    # Load the postings list from the pickle file
-    with open(filename, "rb") as f:
-        postings_list = pickle.load(f)
+    # Load the postings list from disk
+    postings_list = load_postings_dict(filename)
     
     # Search for the specified key and display the result
     if search_term in postings_list:
@@ -62,8 +59,7 @@ def result_vs_homogenous_search(result_filename, posting_filename, search_term):
     python boolean_search_help.py --aspect1 gps --aspect2 gps --opinion gps --method method'''
     with open(result_filename, "rb") as f:
         result_indices = pickle.load(f)
-    with open(posting_filename, "rb") as f:
-        postings_list = pickle.load(f)
+    postings_list = load_postings_dict(posting_filename)
     
     if search_term in postings_list:
         print(f"Num indices in {result_filename}: {len(result_indices)}")
@@ -73,8 +69,7 @@ def pkl_to_excel(filename, output_folder, output_excel):
     # Ensure the output folder exists
     os.makedirs(output_folder, exist_ok=True)
 
-    with open(filename, "rb") as f:
-        postings_list = pickle.load(f)
+    postings_list = load_postings_dict(filename)
     
     # Check if the loaded object is dictionary-like
     if isinstance(postings_list, dict):
@@ -95,28 +90,28 @@ def pkl_to_excel(filename, output_folder, output_excel):
 
 def main():
 
-    filename = "posting_list.pkl"
+    filename = "posting_list.idx"
 
     '''Uncomment one of the functions below to use it:'''
 
     # Display a sample of the postings list
-    #read_postings_list_sample("postings_list.pkl")
+    #read_postings_list_sample("posting_list.idx")
 
     # Save keys to a text file
     sorted = False
-    #read_postings_list_keys("postings_list.pkl", sorted)
+    #read_postings_list_keys("posting_list.idx", sorted)
 
     search_term = "useful"
     # Search for a specific key
-    #search_postings_list_key("postings_list.pkl", search_term) 
+    #search_postings_list_key("posting_list.idx", search_term) 
 
     # Ensure validity of postings list via length of term:set vs term:list
-    #compare_set_vs_list("postings_list.pkl", search_term)
+    #compare_set_vs_list("posting_list.idx", search_term)
 
     method = "method1"
     result_filename = f"{search_term}_{search_term}_{search_term}_{method}.pkl"
     # Ensure consistency between postings list # of indices and binary search results
-    #result_vs_homogenous_search(result_filename, "posting_list.pkl", search_term)
+    #result_vs_homogenous_search(result_filename, "posting_list.idx", search_term)
 
     output_folder = r"C:\Users\Rallysoldier\Documents\4397_COSC\res_proj_helper_files"
     output_excel = "posting_list_excel.xlsx"
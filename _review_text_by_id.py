@@ -1,17 +1,11 @@
-import pickle
+import os
 import pandas as pd
+from metadata_store import load_review_metadata
+from result_export import export_results
 
-'''REMEMBER: Your method files are returning the ID - 2. It is very likely that the reviews segment is being
-improperly converted into a dataframe somehwere. DO NOT FORGET'''
-
-# Load the reviews segment and create a DataFrame
-with open("reviews_segment.pkl", "rb") as f:
-    reviews_segment = pickle.load(f)
-
-segment_df = pd.DataFrame(reviews_segment)
-segment_df["ID"] = segment_df.index + 2  # Add ID column based on the index
-segment_df_result = segment_df[["ID", "review_text"]]  # Filter relevant columns
-print(segment_df_result.head())
+# Result files hold review IDs, the same IDs the metadata is keyed by, so texts are looked up
+# directly (ID <-> DataFrame index conversion lives in metadata_store.to_review_ids/to_segment_index)
+review_metadata = load_review_metadata()
 
 ''' CHOOSE INPUT FILE: '''
 result_files = {
@@ -41,37 +35,15 @@ while(valid_input == None):
         print("Invalid Input\n")
         continue
 
-with open(input_pkl, "rb") as f:
-    result_ids = pickle.load(f)
-
-result_df = pd.DataFrame(result_ids)
-# Add 2 to the only column, no matter its name
-result_df[result_df.columns[0]] = result_df[result_df.columns[0]] + 2
-print(result_df.head())
-
-# Prepare an empty DataFrame for the output
-output_df = pd.DataFrame(columns=["ID", "review_text"])
-print(output_df.head())
-
-# Collect IDs from result_df
-IDs = result_df["review_index"].tolist()
+result_df = pd.read_pickle(input_pkl)
+IDs = result_df[result_df.columns[0]].tolist()
 print(f"# of IDs from boolean search: {len(IDs)}")
 
-# Add rows to the output DataFrame
-for i, ID in enumerate(IDs):
-    # Find the matching review text for the given ID
-    matching_review = segment_df.loc[segment_df["ID"] == ID, "review_text"]
-    
-    if not matching_review.empty:  # Check if a match is found
-        output_df.loc[i, "ID"] = ID
-        output_df.loc[i, "review_text"] = matching_review.iloc[0]  # Get the first matching text
-
-print(output_df.head())
 output_folder = r"C:\Users\Rallysoldier\Documents\4397_COSC\res_proj_helper_files"
 custom_name = input_pkl + "_rev_text"
-output_path = rf"{output_folder}\{custom_name}.xlsx"
+output_path = os.path.join(output_folder, f"{custom_name}.csv")
 
-# Save the DataFrame to an Excel file
-output_df.to_excel(output_path, index=False)  # index=False prevents adding a new index column
+# Stream ID, rating and text page by page (the CSV opens directly in Excel)
+written = export_results(IDs, output_path, review_metadata)
 
-print(f"DataFrame successfully saved to {output_path}")
+print(f"{written} reviews successfully saved to {output_path}")
@@ -0,0 +1,154 @@
+import argparse
+import numpy as np
+import pandas as pd
+from text_analysis import LexiconMatcher, load_lexicon
+
+''' Synthetic review corpus in the reviews_segment.pkl schema, for benchmarks
+
+Usage: python _synthetic_corpus.py NUM_REVIEWS [-o reviews_segment.pkl] [--seed 0] [--vocabulary 50000]
+                                   [--zipf 1.1] [--ratings 8,5,8,19,60]
+
+Review texts draw words from a Zipfian vocabulary: common function words first, then the
+aspect and opinion words of the example queries, then generated filler words. A share of
+the words are opinion lexicon words whose polarity follows the review's rating, so M1, M2
+and M3 have something to agree and disagree on. Ratings follow the given weights (by
+default the J-shape of real product reviews), and customers write three reviews on average,
+so customer profiles have something to group. The same arguments always give the same corpus.
+
+Reviews are generated a chunk at a time with vectorized sampling; millions of reviews take
+minutes, mostly to join the words into texts.
+'''
+
+# Share of reviews per rating 1-5
+RATING_WEIGHTS = (8, 5, 8, 19, 60)
+
+# Chance that a lexicon word in a review of each rating (1-5) is a positive one
+POSITIVE_SHARE = (0.05, 0.15, 0.5, 0.85, 0.95)
+
+# Share of words drawn from the opinion lexicons
+OPINION_RATE = 0.06
+
+# Mean and spread of the log of a review's length in words
+LENGTH_LOG_MEAN = 3.8
+LENGTH_LOG_SIGMA = 0.7
+
+FUNCTION_WORDS = (
+    "the a and i it to of is this was for in my with not but very on that have you are as so "
+    "they be one at just had all if or would when can like will up out what there do"
+).split()
+
+# Aspect and opinion words of the example queries, plus other frequent product words
+PRODUCT_WORDS = (
+    "quality audio image wifi signal gps map poor strong useful sharp product sound battery "
+    "life price screen charge work use time easy set works bought"
+).split()
+
+SYLLABLES = ("ba", "ko", "ri", "mu", "te", "sa", "lo", "ne", "vi", "da", "pu", "go", "fe", "zi", "ha", "ju")
+
+def filler_words(count):
+    ''' count distinct made-up words (three or more syllables, so no filler is a real word) '''
+    words = []
+    for number in range(count):
+        syllables = []
+        number += len(SYLLABLES) ** 2
+        while number:
+            number, digit = divmod(number, len(SYLLABLES))
+            syllables.append(SYLLABLES[digit])
+        words.append("".join(syllables))
+    return words
+
+def zipf_probabilities(size, exponent):
+    weights = 1.0 / np.arange(1, size + 1) ** exponent
+    return weights / weights.sum()
+
+def generate_corpus(num_reviews, seed=0, vocabulary_size=50000, zipf_exponent=1.1, rating_weights=RATING_WEIGHTS,
+                    chunk_size=100000, positive_words_filename="positive-words.txt", negative_words_filename="negative-words.txt"):
+    """
+    Generates a synthetic reviews segment.
+    Args:
+        num_reviews (int): Number of reviews.
+        seed (int): Random seed.
+        vocabulary_size (int): Number of distinct non-lexicon words.
+        zipf_exponent (float): Exponent of the Zipfian word and lexicon word frequencies.
+        rating_weights (tuple): Relative share of reviews per rating 1-5.
+        chunk_size (int): Reviews generated per vectorized batch.
+        positive_words_filename (str): Positive opinion lexicon.
+        negative_words_filename (str): Negative opinion lexicon.
+    Returns:
+        DataFrame: review_text, customer_review_rating, customer_id and review_with_metadata,
+            indexed 0..num_reviews-1 like reviews_segment.pkl.
+    """
+    rng = np.random.default_rng(seed)
+    vocabulary = FUNCTION_WORDS + PRODUCT_WORDS
+    vocabulary = np.array(vocabulary + filler_words(max(vocabulary_size - len(vocabulary), 0)), dtype=object)
+    word_probabilities = zipf_probabilities(len(vocabulary), zipf_exponent)
+
+    # Single-word lexicon entries, in a fixed shuffled order so the Zipfian head is not alphabetical
+    lexicon = LexiconMatcher(load_lexicon(positive_words_filename), load_lexicon(negative_words_filename))
+    lexicons = []
+    for words in (lexicon.positive_words, lexicon.negative_words):
+        words = np.array(sorted(words), dtype=object)
+        lexicons.append(words[rng.permutation(len(words))])
+    lexicon_probabilities = [zipf_probabilities(len(words), zipf_exponent) for words in lexicons]
+
+    rating_probabilities = np.asarray(rating_weights, dtype=np.float64) / np.sum(rating_weights)
+    num_customers = max(num_reviews // 3, 1)
+    num_products = max(num_reviews // 20, 1)
+
+    columns = {"review_text": [], "customer_review_rating": [], "customer_id": [], "review_with_metadata": []}
+    for start in range(0, num_reviews, chunk_size):
+        count = min(chunk_size, num_reviews - start)
+        ratings = rng.choice(5, size=count, p=rating_probabilities) + 1
+        lengths = np.clip(np.rint(rng.lognormal(LENGTH_LOG_MEAN, LENGTH_LOG_SIGMA, count)), 3, 2000).astype(np.int64)
+
+        # Draw every word of the chunk, then swap a share of them for lexicon words
+        words = vocabulary[rng.choice(len(vocabulary), size=int(lengths.sum()), p=word_probabilities)]
+        opinion = np.flatnonzero(rng.random(len(words)) < OPINION_RATE)
+        positive_share = np.asarray(POSITIVE_SHARE)[np.repeat(ratings - 1, lengths)[opinion]]
+        positive = rng.random(len(opinion)) < positive_share
+        for polarity, selected in ((0, opinion[positive]), (1, opinion[~positive])):
+            words[selected] = lexicons[polarity][rng.choice(len(lexicons[polarity]), size=len(selected), p=lexicon_probabilities[polarity])]
+
+        customers = rng.integers(0, num_customers, count)
+        products = rng.integers(0, num_products, count)
+        out_of_helpful = rng.poisson(3, count)
+        helpful = rng.binomial(out_of_helpful, 0.7)
+        days = rng.integers(0, 15 * 365, count)
+        ends = np.cumsum(lengths)
+        for i, (rating, end, length) in enumerate(zip(ratings.tolist(), ends.tolist(), lengths.tolist())):
+            review_words = words[end - length:end].tolist()
+            text = " ".join(review_words).capitalize() + "."
+            customer_id = f"C{customers[i]:08d}"
+            date = str(np.datetime64("1999-01-01") + int(days[i]))
+            fields = (
+                f"R{start + i:09d}", f"P{products[i]:08d}", customer_id, int(helpful[i]), int(out_of_helpful[i]),
+                rating, " ".join(review_words[:4]).capitalize(), date, f"Customer {customers[i]}", "", text,
+            )
+            columns["review_text"].append(text)
+            columns["customer_review_rating"].append(rating)
+            columns["customer_id"].append(customer_id)
+            columns["review_with_metadata"].append(repr(fields) + ",")
+    return pd.DataFrame(columns)
+
+def parse_rating_weights(text):
+    weights = tuple(float(weight) for weight in text.split(","))
+    if len(weights) != 5 or min(weights) < 0 or sum(weights) <= 0:
+        raise argparse.ArgumentTypeError("--ratings needs five non-negative weights, for ratings 1-5")
+    return weights
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic reviews_segment.pkl.")
+    parser.add_argument("reviews", type=int, help="Number of reviews")
+    parser.add_argument("-o", "--output", type=str, default="reviews_segment.pkl", help="Output pickle")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    parser.add_argument("--vocabulary", type=int, default=50000, help="Distinct non-lexicon words")
+    parser.add_argument("--zipf", type=float, default=1.1, help="Zipf exponent of word frequencies")
+    parser.add_argument("--ratings", type=parse_rating_weights, default=RATING_WEIGHTS, help="Relative weights of ratings 1-5")
+    args = parser.parse_args()
+
+    reviews_segment_df = generate_corpus(args.reviews, args.seed, args.vocabulary, args.zipf, args.ratings)
+    reviews_segment_df.to_pickle(args.output)
+    print(f"{len(reviews_segment_df)} reviews saved to {args.output}")
+
+if __name__ == "__main__":
+    main()
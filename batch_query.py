@@ -0,0 +1,157 @@
+import argparse
+import csv
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from types import SimpleNamespace
+import pandas as pd
+from query_server import QUERY_FIELDS
+import boolean_search_help
+
+''' Run a whole file of queries in one process
+
+Artifacts are loaded once (per worker), and boolean_search_help's postings and result caches
+let queries that share terms or whole sub-results reuse each other's work. All results go to a single output file with
+one row per query, in input order, including how long each query took.
+
+    python batch_query.py queries.csv -o batch_results.pkl --workers 4
+
+The query file is CSV with a header row, or JSONL with one object per line, using the
+query server's fields: aspect1, aspect2, opinion, method, phrase, near, rating_threshold, query,
+top_k, classifier_boost, ratio_boost, stage_outputs, snippets, expand,
+expand_limit.
+
+--metrics-json / --metrics-prom report per-stage latency histograms over the whole batch,
+merged from every worker.
+'''
+
+# Every output column run_query can produce, in the order they are written
+OUTPUTS = ("result", "M1_result", "M2_result", "M3_result", "combined_result", "pipeline", "ranked_result", "ranked_scores", "snippets", "expansion")
+
+def _parse_field(field, value):
+    ''' Convert a CSV cell to the type run_query expects '''
+    if value is None or (isinstance(value, str) and value.strip() == ""):
+        return None
+    if field in ("near", "rating_threshold", "top_k", "expand_limit"):
+        return int(value)
+    if field in ("classifier_boost", "ratio_boost"):
+        return float(value)
+    if field in ("phrase", "stage_outputs", "snippets") and isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "yes", "y")
+    return value
+
+def load_queries(filename):
+    """
+    Reads a query file.
+    Args:
+        filename (str): .csv with a header row, or .jsonl / .json with one object per line.
+    Returns:
+        list: One dict of run_query keyword arguments per query.
+    """
+    with open(filename, "r", encoding="utf-8", newline="") as f:
+        if filename.lower().endswith((".jsonl", ".json")):
+            rows = [json.loads(line) for line in f if line.strip()]
+        else:
+            rows = list(csv.DictReader(f))
+
+    queries = []
+    for row in rows:
+        unknown = set(row) - set(QUERY_FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown query fields {sorted(unknown)} in {filename}")
+        query = {field: _parse_field(field, row.get(field)) for field in QUERY_FIELDS}
+        queries.append({field: value for field, value in query.items() if value is not None})
+    return queries
+
+def query_name(query):
+    ''' The name the single-query CLI would give this query's result file '''
+    fields = {field: query.get(field) for field in QUERY_FIELDS}
+    return boolean_search_help.output_name(SimpleNamespace(**fields))
+
+def run_one(query):
+    ''' Run a single query, capturing its results, timing and any error '''
+    row = {"name": query_name(query), **query}
+    start_time = time.perf_counter()
+    try:
+        row.update(boolean_search_help.run_query(**query))
+        row["error"] = None
+    except ValueError as e:
+        row.update({"result": [], "combined_result": []})
+        row["error"] = str(e)
+    row["elapsed"] = time.perf_counter() - start_time
+    return row
+
+def run_chunk(queries):
+    ''' run_one over a slice of the batch in a worker, plus the metrics it recorded (see Metrics.collect) '''
+    return [run_one(query) for query in queries], boolean_search_help.collect_metrics()
+
+def run_batch(queries, workers=None):
+    """
+    Runs every query, fanning them out over a process pool.
+    Each worker loads the artifacts once (forked workers inherit the parent's) and keeps its
+    own postings and result caches for the queries it is given. When search metrics are
+    enabled, each worker's are merged into this process's.
+    Args:
+        queries (list): run_query keyword arguments, one dict per query.
+        workers (int): Worker processes (defaults to the CPU count); 1 runs in this process.
+    Returns:
+        list: One result row per query, in input order.
+    """
+    workers = workers or os.cpu_count() or 1
+    workers = min(workers, len(queries)) or 1
+    if workers > 1:
+        chunksize = max(1, len(queries) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            if not boolean_search_help.search_metrics.enabled:
+                return list(executor.map(run_one, queries, chunksize=chunksize))
+            rows = []
+            chunks = [queries[start:start + chunksize] for start in range(0, len(queries), chunksize)]
+            for chunk_rows, state in executor.map(run_chunk, chunks):
+                rows.extend(chunk_rows)
+                boolean_search_help.search_metrics.merge(state)
+            return rows
+    return [run_one(query) for query in queries]
+
+def write_results(rows, filename):
+    ''' Save the batch as a DataFrame pickle (.pkl), JSONL (.jsonl) or CSV (.csv) '''
+    outputs = [output for output in OUTPUTS if any(output in row for row in rows)]
+    columns = ["name", *QUERY_FIELDS, *outputs, "elapsed", "error"]
+    results_df = pd.DataFrame(rows).reindex(columns=columns)
+    if filename.lower().endswith(".jsonl"):
+        results_df.to_json(filename, orient="records", lines=True)
+    elif filename.lower().endswith(".csv"):
+        results_df.to_csv(filename, index=False)
+    else:
+        results_df.to_pickle(filename)
+    return results_df
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a file of boolean search queries in one process.")
+    parser.add_argument("queries", type=str, help="CSV (with header) or JSONL file of queries")
+    parser.add_argument("-o", "--output", type=str, default="batch_results.pkl", help="Output file (.pkl, .jsonl or .csv)")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (defaults to the CPU count)")
+    boolean_search_help.add_metrics_arguments(parser)
+    args = parser.parse_args()
+
+    try:
+        queries = load_queries(args.queries)
+        if args.metrics_json or args.metrics_prom:
+            boolean_search_help.search_metrics.enable(boolean_search_help.parse_metric_stages(args.metrics_stages), args.trace_memory)
+    except ValueError as e:
+        print(f"\n!! {e} !!\n")
+        return
+
+    start_time = time.perf_counter()
+    rows = run_batch(queries, args.workers)
+    elapsed = time.perf_counter() - start_time
+
+    results_df = write_results(rows, args.output)
+    for _, row in results_df.iterrows():
+        status = f"!! {row['error']} !!" if isinstance(row["error"], str) else f"{len(row['combined_result'])} combined"
+        print(f"{row['name']}: {len(row['result'])} baseline, {status} ({row['elapsed'] * 1000:.1f} ms)")
+    print(f"{len(rows)} queries in {elapsed:.2f}s; results saved to {args.output}")
+    boolean_search_help.write_metrics(args)
+
+if __name__ == "__main__":
+    main()
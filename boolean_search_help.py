@@ -1,46 +1,215 @@
 import pandas as pd
 import argparse
+import os
 import pickle
 import re
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.naive_bayes import MultinomialNB
-
-# Load postings list
-with open("posting_list.pkl", "rb") as f:
-    postings_list = pickle.load(f)
-
-# Load review metadata
-with open("review_metadata.pkl", "rb") as f:
-    review_metadata = pickle.load(f)
-
-# Load Training Model
-with open("sentiment_classifier.pkl", "rb") as f:
-    model = pickle.load(f)
-
-# Load tfidf 
-with open("tfidf_vectorizer.pkl", "rb") as f:
-    tfidf = pickle.load(f)
-
-# Load positive words
-with open("positive-words.txt", "r", encoding="utf-8") as f:
-    positive_words = {line.strip() for line in f if line.strip()}
-
-# Load negative words
-with open("negative-words.txt", "r", encoding="utf-8") as f:
-    negative_words = {line.strip() for line in f if line.strip()}
-
-# Initialize positive/negative indexes
-positive_index = set()
-negative_index = set()
-
-def populate_sentiment_indexes():
-    ''' Populate positive/negative indexes '''
-    for ID in review_metadata:
-        rating = review_metadata[ID]['customer_review_rating']
-        if int(rating) > 3:
-            positive_index.add(ID)
+import threading
+from postings_format import PostingsReader
+import segments
+import sharding
+from search_cache import CachedPostings, LRUCache, artifact_stamp
+from metrics import Metrics
+from positional import positional_filter
+import numpy as np
+from sentiment_scorer import SCORER_FILENAME, load_prediction_cache, load_scorer
+from metadata_store import RATING_THRESHOLD, STORE_DIR, count_tokens, load_review_metadata, rating_masks, ratings_array
+import query_client
+from postings_ops import as_postings, intersect_many
+from query_language import QueryEngine, canonical, method_expression, parse, positive_terms
+from ranking import DEFAULT_TOP_K, BM25Ranker
+from filter_pipeline import FilterPipeline, FilterStage
+from result_export import PAGE_SIZE, export_results
+from snippets import highlight, make_snippets
+from text_analysis import load_lexicon_matcher
+from opinion_expansion import (DEFAULT_NEIGHBOURS, EXPANSION_MODES, cooccurrence_counts, expand_opinion, expansion_candidates,
+                               lexicon_expansion, nearest_neighbours)
+
+# Search artifacts, loaded once by load_search_artifacts
+postings_list = None
+review_metadata = None
+model = None
+tfidf = None
+prediction_cache = None
+lexicon = None
+positive_words = None
+negative_words = None
+has_lexicon_counts = False
+query_engine = None
+ranker = None
+
+# With a sharded index: the coordinator fanning queries out to the shards' workers, or in a
+# worker, the shard directory it serves
+shard_coordinator = None
+serving_shard = None
+
+# Files whose regeneration invalidates the caches below (directories cover every file inside)
+ARTIFACT_FILES = [
+    "posting_list.idx", "posting_list.pkl", "review_metadata.pkl", STORE_DIR,
+    os.path.join(segments.SEGMENTS_DIR, segments.MANIFEST),
+    "sentiment_classifier.pkl", "tfidf_vectorizer.pkl", "sentiment_cache.npz", SCORER_FILENAME,
+    "positive-words.txt", "negative-words.txt", sharding.manifest_path(),
+]
+
+def artifact_files(shard=None):
+    ''' ARTIFACT_FILES, with a shard worker's own index and store in place of the unsharded ones '''
+    if shard is None:
+        return ARTIFACT_FILES
+    shared = [filename for filename in ARTIFACT_FILES if not filename.startswith(("posting_list", "review_metadata", STORE_DIR))]
+    return shared + [shard, os.path.join(shard, STORE_DIR)]
+
+# Decoded postings/positions per term, and finished stage results per normalized query
+POSTINGS_CACHE_BYTES = 256 * 1024 * 1024
+RESULT_CACHE_BYTES = 64 * 1024 * 1024
+postings_cache = LRUCache(max_bytes=POSTINGS_CACHE_BYTES)
+result_cache = LRUCache(max_bytes=RESULT_CACHE_BYTES)
+artifact_version = None
+_reload_lock = threading.Lock()
+
+# Per-stage latency, candidate-set size and memory histograms, off until enabled (see metrics.py)
+search_metrics = Metrics()
+METRIC_STAGES = (
+    "load", "query", "expand", "boolean", "M1_result", "M2_result", "M3_result", "combine", "pipeline",
+    "rank", "snippets", "shard_statistics", "shard_search", "merge",
+)
+
+def measured(stage, compute, input_size=None):
+    ''' compute() inside a metrics span for stage, recording the number of reviews it returns '''
+    with search_metrics.span(stage, input_size) as span:
+        value = compute()
+        span.output(len(value))
+    return value
+
+@search_metrics.timed("load")
+def load_search_artifacts(shard=None):
+    """
+    Load the index, metadata, model and lexicons into the module globals used by the search methods.
+    Args:
+        shard (str): Serve only this shard's index and review store (in a shard worker process).
+            Otherwise a sharded index makes this process the coordinator of its shards.
+    """
+    global postings_list, review_metadata, model, tfidf, prediction_cache, lexicon, positive_words, negative_words, has_lexicon_counts, query_engine
+    global artifact_version, ranker, shard_coordinator, serving_shard
+    serving_shard = shard
+    artifact_version = artifact_stamp(artifact_files(shard))
+    if shard_coordinator is not None:
+        # A worker forked from a coordinator inherits its pools: drop them, they are not its own
+        if shard is None:
+            shard_coordinator.close()
+        shard_coordinator = None
+
+    shard_manifest = sharding.load_manifest() if shard is None else None
+    if shard_manifest is not None:
+        # Coordinator: the shard workers search; reviews are read through their stores
+        postings_list = None
+        review_metadata = sharding.ShardedReviews(shard_manifest)
+        shard_coordinator = sharding.ShardCoordinator(shard_manifest)
+    else:
+        directory = shard or "."
+        # Load postings list, memory-mapping the binary index when it has been generated
+        if os.path.exists(os.path.join(directory, "posting_list.idx")):
+            postings_list = PostingsReader(os.path.join(directory, "posting_list.idx"))
+        else:
+            with open(os.path.join(directory, "posting_list.pkl"), "rb") as f:
+                postings_list = pickle.load(f)
+
+        # Load review metadata, opening the columnar store when it has been generated
+        review_metadata = load_review_metadata(os.path.join(directory, STORE_DIR), os.path.join(directory, "review_metadata.pkl"))
+
+    # Search every live segment appended since the last full rebuild
+    if shard is None and shard_manifest is None and segments.load_manifest() is not None:
+        postings_list = segments.SegmentedIndex(postings_list)
+        review_metadata = segments.load_live_metadata(review_metadata)
+
+    # Load the NumPy scorer exported with the model; it scores raw texts, so there is no tfidf
+    model, tfidf = load_scorer(), None
+    if model is None:
+        # Load Training Model
+        with open("sentiment_classifier.pkl", "rb") as f:
+            model = pickle.load(f)
+
+        # Load tfidf 
+        with open("tfidf_vectorizer.pkl", "rb") as f:
+            tfidf = pickle.load(f)
+
+    # Load per-review predictions cached by classifier.main (None if missing or stale)
+    prediction_cache = load_prediction_cache()
+
+    # Compile the positive and negative lexicons into one matcher
+    lexicon = load_lexicon_matcher("positive-words.txt", "negative-words.txt")
+    positive_words, negative_words = lexicon.positive_words, lexicon.negative_words
+
+    # Use the index-time lexicon counts in M3 unless the lexicon files changed since they were computed
+    has_lexicon_counts = hasattr(review_metadata, "has_lexicon_counts") and review_metadata.has_lexicon_counts()
+
+    # Rating memberships, decoded postings and results are rebuilt lazily for the new artifacts
+    sentiment_indexes.clear()
+    postings_cache.clear()
+    result_cache.clear()
+
+    # Serve repeated term lookups from the postings cache (a postings dict is already in memory)
+    if hasattr(postings_list, "get_postings"):
+        postings_list = CachedPostings(postings_list, postings_cache)
+
+    # Boolean query planner/executor over the postings
+    query_engine = QueryEngine(postings_list, all_review_ids)
+
+    # BM25 ranker, built on the first ranked query (it needs every review's length)
+    ranker = None
+
+def refresh_search_artifacts():
+    ''' Reload everything if any artifact was regenerated since it was loaded; returns True if it reloaded '''
+    if artifact_stamp(artifact_files(serving_shard)) == artifact_version:
+        return False
+    with _reload_lock:
+        if artifact_stamp(artifact_files(serving_shard)) == artifact_version:
+            return False
+        load_search_artifacts(serving_shard)
+        return True
+
+def cache_stats():
+    ''' Hit/miss counters of the postings and result caches '''
+    return {"postings": postings_cache.stats(), "results": result_cache.stats()}
+
+def review_doc_lengths(ids):
+    ''' Token count of each review, from the store's doc_lengths column when available '''
+    if hasattr(review_metadata, "doc_lengths"):
+        return review_metadata.doc_lengths(ids)
+    return np.asarray(count_tokens([review_metadata[ID]["text"] for ID in np.asarray(ids).tolist()]), dtype=np.int64)
+
+def get_ranker():
+    ''' The BM25 ranker over the live reviews, built once per loaded index '''
+    global ranker
+    if ranker is None:
+        ids = all_review_ids()
+        lengths = review_doc_lengths(ids)
+        ranker = BM25Ranker(postings_list, review_doc_lengths, len(ids), float(lengths.mean()) if len(ids) else 0.0)
+    return ranker
+
+def all_review_ids():
+    ''' Sorted array of every live review ID (the universe NOT subtracts from) '''
+    if hasattr(review_metadata, "ids"):
+        return review_metadata.ids()
+    return as_postings(sorted(review_metadata.keys()))
+
+# Positive/negative indexes per rating threshold: boolean masks indexed by review ID
+sentiment_indexes = {}
+
+def populate_sentiment_indexes(threshold=RATING_THRESHOLD):
+    ''' Populate positive/negative indexes from the precomputed rating bitmaps '''
+    if threshold not in sentiment_indexes:
+        if hasattr(review_metadata, "sentiment_masks"):
+            sentiment_indexes[threshold] = review_metadata.sentiment_masks(threshold)
         else:
-            negative_index.add(ID)
+            sentiment_indexes[threshold] = rating_masks(ratings_array(review_metadata), threshold)
+    return sentiment_indexes[threshold]
+
+def in_index(index, result):
+    ''' Vectorized membership of each result ID in a boolean index '''
+    result = np.asarray(result, dtype=np.int64)
+    inside = result < len(index)
+    member = np.zeros(len(result), dtype=bool)
+    member[inside] = index[result[inside]]
+    return member
 
 def determine_positivity(opinion):
     ''' Categorize the opinion as positive or negative using the opinion lexicon '''
@@ -52,31 +221,49 @@ def determine_positivity(opinion):
         return None
 
 def get_indices(term):
-    ''' Retrieve the set of indices for a term from the postings list. '''
-    return set(postings_list.get(term, []))
+    ''' Retrieve the sorted array of indices for a term from the postings list. '''
+    if hasattr(postings_list, "get_postings"):
+        return postings_list.get_postings(term)
+    return as_postings(postings_list.get(term, []))
 
 # Method 1: OR operation on all terms
 def method1(aspect1, aspect2, opinion):
-    return list(get_indices(aspect1) | get_indices(aspect2) | get_indices(opinion))
+    return query_engine.execute(method_expression("method1", aspect1, aspect2, opinion)).tolist()
 
 # Method 2: AND operation on all terms
 def method2(aspect1, aspect2, opinion):
-    return list(get_indices(aspect1) & get_indices(aspect2) & get_indices(opinion))
+    return query_engine.execute(method_expression("method2", aspect1, aspect2, opinion)).tolist()
 
 # Method 3: OR on aspects, AND with opinion
 def method3(aspect1, aspect2, opinion):
-    return list((get_indices(aspect1) | get_indices(aspect2)) & get_indices(opinion))
-
-def M1_rating_search(positivity, result):
+    return query_engine.execute(method_expression("method3", aspect1, aspect2, opinion)).tolist()
+
+def query_search(query):
+    ''' Run a free-form boolean query, e.g. (battery OR charge) AND (life NEAR/3 short) AND NOT refund '''
+    return query_engine.execute(parse(query)).tolist()
+
+def query_polarity(opinion=None, query=None):
+    ''' Polarity of a query: from the opinion when given, otherwise from the free-form query's words '''
+    return determine_positivity(opinion) if opinion is not None else query_positivity(query or "")
+
+def query_positivity(query):
+    ''' Polarity of the first lexicon word among a query's non-negated terms (None if it has none) '''
+    for term in positive_terms(parse(query)):
+        positivity = determine_positivity(term)
+        if positivity is not None:
+            return positivity
+    return None
+
+def M1_mask(positivity, result, threshold=RATING_THRESHOLD):
+    ''' Which reviews of result have a rating agreeing with the opinion's polarity '''
+    positive_index, negative_index = populate_sentiment_indexes(threshold)
+    index = positive_index if positivity else negative_index
+    return in_index(index, result)
+
+def M1_rating_search(positivity, result, threshold=RATING_THRESHOLD):
     ''' Filter for positive/negative review ratings using opinion lexicon '''
-    if positivity:
-        result_index = set(result)
-        return list(result_index & positive_index)
-    elif not positivity:
-        result_index = set(result)
-        return list(result_index & negative_index)
-    else:
-        return result
+    result = np.asarray(result, dtype=np.int64)
+    return result[M1_mask(positivity, result, threshold)].tolist()
     
 def M2_classifier(result, review_metadata, positivity, tfidf, model):
     """
@@ -85,58 +272,194 @@ def M2_classifier(result, review_metadata, positivity, tfidf, model):
         result (list): List of review IDs from the baseline Boolean search.
         review_metadata (dict): Metadata dictionary with review text.
         positivity (bool): Polarity of the query's opinion (True = positive, False = negative).
-        tfidf: Pre-trained TF-IDF vectorizer.
-        model: Pre-trained sentiment classification model.
+        tfidf: Pre-trained TF-IDF vectorizer (None with a SentimentScorer model).
+        model: Pre-trained sentiment classification model, or the SentimentScorer exported from it.
     Returns:
         list: Refined list of review IDs matching the query's sentiment.
     """
-    # Preprocess the review texts for the given IDs
-    review_texts = [review_metadata[ID]["text"] for ID in result]
-
-    # Transform the texts into the TF-IDF feature space
-    vectorized_texts = tfidf.transform(review_texts)
-
-    # Predict sentiment for each review
-    sentiments = model.predict(vectorized_texts)
-
-    # Filter results based on query sentiment
-    filtered_results = [
-        ID for ID, sentiment in zip(result, sentiments)
-        if (positivity and sentiment == 1) or (not positivity and sentiment == 0)
-    ]
-    return filtered_results
+    result = np.asarray(result, dtype=np.int64)
+    return result[M2_mask(positivity, result, review_metadata, tfidf, model)].tolist()
+
+def M2_mask(positivity, result, review_metadata, tfidf, model):
+    ''' Which reviews of result the classifier labels with the opinion's polarity '''
+    return classifier_sentiments(result, review_metadata, tfidf, model) == (1 if positivity else 0)
+
+def cached_sentiments(result, review_metadata):
+    ''' Cached classifier label of each review, -1 where it has to be scored on the fly '''
+    result = np.asarray(result, dtype=np.int64)
+    sentiments = np.full(len(result), -1, dtype=np.int64)
+    if prediction_cache is not None:
+        predictions = prediction_cache[0]
+        cached = result < len(predictions)
+        sentiments[cached] = predictions[result[cached]]
+        # Reviews appended through segments are not in the cache
+        if hasattr(review_metadata, "appended"):
+            sentiments[review_metadata.appended(result)] = -1
+    return sentiments
+
+def featurize(texts, tfidf):
+    ''' The model's input for texts: TF-IDF features, or the texts themselves for a SentimentScorer (tfidf None) '''
+    return texts if tfidf is None else tfidf.transform(texts)
+
+def classifier_sentiments(result, review_metadata, tfidf, model):
+    ''' Classifier label (1 = positive, 0 = negative) of each review, from the cache or scored on the fly '''
+    result = np.asarray(result, dtype=np.int64)
+    sentiments = cached_sentiments(result, review_metadata)
+
+    # Score the remaining reviews on the fly
+    missing = np.flatnonzero(sentiments < 0)
+    if len(missing):
+        # Preprocess the review texts for the given IDs
+        review_texts = [review_metadata[ID]["text"] for ID in result[missing].tolist()]
+
+        # Transform the texts into the TF-IDF feature space
+        vectorized_texts = featurize(review_texts, tfidf)
+
+        # Predict sentiment for each review
+        sentiments[missing] = model.predict(vectorized_texts)
+    return sentiments
+
+def classifier_probabilities(result):
+    ''' Positive-class probability of each review, from the prediction cache or scored on the fly '''
+    result = np.asarray(result, dtype=np.int64)
+    probabilities = np.full(len(result), np.nan)
+    if prediction_cache is not None:
+        cached_probabilities = prediction_cache[1]
+        cached = result < len(cached_probabilities)
+        probabilities[cached] = cached_probabilities[result[cached]]
+        if hasattr(review_metadata, "appended"):
+            probabilities[review_metadata.appended(result)] = np.nan
+    missing = np.flatnonzero(np.isnan(probabilities))
+    if len(missing):
+        review_texts = [review_metadata[ID]["text"] for ID in result[missing].tolist()]
+        positive_column = list(model.classes_).index(1)
+        probabilities[missing] = model.predict_proba(featurize(review_texts, tfidf))[:, positive_column]
+    return probabilities
+
+def rank_result(terms, result, positivity, top_k=DEFAULT_TOP_K, classifier_boost=0.0, ratio_boost=0.0, collection_stats=None):
+    """
+    Ranks a Boolean result with BM25 over the query terms, keeping only the top-k.
+    Args:
+        terms (list): Query terms to score.
+        result (list): Review IDs from the baseline Boolean search; only these are ranked.
+        positivity (bool): Polarity of the opinion; the boosts reward agreeing with it.
+        top_k (int): Number of reviews to return.
+        classifier_boost (float): Weight of the M2 classifier probability in the score.
+        ratio_boost (float): Weight of the M3 lexicon ratio in the score.
+        collection_stats (dict): num_reviews, avg_doc_length and doc_freqs of the whole corpus,
+            used instead of this index's own when it is one shard of it.
+    Returns:
+        tuple: Review IDs and scores, best first.
+    """
+    boosts = []
+    if positivity is not None:
+        # Probability/ratio of agreeing with the opinion; reviews without lexicon words are neutral
+        agree = (lambda values: values) if positivity else (lambda values: 1 - values)
+        boosts.append((classifier_boost, lambda ids: agree(classifier_probabilities(ids))))
+        boosts.append((ratio_boost, lambda ids: agree(np.nan_to_num(get_ratios(ids), nan=0.5))))
+    if collection_stats is not None:
+        bm25 = BM25Ranker(postings_list, review_doc_lengths, collection_stats["num_reviews"],
+                          collection_stats["avg_doc_length"], doc_freqs=collection_stats["doc_freqs"])
+    else:
+        bm25 = get_ranker()
+    with search_metrics.span("rank", len(result)) as span:
+        ranked_result, ranked_scores = bm25.top_k(terms, top_k, restrict=as_postings(result), boosts=boosts)
+        span.output(len(ranked_result))
+    return ranked_result, ranked_scores
+
+def M3_mask(positivity, result):
+    ''' Which reviews of result have a positive word ratio agreeing with the opinion's polarity '''
+    ratios = get_ratios(np.asarray(result, dtype=np.int64))
+    with np.errstate(invalid="ignore"):
+        return ratios > 0.5 if positivity else ratios <= 0.5
 
 def M3_ratio_filter(positivity, result):
     ''' Calculate a Positive/Negative word ratio for each review, filtering matching reviews with undesireable ratios '''
-    ratioed_result = []
-    for ID in result:
-        review_text = review_metadata[ID]["text"]
-        ratio = get_ratioed(review_text)
-        if positivity and ratio is not None and ratio > 0.5:
-            ratioed_result.append(ID)
-        elif not positivity and ratio is not None and ratio <= 0.5:
-            ratioed_result.append(ID)
+    result = np.asarray(result, dtype=np.int64)
+    ratioed_result = result[M3_mask(positivity, result)]
 
     if len(ratioed_result) > 0:
-        return ratioed_result
+        return ratioed_result.tolist()
     else:
-        return result
+        return result.tolist()
+
+def get_ratios(result):
+    ''' Positive word ratio of each review in result (NaN when it has no lexicon words), from the index-time counts when current '''
+    positive = np.full(len(result), -1, dtype=np.int64)
+    negative = np.full(len(result), -1, dtype=np.int64)
+    if has_lexicon_counts:
+        positive, negative = review_metadata.lexicon_counts(result)
+
+    # Count any review without precomputed counts the slow way
+    for i in np.flatnonzero(positive < 0):
+        positive[i], negative[i] = lexicon.count(review_metadata[int(result[i])]["text"])
+
+    total = positive + negative
+    ratios = np.full(len(result), np.nan)
+    np.divide(positive, total, out=ratios, where=total > 0)
+    return ratios
 
 def get_ratioed(review_text):
     ''' M3 helper function that calculates the positive word to negative word ratio in a single review'''
-    # Tokenize and Count
-    words = re.findall(r'\b\w+\b', review_text.lower())
-    positive_count = sum(1 for word in words if word in positive_words)
-    negative_count = sum(1 for word in words if word in negative_words)
-    
-    # Calculate ratio
-    total_count = positive_count + negative_count
-    if total_count == 0:
-        return None  # No sentiment words found
-    return positive_count / total_count
+    # None when no sentiment words are found
+    return lexicon.ratio(review_text)
+
+def uncounted_reviews(result):
+    ''' Number of reviews in result without index-time lexicon counts (M3 tokenizes those) '''
+    if not has_lexicon_counts:
+        return len(result)
+    return int((review_metadata.lexicon_counts(result)[0] < 0).sum())
+
+# Relative cost per review of each filter: array lookups are cheap, tokenizing a review
+# for M3 or running it through the TF-IDF vectorizer and model for M2 are not
+COST_LOOKUP = 1
+COST_TOKENIZE = 50
+COST_CLASSIFY = 500
+
+def relevance_pipeline(positivity, threshold=RATING_THRESHOLD):
+    ''' M1, M2 and M3 as pipeline stages whose costs reflect what is cached for the given reviews '''
+    return FilterPipeline([
+        FilterStage(
+            "M1_result",
+            lambda ids: M1_mask(positivity, ids, threshold),
+            lambda ids: COST_LOOKUP * len(ids),
+        ),
+        FilterStage(
+            "M2_result",
+            lambda ids: M2_mask(positivity, ids, review_metadata, tfidf, model),
+            lambda ids: COST_LOOKUP * len(ids) + COST_CLASSIFY * int((cached_sentiments(ids, review_metadata) < 0).sum()),
+        ),
+        FilterStage(
+            "M3_result",
+            lambda ids: M3_mask(positivity, ids),
+            lambda ids: 2 * COST_LOOKUP * len(ids) + COST_TOKENIZE * uncounted_reviews(ids),
+            keep_all_if_none=True,
+        ),
+    ])
+
+def run_relevance_pipeline(positivity, result, threshold=RATING_THRESHOLD):
+    ''' relevance_pipeline(...).run(result), recording the whole run and each stage it ran in the metrics '''
+    with search_metrics.span("pipeline", len(result)) as span:
+        combined_result, trace = relevance_pipeline(positivity, threshold).run(result)
+        span.output(len(combined_result))
+    for step in trace:
+        search_metrics.observe(step["stage"], step["elapsed"], step["input"], step["output"])
+    return combined_result, trace
+
+def snippet_column(terms):
+    ''' Exporter column of snippets (with highlights wrapped in **) for one page of IDs at a time '''
+    return lambda ids: [highlight(snippet) for snippet in make_snippets(postings_list, review_metadata, terms, ids)]
+
+def method_flags(positivity, threshold=RATING_THRESHOLD):
+    ''' Per-review M1/M2/M3 verdicts for the exporter, evaluated one page of IDs at a time '''
+    return {
+        "M1": lambda ids: M1_mask(positivity, ids, threshold),
+        "M2": lambda ids: M2_mask(positivity, ids, review_metadata, tfidf, model),
+        "M3": lambda ids: M3_mask(positivity, ids),
+    }
 
 def combine_methods(result1, result2, result3):
-    return list(set(result1) & set(result2) & set(result3))
+    return intersect_many([as_postings(result1), as_postings(result2), as_postings(result3)]).tolist()
 
 def diagnostic(result, M1_result, M2_result, M3_result, combined_result, print_raw:bool=False):
     if print_raw:
@@ -147,78 +470,452 @@ def diagnostic(result, M1_result, M2_result, M3_result, combined_result, print_r
     print(f"Length of M3_result: {len(M3_result)}")
     print(f"Length of combined result: {len(combined_result)}")
 
-def main():
-
-    parser = argparse.ArgumentParser(description="Perform the boolean search.")
-
-    parser.add_argument("-a1", "--aspect1", type=str, required=True, default=None, help="First word of the aspect")
-    parser.add_argument("-a2", "--aspect2", type=str, required=True, default=None, help="Second word of the aspect")
-    parser.add_argument("-o", "--opinion", type=str, required=True, default=None, help="Only word of the opinion")
-    parser.add_argument("-m", "--method", type=str, required=True, default=None, help="The method of boolean operation. Methods\
-                        can be method1, method2 or method3")
-
-    # Parse the arguments
-    args = parser.parse_args()
+def pipeline_diagnostic(result, trace, combined_result):
+    ''' Per-stage report of a lazy pipeline run: each stage's input and output, in the order they ran '''
+    print(f"Length of Baseline: {len(result)}")
+    for step in trace:
+        print(f"{step['stage']}: {step['input']} -> {step['output']} ({step['elapsed'] * 1000:.1f} ms)")
+    print(f"Length of combined result: {len(combined_result)}")
 
-    # Populate positive/negative indexes
-    populate_sentiment_indexes()
+@search_metrics.timed("query")
+def run_query(aspect1=None, aspect2=None, opinion=None, method=None, phrase=False, near=None, rating_threshold=RATING_THRESHOLD, query=None,
+              top_k=None, classifier_boost=0.0, ratio_boost=0.0, stage_outputs=False, snippets=False,
+              expand=None, expand_limit=None, expansion=None, collection_stats=None):
+    """
+    Runs one aspect/opinion query, or a free-form boolean query, through the baseline Boolean search and M1/M2/M3.
+    With a sharded index, the query runs on every shard in parallel (see run_sharded_query).
+    Args:
+        aspect1 (str): First word of the aspect.
+        aspect2 (str): Second word of the aspect.
+        opinion (str): Only word of the opinion.
+        method (str): method1, method2 or method3.
+        phrase (bool): Require aspect1 and aspect2 as an exact phrase.
+        near (int): Require the opinion within this many words of the aspect.
+        rating_threshold (int): Ratings above this count as positive in M1.
+        query (str): Free-form boolean query replacing method; its polarity comes from opinion
+            when given, otherwise from the first lexicon word in the query.
+        top_k (int): Also rank the baseline result with BM25 and return its top_k reviews.
+        classifier_boost (float): Weight of the M2 classifier probability in the ranking.
+        ratio_boost (float): Weight of the M3 lexicon ratio in the ranking.
+        stage_outputs (bool): Run each of M1/M2/M3 on the whole baseline and return their
+            outputs, instead of the cheaper lazy pipeline.
+        snippets (bool): Also return a snippet with highlight offsets for every final hit
+            (the ranked result with top_k, otherwise the combined result).
+        expand (str): OR the opinion with more same-polarity words: "lexicon" (lexicon words
+            found in the index) or "cooccurrence" (the lexicon words co-occurring most with it).
+        expand_limit (int): Most words the expansion adds.
+        expansion (list): Words to OR with the opinion, instead of choosing them with expand.
+        collection_stats (dict): Corpus-wide BM25 statistics for ranking a shard (see rank_result).
+    Returns:
+        dict: Review ID lists keyed by stage: result and combined_result, plus the pipeline trace
+            (stage, input, output, cost, elapsed) or, with stage_outputs, M1_result, M2_result and
+            M3_result; with top_k, also ranked_result and the aligned ranked_scores; with snippets,
+            snippets: one dict (ID, snippet, highlights) per final hit; with expand, expansion:
+            the words ORed with the opinion.
+    Raises:
+        ValueError: For an unsupported method, a malformed query, phrase/near without a positional index,
+            or an expansion that does not apply.
+    """
+    # Pick up regenerated artifacts (and drop every cached result) before answering
+    refresh_search_artifacts()
+    if shard_coordinator is not None:
+        return run_sharded_query(
+            aspect1=aspect1, aspect2=aspect2, opinion=opinion, method=method, phrase=phrase, near=near,
+            rating_threshold=rating_threshold, query=query, top_k=top_k, classifier_boost=classifier_boost,
+            ratio_boost=ratio_boost, stage_outputs=stage_outputs, snippets=snippets, expand=expand,
+            expand_limit=expand_limit, expansion=expansion
+        )
 
     # Bool that records the polarity of the opinion
-    positivity = determine_positivity(args.opinion)
+    positivity = query_polarity(opinion, query)
 
     ''' Baseline '''
-    if args.method.lower() == "method1":
-        result = method1(args.aspect1, args.aspect2, args.opinion)
-    elif args.method.lower() == "method2":
-        result = method2(args.aspect1, args.aspect2, args.opinion)
-    elif args.method.lower() == "method3":
-        result = method3(args.aspect1, args.aspect2, args.opinion)
+    if query is not None:
+        expression = parse(query)
+    elif method is None:
+        raise ValueError("Either a method or a query is required")
     else:
-        print("\n!! The method is not supported !!\n")
-        return
+        expression = method_expression(method.lower(), aspect1, aspect2, opinion)
+    positional = query is None and (phrase or near is not None)
+
+    # Opinion expansion: the same method with the opinion ORed with similar words
+    if expand is not None or expansion is not None:
+        if query is not None or positional:
+            raise ValueError("Opinion expansion applies to the aspect/opinion methods without --phrase/--near")
+        if expansion is None:
+            expansion = measured("expand", lambda: expand_opinion(postings_list, opinion, positivity, lexicon, expand, expand_limit))
+        expression = method_expression(method.lower(), aspect1, aspect2, opinion, expansion)
+    if positional and not getattr(postings_list, "has_positions", False):
+        raise ValueError("--phrase and --near need posting_list.idx built with token positions")
+
+    # Results are cached per normalized query, so reordered or repeated queries reuse earlier work
+    baseline_key = (repr(canonical(expression)), (aspect1, aspect2, opinion, phrase, near) if positional else None)
+
+    def baseline():
+        with search_metrics.span("boolean") as span:
+            result = query_engine.execute(expression).tolist()
+            # Narrow the baseline with phrase/proximity matching before the sentiment filters
+            if positional:
+                result = positional_filter(postings_list, result, aspect1, aspect2, opinion, phrase, near)
+            span.output(len(result))
+        return as_postings(result)
+
+    result = result_cache.get_or_compute(("baseline", baseline_key), baseline).tolist()
     
-    ''' M1: 4.2: Boolean and Rating Search '''
-    M1_result = M1_rating_search(positivity, result)
+    if stage_outputs:
+        ''' M1: 4.2: Boolean and Rating Search '''
+        M1_result = result_cache.get_or_compute(
+            ("M1", baseline_key, positivity, rating_threshold),
+            lambda: measured("M1_result", lambda: as_postings(M1_rating_search(positivity, result, rating_threshold)), len(result))
+        ).tolist()
+
+        ''' M2: 4.3: Modeling Linguistic Relevance using Classification '''
+        M2_result = result_cache.get_or_compute(
+            ("M2", baseline_key, positivity),
+            lambda: measured("M2_result", lambda: as_postings(M2_classifier(result, review_metadata, positivity, tfidf, model)), len(result))
+        ).tolist()
+
+        ''' M3: 4.4(b): Grammar and Structure Based Relevance using Review Title and Sentence Structure '''
+        M3_result = result_cache.get_or_compute(
+            ("M3", baseline_key, positivity),
+            lambda: measured("M3_result", lambda: as_postings(M3_ratio_filter(positivity, result)), len(result))
+        ).tolist()
+
+        ''' M1 + M3: AND operation: M1_result AND M2_result AND M3_result '''
+        combined_result = measured("combine", lambda: combine_methods(M1_result, M2_result, M3_result), len(result))
+        results = {
+            "result": result,
+            "M1_result": M1_result,
+            "M2_result": M2_result,
+            "M3_result": M3_result,
+            "combined_result": combined_result,
+        }
+    else:
+        ''' M1 AND M2 AND M3, cheapest filter first on the shrinking survivor set '''
+        combined_result, trace = result_cache.get_or_compute(
+            ("combined", baseline_key, positivity, rating_threshold),
+            lambda: run_relevance_pipeline(positivity, result, rating_threshold)
+        )
+        results = {
+            "result": result,
+            "combined_result": combined_result.tolist(),
+            "pipeline": trace,
+        }
+
+    ''' Ranked: BM25 top-k of the baseline, optionally boosted by M2/M3 '''
+    if top_k is not None:
+        ranked_result, ranked_scores = result_cache.get_or_compute(
+            ("ranked", baseline_key, positivity, top_k, classifier_boost, ratio_boost, collection_stats is not None),
+            lambda: rank_result(positive_terms(expression), result, positivity, top_k, classifier_boost, ratio_boost, collection_stats)
+        )
+        results["ranked_result"] = ranked_result.tolist()
+        results["ranked_scores"] = ranked_scores.tolist()
+
+    ''' Snippets: a window around the query terms of each final hit '''
+    if snippets:
+        hits = results.get("ranked_result", results["combined_result"])
+        results["snippets"] = measured("snippets", lambda: make_snippets(postings_list, review_metadata, positive_terms(expression), hits), len(hits))
+    if expand is not None:
+        results["expansion"] = expansion
+    return results
+
+def shard_search(metrics=None, **query):
+    """
+    run_query on this worker's shard, plus whether any of the shard's baseline passes M3 (M3_passes).
+    Args:
+        metrics (tuple): The coordinator's (stages, trace_memory) when it records metrics, so this
+            worker records its own stages too (collected by collect_shard_metrics).
+        **query: run_query's arguments.
+    """
+    if metrics is not None and not search_metrics.enabled:
+        search_metrics.enable(*metrics)
+    results = run_query(**query)
+    result = results["result"]
+    positivity = query_polarity(query.get("opinion"), query.get("query"))
+    # M3 dropping some of its input settles it; otherwise (kept all, or never ran) check the baseline
+    if "M3_result" in results:
+        settled = len(results["M3_result"]) < len(result)
+    else:
+        settled = any(step["stage"] == "M3_result" and step["output"] < step["input"] for step in results["pipeline"])
+    results["M3_passes"] = bool(result) and (settled or bool(M3_mask(positivity, as_postings(result)).any()))
+    return results
+
+def shard_statistics(terms=(), opinion=None, words=()):
+    """
+    This shard's share of the collection statistics a sharded search needs.
+    Args:
+        terms (list): Terms whose document frequencies are wanted (BM25, lexicon expansion).
+        opinion (str): Opinion whose co-occurrence with words is wanted (cooccurrence expansion).
+        words (list): Candidate expansion words.
+    Returns:
+        dict: num_reviews, total_length, doc_freqs, opinion_freq and cooccurrence (see sharding.merge_statistics).
+    """
+    refresh_search_artifacts()
+    bm25 = get_ranker()
+    opinion_freq, cooccurrence = cooccurrence_counts(postings_list, opinion, words) if opinion is not None else (0, {})
+    return {
+        "num_reviews": bm25.num_reviews,
+        "total_length": bm25.avg_doc_length * bm25.num_reviews,
+        "doc_freqs": {term: postings_list.doc_freq(term) for term in terms},
+        "opinion_freq": opinion_freq,
+        "cooccurrence": cooccurrence,
+    }
+
+def gather_statistics(**kwargs):
+    ''' shard_statistics(**kwargs) of every shard, summed '''
+    with search_metrics.span("shard_statistics"):
+        return sharding.merge_statistics(shard_coordinator.scatter("shard_statistics", **kwargs))
+
+def collect_metrics():
+    ''' This process's recorded metrics, reset afterwards (see Metrics.collect) '''
+    return search_metrics.collect()
+
+def collect_shard_metrics():
+    ''' Merge what every shard worker recorded into search_metrics, as "shard:<stage>" '''
+    if shard_coordinator is None or not search_metrics.enabled:
+        return
+    for state in shard_coordinator.scatter("collect_metrics"):
+        search_metrics.merge({f"shard:{stage}": histograms for stage, histograms in state.items()})
+
+def run_sharded_query(**query):
+    """
+    Scatter-gather run_query over the shards: every shard runs the Boolean step and M1/M2/M3 on
+    its own reviews in its worker process, and the sorted outputs are merged. Expansion words
+    and BM25 statistics are computed over the whole corpus first and sent to every shard.
+    Args:
+        **query: run_query's arguments.
+    Returns:
+        dict: The same output run_query gives for an unsharded index.
+    """
+    expand, expansion = query.pop("expand"), query.pop("expansion")
+    expand_limit = query.pop("expand_limit")
+    method, opinion = query["method"], query["opinion"]
+
+    if expand is not None and expansion is None:
+        if query["query"] is not None or query["phrase"] or query["near"] is not None:
+            raise ValueError("Opinion expansion applies to the aspect/opinion methods without --phrase/--near")
+        words = sorted(expansion_candidates(opinion, query_polarity(opinion, None), lexicon, expand))
+        if expand == "lexicon":
+            statistics = gather_statistics(terms=words)
+            expansion = lexicon_expansion(statistics["doc_freqs"], opinion, expand_limit)
+        else:
+            statistics = gather_statistics(opinion=opinion, words=words)
+            limit = DEFAULT_NEIGHBOURS if expand_limit is None else expand_limit
+            expansion = nearest_neighbours(statistics["opinion_freq"], statistics["cooccurrence"], limit)
+
+    collection_stats = None
+    if query["top_k"] is not None:
+        if query["query"] is not None:
+            expression = parse(query["query"])
+        elif method is None:
+            raise ValueError("Either a method or a query is required")
+        else:
+            expression = method_expression(method.lower(), query["aspect1"], query["aspect2"], opinion, expansion or ())
+        statistics = gather_statistics(terms=positive_terms(expression))
+        collection_stats = {
+            "num_reviews": statistics["num_reviews"],
+            "avg_doc_length": statistics["total_length"] / max(statistics["num_reviews"], 1),
+            "doc_freqs": statistics["doc_freqs"],
+        }
+
+    metrics = (search_metrics.stages, search_metrics.trace_memory) if search_metrics.enabled else None
+    with search_metrics.span("shard_search"):
+        shard_results = shard_coordinator.scatter(
+            "shard_search", metrics=metrics, expansion=expansion, collection_stats=collection_stats, **query
+        )
+    with search_metrics.span("merge"):
+        results = sharding.merge_shard_results(shard_results, query["top_k"])
+    if expand is not None or expansion is not None:
+        results["expansion"] = expansion
+    return results
+
+# Snippets printed by the CLI (every hit still gets one in --export and in run_query's output)
+SNIPPETS_SHOWN = 10
+
+# Expansion words printed by the CLI
+EXPANSION_SHOWN = 20
+
+def export_terms(args, results):
+    ''' The terms to highlight for the CLI's query, including any opinion expansion '''
+    if args.query is not None:
+        return positive_terms(parse(args.query))
+    expansion = results.get("expansion", [])
+    return positive_terms(method_expression(args.method.lower(), args.aspect1, args.aspect2, args.opinion, expansion))
+
+def add_metrics_arguments(parser):
+    ''' The metrics flags shared by this CLI, batch_query.py and query_server.py '''
+    parser.add_argument("--metrics-json", type=str, default=None, help="Record per-stage latency and candidate-set\
+                        histograms and write them to this JSON report")
+    parser.add_argument("--metrics-prom", type=str, default=None, help="Also write them in Prometheus text format to this file")
+    parser.add_argument("--metrics-stages", type=str, default=None, help=f"Comma-separated stages to record (default all):\
+                        {', '.join(METRIC_STAGES)}")
+    parser.add_argument("--trace-memory", action="store_true", help="Also record each stage's peak memory (tracemalloc, slower)")
+
+def parse_metric_stages(text):
+    ''' The stages named in a comma-separated --metrics-stages value (None, for all, when empty) '''
+    if not text:
+        return None
+    stages = [stage.strip() for stage in text.split(",") if stage.strip()]
+    unknown = set(stages) - set(METRIC_STAGES)
+    if unknown:
+        raise ValueError(f"Unknown metrics stages {sorted(unknown)}: use {', '.join(METRIC_STAGES)}")
+    return stages
+
+def write_metrics(args):
+    ''' Write the reports the metrics flags ask for, including what shard workers recorded '''
+    collect_shard_metrics()
+    if args.metrics_json:
+        search_metrics.write_json(args.metrics_json)
+        print(f"Metrics report saved to {args.metrics_json}")
+    if args.metrics_prom:
+        search_metrics.write_prometheus(args.metrics_prom)
+        print(f"Prometheus metrics saved to {args.metrics_prom}")
+
+def output_name(args):
+    ''' Base name of the result file: aspect1_aspect2_opinion_method, or query_<terms> for --query, plus _<expansion> and _top<K> '''
+    if args.query is not None:
+        name = "query_" + "_".join(re.findall(r'\w+', args.query))
+    else:
+        name = f"{args.aspect1}_{args.aspect2}_{args.opinion}_{args.method}"
+    if getattr(args, "expand", None) is not None:
+        name += f"_{args.expand}"
+    if getattr(args, "top_k", None) is not None:
+        name += f"_top{args.top_k}"
+    return name
 
-    ''' M2: 4.3: Modeling Linguistic Relevance using Classification '''
-    M2_result = M2_classifier(result, review_metadata, positivity, tfidf, model)
+def main():
 
-    ''' M3: 4.4(b): Grammar and Structure Based Relevance using Review Title and Sentence Structure '''
-    M3_result = M3_ratio_filter(positivity, result)
+    parser = argparse.ArgumentParser(description="Perform the boolean search.")
 
-    ''' M1 + M3: AND operation: M1_result AND M2_result AND M3_result '''
-    combined_result = combine_methods(M1_result, M2_result, M3_result)
+    parser.add_argument("-a1", "--aspect1", type=str, required=False, default=None, help="First word of the aspect")
+    parser.add_argument("-a2", "--aspect2", type=str, required=False, default=None, help="Second word of the aspect")
+    parser.add_argument("-o", "--opinion", type=str, required=False, default=None, help="Only word of the opinion")
+    parser.add_argument("-m", "--method", type=str, required=False, default=None, help="The method of boolean operation. Methods\
+                        can be method1, method2 or method3")
+    parser.add_argument("-q", "--query", type=str, default=None, help="Boolean query instead of aspects/method, e.g.\
+                        '(battery OR charge) AND (life NEAR/3 short) AND NOT refund'")
+    parser.add_argument("--phrase", action="store_true", help="Require aspect1 and aspect2 as an exact phrase")
+    parser.add_argument("--near", type=int, default=None, help="Require the opinion within N words of the aspect")
+    parser.add_argument("--rating-threshold", type=int, default=RATING_THRESHOLD, help="Ratings above this count as positive in M1")
+    parser.add_argument("--top-k", type=int, default=None, help="Rank the baseline with BM25 and keep only the K best reviews")
+    parser.add_argument("--classifier-boost", type=float, default=0.0, help="Weight of the M2 classifier probability in the --top-k ranking")
+    parser.add_argument("--ratio-boost", type=float, default=0.0, help="Weight of the M3 lexicon ratio in the --top-k ranking")
+    parser.add_argument("--all-stages", action="store_true", help="Run M1, M2 and M3 on the whole baseline for the per-stage diagnostic (slower)")
+    parser.add_argument("--export", type=str, default=None, help="Also stream the final result with ratings, texts and\
+                        M1/M2/M3 flags to a .jsonl, .csv or .parquet file")
+    parser.add_argument("--page-size", type=int, default=PAGE_SIZE, help="Reviews per page written by --export")
+    parser.add_argument("--snippets", action="store_true", help="Show a highlighted snippet around the query terms of each hit\
+                        (and add it to --export)")
+    parser.add_argument("--expand", type=str, choices=EXPANSION_MODES, default=None, help="Also match same-polarity words of\
+                        the opinion: every lexicon word in the index, or the lexicon words co-occurring with it most")
+    parser.add_argument("--expand-limit", type=int, default=None, help="Most words --expand adds to the opinion")
+    parser.add_argument("--server", type=str, default=None, help="URL of a running query_server.py; skips loading the artifacts locally")
+    add_metrics_arguments(parser)
+
+    # Parse the arguments
+    args = parser.parse_args()
+    if args.query is None and None in (args.aspect1, args.aspect2, args.opinion, args.method):
+        parser.error("--aspect1, --aspect2, --opinion and --method are required unless --query is given")
+    if args.export and args.server:
+        parser.error("--export reads review texts locally and cannot be combined with --server")
+    if (args.metrics_json or args.metrics_prom) and args.server:
+        parser.error("--metrics-json/--metrics-prom time the local search; use the server's /metrics instead")
+    try:
+        metric_stages = parse_metric_stages(args.metrics_stages)
+    except ValueError as e:
+        parser.error(str(e))
+    query = dict(
+        aspect1=args.aspect1, aspect2=args.aspect2, opinion=args.opinion, method=args.method,
+        phrase=args.phrase, near=args.near, rating_threshold=args.rating_threshold, query=args.query,
+        top_k=args.top_k, classifier_boost=args.classifier_boost, ratio_boost=args.ratio_boost,
+        stage_outputs=args.all_stages, snippets=args.snippets, expand=args.expand, expand_limit=args.expand_limit
+    )
+
+    try:
+        if args.server:
+            # Thin client: the server already holds every artifact in memory
+            results = query_client.search(args.server, **query)
+        else:
+            if args.metrics_json or args.metrics_prom:
+                search_metrics.enable(metric_stages, args.trace_memory)
+            load_search_artifacts()
+            results = run_query(**query)
+    except ValueError as e:
+        print(f"\n!! {e} !!\n")
+        return
+    result, combined_result = results["result"], results["combined_result"]
+    if "expansion" in results:
+        expansion = results["expansion"]
+        shown = ", ".join(expansion[:EXPANSION_SHOWN]) + (", ..." if len(expansion) > EXPANSION_SHOWN else "")
+        print(f"Opinion expanded with {len(expansion)} words: {shown}")
+    # Only --all-stages runs every filter on the whole baseline
+    M1_result, M2_result, M3_result = results.get("M1_result"), results.get("M2_result"), results.get("M3_result")
 
     ''' 
     Choose Method for Final Output:
     Baseline: 'result'
-    Rating Search: 'M1_result'
-    Classifier: 'M2_result'
-    Ratio Filter: 'M3_result'
+    Rating Search: 'M1_result' (--all-stages)
+    Classifier: 'M2_result' (--all-stages)
+    Ratio Filter: 'M3_result' (--all-stages)
     Combined Methods: 'combined_result' 
+    Ranked (--top-k): 'ranked_result'
     '''
-    final_result = combined_result
+    final_result = results.get("ranked_result", combined_result)
 
     # Skip file generation is diagnostic is None
     skip_diagnostic = False
     if skip_diagnostic:
         revs = pd.DataFrame()
         revs["review_index"] = final_result
-        output_filename = f"{args.aspect1}_{args.aspect2}_{args.opinion}_{args.method}.pkl"
+        if "ranked_scores" in results:
+            revs["score"] = results["ranked_scores"]
+        output_filename = output_name(args) + ".pkl"
         revs.to_pickle(output_filename)
         print(f"Results saved to {output_filename}")
     elif skip_diagnostic is not None:
         revs = pd.DataFrame()
         revs["review_index"] = final_result
-        output_filename = f"{args.aspect1}_{args.aspect2}_{args.opinion}_{args.method}.pkl"
+        if "ranked_scores" in results:
+            revs["score"] = results["ranked_scores"]
+        output_filename = output_name(args) + ".pkl"
         revs.to_pickle(output_filename)
         print(f"Results saved to {output_filename}")
-        diagnostic(result, M1_result, M2_result, M3_result, combined_result)
+        if "pipeline" in results:
+            pipeline_diagnostic(result, results["pipeline"], combined_result)
+        else:
+            diagnostic(result, M1_result, M2_result, M3_result, combined_result)
+        if "ranked_result" in results:
+            print(revs.to_string(index=False))
+    elif "pipeline" in results:
+        pipeline_diagnostic(result, results["pipeline"], combined_result)
     else:
         diagnostic(result, M1_result, M2_result, M3_result, combined_result, print_raw=False)
+    for snippet in results.get("snippets", [])[:SNIPPETS_SHOWN]:
+        print(f"{snippet['ID']}: {highlight(snippet)}")
+
+    # Per-stage timings of this query
+    if not args.server:
+        write_metrics(args)
+
+    # Stream the final result with its review data, looked up by ID a page at a time
+    if args.export:
+        try:
+            written = export_results(
+                final_result, args.export, review_metadata,
+                flags=method_flags(query_polarity(args.opinion, args.query), args.rating_threshold),
+                scores=results.get("ranked_scores"), page_size=args.page_size,
+                columns={"snippet": snippet_column(export_terms(args, results))} if args.snippets else None
+            )
+        except ValueError as e:
+            print(f"\n!! {e} !!\n")
+            return
+        print(f"Exported {written} reviews to {args.export}")
 
 if __name__ == "__main__":
     main()
+else:
+    # Imported by the query server and other tools: load everything once up front
+    load_search_artifacts()
 
 '''
 python boolean_search_help.py --aspect1 audio --aspect2 quality --opinion poor --method method1
@@ -236,4 +933,7 @@ python boolean_search_help.py --aspect1 gps --aspect2 map --opinion useful --met
 python boolean_search_help.py --aspect1 image --aspect2 quality --opinion sharp --method method1
 python boolean_search_help.py --aspect1 image --aspect2 quality --opinion sharp --method method2
 python boolean_search_help.py --aspect1 image --aspect2 quality --opinion sharp --method method3
+
+All twelve in one process (queries.csv lists them):
+python batch_query.py queries.csv -o batch_results.pkl
 '''
\ No newline at end of file
@@ -1,21 +1,41 @@
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+from itertools import compress
+import json
+import os
 import pickle
-import re
+import numpy as np
+from scipy import sparse
+import sklearn
 from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS
-from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfVectorizer
 from sklearn.model_selection import train_test_split
 from sklearn.naive_bayes import MultinomialNB
 from sklearn.metrics import accuracy_score, classification_report
 import time
+from metadata_store import ReviewStore, load_review_metadata
+from sentiment_scorer import SCORER_FILENAME, artifact_fingerprint, export_scorer, load_prediction_cache
+from sharding import ShardedReviews, load_sharded_reviews
+from text_analysis import ANALYSIS_VERSION, tokenize
 
 def prepare_labeled_data(review_metadata):
     """
     Prepares labeled data from review metadata.
     Args:
-        review_metadata (dict): Dictionary containing review text and ratings.
+        review_metadata (dict or ReviewStore): Review text and ratings.
     Returns:
         list: List of tuples (review_text, label), where label is 1 for positive and 0 for negative.
     """
     labeled_data = []
+    if isinstance(review_metadata, (ReviewStore, ShardedReviews)):
+        # Read the rating column in one go and decode only the texts of rated reviews
+        ids = review_metadata.ids()
+        ratings = review_metadata.ratings[ids]
+        for ID, rating in zip(ids[ratings >= 0].tolist(), ratings[ratings >= 0].tolist()):
+            labeled_data.append((review_metadata.text(ID), 1 if rating > 3 else 0))
+        return labeled_data
     for ID in review_metadata:
         rating = review_metadata[ID].get('customer_review_rating', None)
         text = review_metadata[ID].get('text', "")
@@ -26,6 +46,110 @@ def prepare_labeled_data(review_metadata):
                 labeled_data.append((text, 0))  # Negative
     return labeled_data
 
+# Streaming training (--streaming): reviews are read a chunk at a time and hashed into a
+# fixed feature space, so there is no vocabulary to fit first and memory does not grow with
+# the corpus. MultinomialNB only sums feature counts per class, so partial_fit over the chunks
+# learns exactly what one fit on all of them would
+STREAM_CHUNK_SIZE = 10000
+HASHING_FEATURES = 2 ** 20
+TEST_SIZE = 0.2
+# Naive Bayes smoothing per hashed feature: with a million mostly empty features, the default
+# alpha of 1 would outweigh the counts seen in training
+STREAM_ALPHA = 0.01
+CLASSES = np.array([0, 1])
+
+def held_out(ids, test_size=TEST_SIZE):
+    ''' Boolean mask of the reviews in the held-out split, decided by a hash of the review ID so it does not depend on chunking or order '''
+    hashed = (np.asarray(ids, dtype=np.uint64) * np.uint64(0x9E3779B97F4A7C15)) >> np.uint64(40)
+    return hashed < np.uint64(test_size * 2 ** 24)
+
+def iter_labeled_chunks(review_metadata, chunk_size=STREAM_CHUNK_SIZE, subset=None, test_size=TEST_SIZE):
+    """
+    Streams the labeled reviews a chunk at a time; only one chunk's texts are decoded at once.
+    Args:
+        review_metadata (dict or ReviewStore): Review text and ratings.
+        chunk_size (int): Reviews per chunk.
+        subset (str): "train" or "test" for one side of the held_out split (None for every review).
+        test_size (float): Share of reviews held out.
+    Yields:
+        tuple: List of review texts and array of labels (1 positive, 0 negative) of one chunk.
+    """
+    def selected(ids):
+        if subset is None:
+            return np.ones(len(ids), dtype=bool)
+        return held_out(ids, test_size) == (subset == "test")
+
+    if isinstance(review_metadata, (ReviewStore, ShardedReviews)):
+        # Pick the chunk's reviews from the ID and rating columns before decoding any text
+        ids = review_metadata.ids()
+        ratings = review_metadata.ratings[ids]
+        keep = (ratings >= 0) & selected(ids)
+        ids, labels = ids[keep], (ratings[keep] > 3).astype(np.int64)
+        for start in range(0, len(ids), chunk_size):
+            yield review_metadata.texts(ids[start:start + chunk_size].tolist()), labels[start:start + chunk_size]
+        return
+
+    chunk_ids, texts, labels = [], [], []
+    for ID, data in review_metadata.items():
+        rating = data.get('customer_review_rating', None)
+        if rating is None:
+            continue
+        chunk_ids.append(ID)
+        texts.append(data.get('text', ""))
+        labels.append(1 if int(rating) > 3 else 0)
+        if len(chunk_ids) == chunk_size:
+            keep = selected(chunk_ids)
+            yield list(compress(texts, keep)), np.asarray(labels, dtype=np.int64)[keep]
+            chunk_ids, texts, labels = [], [], []
+    if chunk_ids:
+        keep = selected(chunk_ids)
+        yield list(compress(texts, keep)), np.asarray(labels, dtype=np.int64)[keep]
+
+def print_confusion_report(confusion):
+    ''' Accuracy and per-class precision/recall from a 2x2 confusion matrix (rows true, columns predicted) '''
+    total = confusion.sum()
+    print("Accuracy:", confusion.trace() / total if total else float("nan"))
+    print(f"{'':>10} {'precision':>10} {'recall':>10} {'support':>10}")
+    for label, name in enumerate(("negative", "positive")):
+        predicted, support = confusion[:, label].sum(), confusion[label].sum()
+        precision = confusion[label, label] / predicted if predicted else 0.0
+        recall = confusion[label, label] / support if support else 0.0
+        print(f"{name:>10} {precision:>10.2f} {recall:>10.2f} {support:>10}")
+
+def train_streaming(review_metadata, chunk_size=STREAM_CHUNK_SIZE, n_features=HASHING_FEATURES, test_size=TEST_SIZE):
+    """
+    Trains the classifier out of core: one pass over the training split, partial_fit per chunk,
+    then one pass over the held-out split to report its accuracy.
+    Args:
+        review_metadata (dict or ReviewStore): Review text and ratings.
+        chunk_size (int): Reviews per chunk.
+        n_features (int): Size of the hashed feature space.
+        test_size (float): Share of reviews held out for evaluation.
+    Returns:
+        tuple: Trained MultinomialNB and the HashingVectorizer; they are saved and used by M2
+            exactly like the TF-IDF model and vectorizer.
+    Raises:
+        ValueError: If there are no rated reviews to train on.
+    """
+    # Raw, non-negative term counts: there is no IDF without a pass over the whole corpus
+    vectorizer = HashingVectorizer(n_features=n_features, alternate_sign=False, norm=None)
+    model = MultinomialNB(alpha=STREAM_ALPHA)
+    trained = 0
+    for texts, labels in iter_labeled_chunks(review_metadata, chunk_size, "train", test_size):
+        if len(labels):
+            model.partial_fit(vectorizer.transform(texts), labels, classes=CLASSES)
+            trained += len(labels)
+    if not trained:
+        raise ValueError("No rated reviews to train the classifier on")
+
+    confusion = np.zeros((2, 2), dtype=np.int64)
+    for texts, labels in iter_labeled_chunks(review_metadata, chunk_size, "test", test_size):
+        if len(labels):
+            np.add.at(confusion, (labels, model.predict(vectorizer.transform(texts))), 1)
+    print(f"Trained on {trained} reviews, evaluated on {confusion.sum()} held-out reviews")
+    print_confusion_report(confusion)
+    return model, vectorizer
+
 def preprocess_text(text):
     """
     Preprocesses a single review text: tokenization, lowercasing, and stopword removal.
@@ -34,7 +158,7 @@ def preprocess_text(text):
     Returns:
         str: Preprocessed text.
     """
-    tokens = re.findall(r'\b\w+\b', text.lower())
+    tokens = tokenize(text)
     tokens = [word for word in tokens if word not in ENGLISH_STOP_WORDS]
     return " ".join(tokens)
 
@@ -50,30 +174,105 @@ def preprocess_metadata(review_metadata):
         data["preprocessed_text"] = preprocess_text(data["text"])
     return review_metadata
 
-def vectorize_text(labeled_data):
+# Vectorized corpora are cached here as sparse .npz matrices plus the fitted vectorizer,
+# keyed by the labeled corpus and the vectorizer config
+FEATURE_CACHE_DIR = "feature_cache"
+
+# TF-IDF settings of the default training run (max_features None keeps every word;
+# preprocess tokenizes and drops stop words as preprocess_text does)
+VECTORIZER_CONFIG = {"max_features": 5000, "ngram_range": (1, 1), "preprocess": False}
+
+def make_vectorizer(config):
+    ''' Unfitted TfidfVectorizer for a vectorizer config '''
+    if config["preprocess"]:
+        # preprocess_text's steps inside the vectorizer, so M2 applies them to the texts it scores
+        return TfidfVectorizer(max_features=config["max_features"], ngram_range=tuple(config["ngram_range"]),
+                               tokenizer=tokenize, token_pattern=None, stop_words=sorted(ENGLISH_STOP_WORDS))
+    return TfidfVectorizer(max_features=config["max_features"], ngram_range=tuple(config["ngram_range"]))
+
+def corpus_fingerprint(labeled_data):
+    ''' Hash of the labeled texts; cached features are stale when it changes '''
+    digest = hashlib.sha1()
+    for text, label in labeled_data:
+        digest.update(text.encode("utf-8"))
+        digest.update(b"\0%d\0" % label)
+    return digest.hexdigest()
+
+def feature_cache_path(corpus_key, config, cache_dir=FEATURE_CACHE_DIR):
+    ''' Cache file (without extension) of a corpus vectorized with a config, under the libraries that shape the features '''
+    settings = dict(config, ngram_range=list(config["ngram_range"]), sklearn=sklearn.__version__, analysis=ANALYSIS_VERSION)
+    digest = hashlib.sha1(corpus_key.encode())
+    digest.update(json.dumps(settings, sort_keys=True).encode())
+    return os.path.join(cache_dir, digest.hexdigest())
+
+def save_features(path, features, labels, tfidf):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    features = sparse.csr_matrix(features)
+    np.savez(path + ".npz", data=features.data, indices=features.indices, indptr=features.indptr,
+             shape=features.shape, labels=labels)
+    # The vectorizer last: a cache entry counts only once both files exist
+    with open(path + ".pkl", "wb") as f:
+        pickle.dump(tfidf, f)
+
+def load_features(path, with_vectorizer=True):
     """
-    Vectorizes the text using TF-IDF.
+    Loads a cached feature matrix.
+    Args:
+        path (str): Cache file, as returned by feature_cache_path.
+        with_vectorizer (bool): Also unpickle the fitted vectorizer.
+    Returns:
+        tuple: Features (CSR matrix), labels and the vectorizer (None without with_vectorizer),
+            or None if the entry is not cached.
+    """
+    if not (os.path.exists(path + ".npz") and os.path.exists(path + ".pkl")):
+        return None
+    with np.load(path + ".npz") as cache:
+        features = sparse.csr_matrix((cache["data"], cache["indices"], cache["indptr"]), shape=tuple(cache["shape"]))
+        labels = cache["labels"]
+    tfidf = None
+    if with_vectorizer:
+        with open(path + ".pkl", "rb") as f:
+            tfidf = pickle.load(f)
+    return features, labels, tfidf
+
+def vectorize_text(labeled_data, config=None, cache_dir=FEATURE_CACHE_DIR, corpus_key=None):
+    """
+    Vectorizes the text using TF-IDF, or loads the result of an earlier run on the same corpus and config.
     Args:
         labeled_data (list): List of tuples (review_text, label).
+        config (dict): Vectorizer config (VECTORIZER_CONFIG by default).
+        cache_dir (str): Feature cache directory (None to neither read nor write the cache).
+        corpus_key (str): corpus_fingerprint of labeled_data, if already computed.
     Returns:
         tuple: Features, labels, and the TF-IDF vectorizer.
     """
+    config = config or VECTORIZER_CONFIG
+    if cache_dir is not None:
+        path = feature_cache_path(corpus_key or corpus_fingerprint(labeled_data), config, cache_dir)
+        cached = load_features(path)
+        if cached is not None:
+            return cached
+
     texts, labels = zip(*labeled_data)
-    tfidf = TfidfVectorizer(max_features=5000)
+    labels = np.array(labels, dtype=np.int64)
+    tfidf = make_vectorizer(config)
     features = tfidf.fit_transform(texts)
+    if cache_dir is not None:
+        save_features(path, features, labels, tfidf)
     return features, labels, tfidf
 
-def train_classifier(features, labels):
+def train_classifier(features, labels, alpha=1.0):
     """
     Trains a Naive Bayes classifier.
     Args:
         features (sparse matrix): TF-IDF features.
         labels (list): Labels corresponding to features.
+        alpha (float): Additive smoothing.
     Returns:
         MultinomialNB: Trained model.
     """
     X_train, X_test, y_train, y_test = train_test_split(features, labels, test_size=0.2, random_state=42)
-    model = MultinomialNB()
+    model = MultinomialNB(alpha=alpha)
     model.fit(X_train, y_train)
     y_pred = model.predict(X_test)
     print("Accuracy:", accuracy_score(y_test, y_pred))
@@ -101,14 +300,22 @@ def filter_results_with_classifier(model, tfidf, result_ids, review_metadata, po
         if (positivity and sentiment == 1) or (not positivity and sentiment == 0)
     ]
 
-def save_artifacts(model, tfidf, model_filename="sentiment_classifier.pkl", tfidf_filename="tfidf_vectorizer.pkl"):
+def exportable_scorer(model, tfidf):
+    ''' Whether sentiment_scorer can reproduce the model and vectorizer (a HashingVectorizer or custom analyzer cannot be) '''
+    return (type(model) is MultinomialNB and type(tfidf) is TfidfVectorizer and tfidf.analyzer == "word"
+            and tfidf.input == "content" and tfidf.preprocessor is None and tfidf.strip_accents is None
+            and tfidf.tokenizer in (None, tokenize) and np.dtype(tfidf.dtype) == np.float64)
+
+def save_artifacts(model, tfidf, model_filename="sentiment_classifier.pkl", tfidf_filename="tfidf_vectorizer.pkl",
+                   scorer_filename=SCORER_FILENAME):
     """
-    Saves the trained model and TF-IDF vectorizer to disk.
+    Saves the trained model and TF-IDF vectorizer to disk, and exports them as a NumPy scorer bundle.
     Args:
         model: The trained sentiment classification model.
         tfidf: The trained TF-IDF vectorizer.
         model_filename: The filename to save the model.
         tfidf_filename: The filename to save the vectorizer.
+        scorer_filename: The filename to save the scorer bundle.
     """
     with open(model_filename, "wb") as model_file:
         pickle.dump(model, model_file)
@@ -118,6 +325,86 @@ def save_artifacts(model, tfidf, model_filename="sentiment_classifier.pkl", tfid
         pickle.dump(tfidf, tfidf_file)
         print(f"TF-IDF vectorizer saved as '{tfidf_filename}'")
 
+    if exportable_scorer(model, tfidf):
+        tokenizer_name = "text_analysis.tokenize" if tfidf.tokenizer is tokenize else None
+        export_scorer(model, tfidf, tokenizer_name, scorer_filename, artifact_fingerprint(model_filename, tfidf_filename))
+        print(f"Scorer bundle saved as '{scorer_filename}'")
+    elif os.path.exists(scorer_filename):
+        # A bundle of an earlier model would be ignored as stale anyway
+        os.remove(scorer_filename)
+
+# Model and vectorizer of a scoring worker process, loaded once by _init_scorer
+_scorer = None
+
+def _init_scorer(model_filename, tfidf_filename):
+    global _scorer
+    with open(model_filename, "rb") as f:
+        model = pickle.load(f)
+    with open(tfidf_filename, "rb") as f:
+        tfidf = pickle.load(f)
+    _scorer = (model, tfidf)
+
+def _score_chunk(texts):
+    ''' Worker: predicted label and positive-class probability of each text '''
+    model, tfidf = _scorer
+    features = tfidf.transform(texts)
+    positive_column = list(model.classes_).index(1)
+    return model.predict(features), model.predict_proba(features)[:, positive_column]
+
+def build_prediction_cache(review_metadata, cache_filename="sentiment_cache.npz", model_filename="sentiment_classifier.pkl",
+                           tfidf_filename="tfidf_vectorizer.pkl", chunk_size=5000, workers=None):
+    """
+    Scores every review once with the saved model, in batches spread over a process pool,
+    and caches the predictions keyed by the artifacts' fingerprint. Texts are decoded a batch
+    at a time and only a few batches are in flight, so memory stays flat on large corpora.
+    Args:
+        review_metadata (dict or ReviewStore): Review texts keyed by ID.
+        cache_filename (str): Where to save the cache.
+        model_filename (str): The saved model.
+        tfidf_filename (str): The saved vectorizer.
+        chunk_size (int): Number of reviews per batch.
+        workers (int): Number of worker processes. Defaults to the CPU count; 1 runs in-process.
+    """
+    start_time = time.time()
+    if hasattr(review_metadata, "ids"):
+        ids = review_metadata.ids()
+    else:
+        ids = np.array(sorted(review_metadata.keys()), dtype=np.int64)
+    if isinstance(review_metadata, (ReviewStore, ShardedReviews)):
+        read_texts = review_metadata.texts
+    else:
+        read_texts = lambda chunk_ids: [review_metadata[ID]["text"] for ID in chunk_ids]
+    starts = range(0, len(ids), chunk_size)
+    chunks = (read_texts(ids[start:start + chunk_size].tolist()) for start in starts)
+
+    size = int(ids.max()) + 1 if len(ids) else 0
+    predictions = np.full(size, -1, dtype=np.int8)
+    probabilities = np.full(size, np.nan, dtype=np.float32)
+    def store(start, scores):
+        chunk_ids = ids[start:start + chunk_size]
+        predictions[chunk_ids], probabilities[chunk_ids] = scores
+
+    workers = workers or os.cpu_count() or 1
+    if workers > 1 and len(starts) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(starts)), initializer=_init_scorer,
+                                 initargs=(model_filename, tfidf_filename)) as executor:
+            # Keep two batches per worker in flight
+            pending = deque()
+            for start, chunk in zip(starts, chunks):
+                pending.append((start, executor.submit(_score_chunk, chunk)))
+                if len(pending) >= 2 * workers:
+                    done, future = pending.popleft()
+                    store(done, future.result())
+            for done, future in pending:
+                store(done, future.result())
+    else:
+        _init_scorer(model_filename, tfidf_filename)
+        for start, chunk in zip(starts, chunks):
+            store(start, _score_chunk(chunk))
+    np.savez(cache_filename, predictions=predictions, probabilities=probabilities,
+             fingerprint=artifact_fingerprint(model_filename, tfidf_filename))
+    print(f"Prediction cache for {len(ids)} reviews saved as '{cache_filename}' in {time.time() - start_time:.2f} seconds")
+
 def load_artifacts():
     """
     Loads the trained model and vectorizer from disk.
@@ -130,28 +417,48 @@ def load_artifacts():
         tfidf = pickle.load(f)
     return model, tfidf
 
-def main():
-    start_time = time.time()
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Train the sentiment classifier used by M2.")
+    parser.add_argument("--streaming", action="store_true",
+                        help="Train out of core: hashed features and partial_fit over chunks of reviews")
+    parser.add_argument("--chunk-size", type=int, default=STREAM_CHUNK_SIZE, help="Reviews per chunk with --streaming")
+    parser.add_argument("--n-features", type=int, default=HASHING_FEATURES, help="Hashed feature space size with --streaming")
+    parser.add_argument("--test-size", type=float, default=TEST_SIZE, help="Share of reviews held out with --streaming")
+    parser.add_argument("--alpha", type=float, default=1.0, help="Naive Bayes smoothing")
+    parser.add_argument("--max-features", type=int, default=VECTORIZER_CONFIG["max_features"],
+                        help="TF-IDF vocabulary size (0 for every word)")
+    parser.add_argument("--ngram-max", type=int, default=VECTORIZER_CONFIG["ngram_range"][1], help="Longest n-gram to use as a feature")
+    parser.add_argument("--preprocess", action="store_true", help="Drop stop words with preprocess_text before vectorizing")
+    parser.add_argument("--no-feature-cache", action="store_true", help="Vectorize even if the features are cached")
+    args = parser.parse_args(argv)
+    if not 0 < args.test_size < 1:
+        parser.error("--test-size must be between 0 and 1")
 
-    # Load review metadata
-    with open("review_metadata.pkl", "rb") as f:
-        review_metadata = pickle.load(f)
+    start_time = time.time()
 
-    # Step 1: Prepare labeled data
-    labeled_data = prepare_labeled_data(review_metadata)
+    # Load review metadata, across every shard when the index is sharded
+    review_metadata = load_sharded_reviews() or load_review_metadata()
 
-    # Step 2: Preprocess metadata for efficiency
-    review_metadata = preprocess_metadata(review_metadata)
+    if args.streaming:
+        # Steps 1-3 in one pass over chunks of reviews
+        model, tfidf = train_streaming(review_metadata, args.chunk_size, args.n_features, args.test_size)
+    else:
+        # Step 1: Prepare labeled data
+        labeled_data = prepare_labeled_data(review_metadata)
 
-    # Step 3: Vectorize text
-    features, labels, tfidf = vectorize_text(labeled_data)
+        # Step 2: Vectorize text (cached until the corpus or the config changes)
+        config = {"max_features": args.max_features or None, "ngram_range": (1, args.ngram_max), "preprocess": args.preprocess}
+        features, labels, tfidf = vectorize_text(labeled_data, config, None if args.no_feature_cache else FEATURE_CACHE_DIR)
 
-    # Step 4: Train classifier
-    model = train_classifier(features, labels)
+        # Step 3: Train classifier
+        model = train_classifier(features, labels, args.alpha)
 
-    # Step 5: Save artifacts
+    # Step 4: Save artifacts
     save_artifacts(model, tfidf)
 
+    # Step 5: Score the corpus once for M2's prediction cache
+    build_prediction_cache(review_metadata)
+
     print(f"Training completed in {time.time() - start_time:.2f} seconds")
 
 if __name__ == "__main__":
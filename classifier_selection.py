@@ -0,0 +1,197 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import itertools
+import os
+import time
+import numpy as np
+from scipy import sparse
+from sklearn.metrics import accuracy_score, f1_score
+from sklearn.model_selection import StratifiedKFold
+from sklearn.naive_bayes import MultinomialNB
+import classifier
+from metadata_store import load_review_metadata
+from sharding import load_sharded_reviews
+
+''' Cross-validated model selection for the sentiment classifier
+
+    python classifier_selection.py --alpha 0.1,0.3,1 --max-features 5000,20000,0 --ngram-max 1,2 --preprocess no,yes
+
+Sweeps every combination of the vectorizer settings (TF-IDF vocabulary size, longest n-gram,
+stop-word preprocessing) and the Naive Bayes smoothing with stratified k-fold cross-validation,
+and prints the mean accuracy and macro F1 of each, best first, with the classifier.py command
+that trains the best one.
+
+The TF-IDF vectorizer is fit on each fold's training split only, so its vocabulary, the
+max_features cut-off and the IDF weights never see the test fold. Work is spread over a process
+pool in two rounds: vectorizing every config and fold that is not in the feature cache yet
+(keyed by corpus, config and fold), then one task per config and fold that fits every alpha on
+it. A repeated or extended sweep only vectorizes the new configs.
+'''
+
+FOLDS = 5
+SEED = 42
+
+# Labeled corpus of a vectorizing worker, set once by _init_vectorizer
+_labeled_data = None
+
+def _init_vectorizer(labeled_data):
+    global _labeled_data
+    _labeled_data = labeled_data
+
+def fold_split(labels, fold, folds):
+    ''' Training and test indices of one stratified fold '''
+    splits = StratifiedKFold(n_splits=folds, shuffle=True, random_state=SEED).split(np.zeros(len(labels)), labels)
+    return next(itertools.islice(splits, fold, None))
+
+def fold_cache_path(corpus_key, config, fold, folds, cache_dir):
+    ''' Feature cache file (without extension) of one fold of a config '''
+    return classifier.feature_cache_path(corpus_key, dict(config, fold=fold, folds=folds, seed=SEED), cache_dir)
+
+def save_fold(path, train, test):
+    ''' Cache one fold's (features, labels) for training and for testing '''
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    arrays = {}
+    for split, (features, labels) in (("train", train), ("test", test)):
+        features = sparse.csr_matrix(features)
+        arrays.update({
+            f"{split}_data": features.data, f"{split}_indices": features.indices, f"{split}_indptr": features.indptr,
+            f"{split}_shape": features.shape, f"{split}_labels": labels,
+        })
+    np.savez(path + ".npz", **arrays)
+
+def load_fold(path):
+    ''' The (features, labels) for training and for testing saved by save_fold, or None if not cached '''
+    if not os.path.exists(path + ".npz"):
+        return None
+    with np.load(path + ".npz") as cache:
+        return tuple(
+            (sparse.csr_matrix((cache[f"{split}_data"], cache[f"{split}_indices"], cache[f"{split}_indptr"]),
+                               shape=tuple(cache[f"{split}_shape"])), cache[f"{split}_labels"])
+            for split in ("train", "test")
+        )
+
+def _vectorize(path, config, fold, folds):
+    ''' Worker: fit a config's vectorizer on one fold's training split and cache both splits' features '''
+    texts, labels = zip(*_labeled_data)
+    labels = np.array(labels, dtype=np.int64)
+    train, test = fold_split(labels, fold, folds)
+    tfidf = classifier.make_vectorizer(config)
+    train_features = tfidf.fit_transform([texts[i] for i in train])
+    test_features = tfidf.transform([texts[i] for i in test])
+    save_fold(path, (train_features, labels[train]), (test_features, labels[test]))
+
+def _evaluate_fold(path, alphas):
+    ''' Worker: accuracy and macro F1 of each alpha, trained on a fold's training split and tested on its test split '''
+    (train_features, train_labels), (test_features, test_labels) = load_fold(path)
+    scores = []
+    for alpha in alphas:
+        model = MultinomialNB(alpha=alpha).fit(train_features, train_labels)
+        predicted = model.predict(test_features)
+        scores.append((accuracy_score(test_labels, predicted), f1_score(test_labels, predicted, average="macro")))
+    return scores
+
+def run_pool(function, tasks, workers, initializer=None, initargs=()):
+    ''' function over every task tuple, on a process pool when there are several workers and tasks '''
+    if workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks)), initializer=initializer, initargs=initargs) as executor:
+            return list(executor.map(function, *zip(*tasks)))
+    if initializer is not None:
+        initializer(*initargs)
+    return [function(*task) for task in tasks]
+
+def select_model(labeled_data, configs, alphas, folds=FOLDS, workers=None, cache_dir=classifier.FEATURE_CACHE_DIR):
+    """
+    Cross-validates every vectorizer config with every alpha.
+    Args:
+        labeled_data (list): List of tuples (review_text, label).
+        configs (list): Vectorizer configs (see classifier.VECTORIZER_CONFIG).
+        alphas (list): Naive Bayes smoothing values.
+        folds (int): Number of cross-validation folds.
+        workers (int): Number of worker processes. Defaults to the CPU count; 1 runs in-process.
+        cache_dir (str): Feature cache directory.
+    Returns:
+        list: Dicts of config, alpha, accuracy, accuracy_std and f1, best mean accuracy first.
+    """
+    workers = workers or os.cpu_count() or 1
+    corpus_key = classifier.corpus_fingerprint(labeled_data)
+    tasks = [(fold_cache_path(corpus_key, config, fold, folds, cache_dir), config, fold, folds)
+             for config in configs for fold in range(folds)]
+
+    # Round 1: vectorize the folds that are not cached yet
+    missing = [task for task in tasks if not os.path.exists(task[0] + ".npz")]
+    start_time = time.time()
+    run_pool(_vectorize, missing, workers, _init_vectorizer, (labeled_data,))
+    print(f"Vectorized {len(missing)} of {len(tasks)} config folds in {time.time() - start_time:.2f} seconds")
+
+    # Round 2: every fold of every config, each fitting all alphas
+    start_time = time.time()
+    fold_scores = run_pool(_evaluate_fold, [(path, alphas) for path, _, _, _ in tasks], workers)
+    print(f"Evaluated {len(tasks) * len(alphas)} fits in {time.time() - start_time:.2f} seconds")
+
+    results = []
+    for i, config in enumerate(configs):
+        # Scores of this config: folds x alphas x (accuracy, F1)
+        scores = np.array(fold_scores[i * folds:(i + 1) * folds])
+        for j, alpha in enumerate(alphas):
+            results.append({
+                "config": config, "alpha": alpha, "accuracy": scores[:, j, 0].mean(),
+                "accuracy_std": scores[:, j, 0].std(), "f1": scores[:, j, 1].mean(),
+            })
+    results.sort(key=lambda result: -result["accuracy"])
+    return results
+
+def training_command(result):
+    ''' The classifier.py command line that trains a swept model on the whole corpus '''
+    config = result["config"]
+    command = (f"python classifier.py --alpha {result['alpha']:g} --max-features {config['max_features'] or 0}"
+               f" --ngram-max {config['ngram_range'][1]}")
+    return command + " --preprocess" if config["preprocess"] else command
+
+def parse_list(convert):
+    ''' argparse type for a comma-separated list of values '''
+    def parse(text):
+        try:
+            return [convert(value.strip()) for value in text.split(",")]
+        except ValueError as e:
+            raise argparse.ArgumentTypeError(str(e))
+    return parse
+
+def parse_yes_no(text):
+    if text not in ("yes", "no"):
+        raise ValueError(f"expected yes or no, not '{text}'")
+    return text == "yes"
+
+def main():
+    parser = argparse.ArgumentParser(description="Cross-validated hyperparameter sweep for the sentiment classifier.")
+    parser.add_argument("--alpha", type=parse_list(float), default=[0.1, 0.3, 1.0], help="Naive Bayes smoothing values")
+    parser.add_argument("--max-features", type=parse_list(int), default=[5000, 20000, 0],
+                        help="TF-IDF vocabulary sizes (0 for every word)")
+    parser.add_argument("--ngram-max", type=parse_list(int), default=[1, 2], help="Longest n-gram lengths")
+    parser.add_argument("--preprocess", type=parse_list(parse_yes_no), default=[False, True],
+                        help="Stop-word preprocessing settings (yes, no)")
+    parser.add_argument("--folds", type=int, default=FOLDS, help="Cross-validation folds")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--top", type=int, default=10, help="Results to print")
+    args = parser.parse_args()
+    if args.folds < 2:
+        parser.error("--folds must be at least 2")
+
+    # Load review metadata, across every shard when the index is sharded
+    review_metadata = load_sharded_reviews() or load_review_metadata()
+    labeled_data = classifier.prepare_labeled_data(review_metadata)
+
+    configs = [
+        {"max_features": max_features or None, "ngram_range": (1, ngram_max), "preprocess": preprocess}
+        for max_features, ngram_max, preprocess in itertools.product(args.max_features, args.ngram_max, args.preprocess)
+    ]
+    results = select_model(labeled_data, configs, args.alpha, args.folds, args.workers)
+
+    print(f"{'accuracy':>9} {'std':>6} {'macro F1':>9} {'alpha':>6} {'features':>9} {'ngrams':>7} {'preprocess':>10}")
+    for result in results[:args.top]:
+        config = result["config"]
+        print(f"{result['accuracy']:>9.4f} {result['accuracy_std']:>6.4f} {result['f1']:>9.4f} {result['alpha']:>6g} "
+              f"{config['max_features'] or 'all':>9} {'1-%d' % config['ngram_range'][1]:>7} {'yes' if config['preprocess'] else 'no':>10}")
+    print("Train the best model with:", training_command(results[0]))
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,8 @@
 import pickle
 import pandas as pd
 import ast
-import re
+from metadata_store import ReviewStore, corpus_fingerprint, has_review_store, to_review_ids
+from text_analysis import LexiconMatcher, load_lexicon
 
 ''' Customer Class and Methods for M4: Unique Method '''
 class Customer:
@@ -10,12 +11,15 @@ class Customer:
             metadata:list[str]=None, formatted_metadata:list[tuple]=None, 
             tuple_sizes:int=None, reviews:list[dict]=None, num_reviews:int=0, 
             star_sum:int=0, helpful_count:int=0, out_of_helpful_count:int=0, 
-            avg_stars:float=None, avg_helpfulness:float=None, avg_positivity:float=None
+            avg_stars:float=None, avg_helpfulness:float=None, avg_positivity:float=None,
+            lexicon_counts=None, lexicon=None
             ):
         self.group = group
         self.cust_id = cust_id
         self.positive_words = positive_words if positive_words is not None else None
         self.negative_words = negative_words if negative_words is not None else None
+        # Compiled positive/negative lexicon shared by every customer (built here when not given)
+        self.lexicon = lexicon
         self.metadata = self.get_metadata()
         self.formatted_metadata = self.format_metadata()
         self.tuple_sizes = self.get_tuple_sizes()
@@ -28,7 +32,7 @@ class Customer:
         self.avg_stars = self.calc_avg_stars()
         self.avg_helpfulness = self.calc_avg_helpfulness()
         if positive_words and negative_words:
-            self.avg_positivity = self.calc_avg_positivity()
+            self.avg_positivity = self.calc_avg_positivity(lexicon_counts)
         else:
             self.avg_positivity = None
 
@@ -109,15 +113,16 @@ class Customer:
         else:
             return self.helpful_count / self.out_of_helpful_count 
 
-    def calc_avg_positivity(self):
+    def calc_avg_positivity(self, lexicon_counts=None):
+        ''' Positive share of all lexicon words in the customer's reviews; lexicon_counts is an optional ReviewStore with index-time counts '''
+        if lexicon_counts is not None:
+            return self.calc_avg_positivity_from_counts(lexicon_counts)
+        if self.lexicon is None:
+            self.lexicon = LexiconMatcher(self.positive_words, self.negative_words)
         positive_sum = 0
         negative_sum = 0
         for review in self.reviews:
-            review_text = review["review_text"]
-            # Tokenize and Count
-            words = re.findall(r'\b\w+\b', review_text.lower())
-            positive_count = sum(1 for word in words if word in self.positive_words)
-            negative_count = sum(1 for word in words if word in self.negative_words)
+            positive_count, negative_count = self.lexicon.count(review["review_text"])
             positive_sum += positive_count
             negative_sum += negative_count
         total_sum = positive_sum + negative_sum
@@ -126,6 +131,22 @@ class Customer:
         else:
             return None
 
+    def calc_avg_positivity_from_counts(self, lexicon_counts):
+        ''' Same ratio as calc_avg_positivity, summing the precomputed lexicon counts of the customer's reviews '''
+        # The counts are per corpus row: usable only when every row was parsed into a review with the row's text
+        texts = self.group["review_text"].tolist()
+        if len(self.reviews) != len(texts) or any(review["review_text"] != text for review, text in zip(self.reviews, texts)):
+            return self.calc_avg_positivity()
+        ids = to_review_ids(self.group.index)
+        positive_counts, negative_counts = lexicon_counts.lexicon_counts(ids)
+        if (positive_counts < 0).any():
+            return self.calc_avg_positivity()
+        total_sum = int(positive_counts.sum() + negative_counts.sum())
+        if total_sum > 0:
+            return int(positive_counts.sum()) / total_sum
+        else:
+            return None
+
     def diagnostic(self):
         attributes = [
             attr for attr in dir(self) if not attr.startswith('__') 
@@ -138,28 +159,37 @@ class Customer:
             else:
                 print(f"{attr_name}: length={len(attr_value)}: {type(attr_value)}")
 
+def load_corpus(corpus_filename) -> pd.DataFrame:
+    ''' Load the pickled reviews DataFrame '''
+    with open(corpus_filename, "rb") as f:
+        return pickle.load(f)
+
 def get_groups(corpus_filename) -> pd.DataFrame:
     ''' Split the corpus into groups based on 'customer_id' '''
-    with open(corpus_filename, "rb") as f:
-        reviews_segment_df = pickle.load(f)
-    return reviews_segment_df.groupby("customer_id")
+    return load_corpus(corpus_filename).groupby("customer_id")
 
 def get_customers(
         grouped_reviews:pd.DataFrame, 
         positive_words_filename, 
-        negative_words_filename
+        negative_words_filename,
+        reviews_segment_df:pd.DataFrame=None
     ) -> list[Customer]:
-    ''' Initialize instances of class Customer to create customer profiles'''
-    # Load positive words
-    with open(positive_words_filename, "r", encoding="utf-8") as f:
-        positive_words = {line.strip() for line in f if line.strip()}
-    # Load negative words
-    with open(negative_words_filename, "r", encoding="utf-8") as f:
-        negative_words = {line.strip() for line in f if line.strip()}
+    ''' Initialize instances of class Customer to create customer profiles; reviews_segment_df is the grouped corpus, needed to use index-time lexicon counts'''
+    # Load the lexicons and compile them once for every customer
+    positive_words = load_lexicon(positive_words_filename)
+    negative_words = load_lexicon(negative_words_filename)
+    lexicon = LexiconMatcher(positive_words, negative_words)
+    # Use the index-time lexicon counts when they match the lexicon files and were counted from this corpus
+    lexicon_counts = None
+    if reviews_segment_df is not None and has_review_store():
+        review_store = ReviewStore()
+        corpus = corpus_fingerprint(to_review_ids(reviews_segment_df.index), reviews_segment_df["review_text"].tolist())
+        if review_store.has_lexicon_counts(positive_words_filename, negative_words_filename, corpus):
+            lexicon_counts = review_store
     # Generate Profiles
     customers:list[Customer] = []
     for cust_id, group in grouped_reviews:
-        customers.append(Customer(group, cust_id, positive_words, negative_words))
+        customers.append(Customer(group, cust_id, positive_words, negative_words, lexicon_counts=lexicon_counts, lexicon=lexicon))
     return customers
 
 def customer_generation(
@@ -168,8 +198,9 @@ def customer_generation(
         negative_words_filename = "negative-words.txt"
     ) -> list[Customer]:
     ''' Master Function to generate profiles '''
-    grouped_reviews = get_groups(corpus_filename)
-    return get_customers(grouped_reviews, positive_words_filename, negative_words_filename)
+    reviews_segment_df = load_corpus(corpus_filename)
+    grouped_reviews = reviews_segment_df.groupby("customer_id")
+    return get_customers(grouped_reviews, positive_words_filename, negative_words_filename, reviews_segment_df)
 
 def save_customers_to_file(customers, filename="customers.pkl"):
     ''' Create customers.pkl for export '''
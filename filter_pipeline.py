@@ -0,0 +1,82 @@
+import time
+import numpy as np
+
+''' Composable, short-circuiting filter pipeline for the M1/M2/M3 relevance filters
+
+Each FilterStage decides per review whether it survives and estimates what that costs for
+a given set of reviews. FilterPipeline.run applies the stages cheapest-first to the
+shrinking survivor set, re-estimating costs as it goes, and stops as soon as nothing is
+left, so expensive stages (classifier, regex lexicon counting) only see the reviews the
+cheap ones let through. run_all keeps the old behaviour of applying every stage to the
+whole input, for reports that need each stage's full output.
+'''
+
+class FilterStage:
+    """
+    One relevance filter.
+    Args:
+        name (str): Name used in traces and per-stage outputs, e.g. "M1_result".
+        keep (function): Maps a sorted array of review IDs to a boolean mask of survivors.
+        cost (function): Maps a sorted array of review IDs to the estimated cost of keep on them.
+        keep_all_if_none (bool): When no review of the whole input survives, let all of them
+            through instead (M3's fallback for result sets without lexicon words).
+    """
+
+    def __init__(self, name, keep, cost, keep_all_if_none=False):
+        self.name = name
+        self.keep = keep
+        self.cost = cost
+        self.keep_all_if_none = keep_all_if_none
+
+    def apply(self, ids):
+        ''' The stage's own output on ids, as a sorted array '''
+        ids = np.asarray(ids, dtype=np.int64)
+        survivors = ids[self.keep(ids)]
+        if len(survivors) == 0 and self.keep_all_if_none:
+            return ids
+        return survivors
+
+class FilterPipeline:
+    ''' Runs FilterStages over a Boolean result and intersects their outputs '''
+
+    def __init__(self, stages):
+        self.stages = stages
+
+    def run(self, ids):
+        """
+        Lazily applies every stage, cheapest first, to the reviews that survived the previous ones.
+        Gives the same survivors as intersecting each stage's output on the full input.
+        Args:
+            ids (array-like): Sorted review IDs to filter.
+        Returns:
+            tuple: Sorted array of surviving IDs, and a trace of one dict per stage that ran
+                (stage, input, output, cost, elapsed) in the order they ran.
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        survivors = ids
+        trace = []
+        pending = list(self.stages)
+        while pending and len(survivors):
+            costs = [stage.cost(survivors) for stage in pending]
+            stage = pending.pop(int(np.argmin(costs)))
+            start_time = time.perf_counter()
+            kept = stage.keep(survivors)
+            if not kept.any() and stage.keep_all_if_none:
+                # The fallback depends on the whole input: it only applies when none of the
+                # reviews dropped earlier would have survived this stage either
+                dropped = np.setdiff1d(ids, survivors, assume_unique=True)
+                if len(dropped) == 0 or not stage.keep(dropped).any():
+                    kept[:] = True
+            trace.append({
+                "stage": stage.name,
+                "input": len(survivors),
+                "output": int(kept.sum()),
+                "cost": float(min(costs)),
+                "elapsed": time.perf_counter() - start_time,
+            })
+            survivors = survivors[kept]
+        return survivors, trace
+
+    def run_all(self, ids):
+        ''' Every stage's output on the whole input (dict keyed by stage name), for diagnostics '''
+        return {stage.name: stage.apply(ids) for stage in self.stages}
@@ -0,0 +1,395 @@
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import json
+import mmap
+import os
+import pickle
+import numpy as np
+from text_analysis import ANALYSIS_VERSION, TOKEN_PATTERN, LexiconMatcher, load_lexicon, tokenize
+
+''' Columnar review metadata store with lazy text access
+
+Every column is a NumPy array indexed directly by review ID and opened with mmap_mode="r",
+so nothing is read into memory until it is touched:
+
+    review_store/
+        present.npy         bool, True for IDs that hold a review
+        ratings.npy         int8 customer_review_rating, -1 when missing
+        <column>.npy        any other numeric column, e.g. customer_id codes
+        <column>_labels.npy the distinct values of a string column, indexed by its codes
+        doc_lengths.npy     int32 number of tokens per review (BM25 length normalization)
+        token_spans.npy     int32 (start, end) character offsets of every token, in ID order
+        span_offsets.npy    int64, review ID's tokens are token_spans[offsets[ID]:offsets[ID + 1]]
+        text_offsets.npy    int64, review ID's text is texts.bin[offsets[ID]:offsets[ID + 1]]
+        texts.bin           utf-8 review texts concatenated in ID order
+        sentiment_gt<N>.npz packed positive/negative rating bitmaps for threshold N
+        positive_counts.npy int32 positive lexicon hits per review
+        negative_counts.npy int32 negative lexicon hits per review
+        lexicon_counts.json fingerprints of the lexicon files and of the corpus the counts were computed from
+
+Texts are decoded only when asked for, so filters that only need ratings never load them.
+'''
+
+STORE_DIR = "review_store"
+
+# Review IDs are the DataFrame index shifted by two (header row + 1-based Excel rows).
+# Convert only through to_review_ids/to_segment_index so the shift lives in one place.
+ID_OFFSET = 2
+
+def to_review_ids(index):
+    ''' Review IDs of reviews_segment DataFrame index labels '''
+    return np.asarray(index, dtype=np.int64) + ID_OFFSET
+
+def to_segment_index(ids):
+    ''' reviews_segment DataFrame index labels of review IDs '''
+    return np.asarray(ids, dtype=np.int64) - ID_OFFSET
+
+# Ratings above this are positive, the rest negative
+RATING_THRESHOLD = 3
+
+def write_review_store(ids, texts, directory=STORE_DIR, **columns):
+    """
+    Writes review metadata as a columnar store.
+    Args:
+        ids (array-like): Review IDs.
+        texts (list): Review texts aligned with ids.
+        directory (str): Directory of the store.
+        **columns: Further columns aligned with ids. Numeric columns are stored as they are;
+            string columns (e.g. customer_id) as int32 codes plus a <column>_labels.npy lookup.
+    """
+    os.makedirs(directory, exist_ok=True)
+    ids = np.asarray(ids, dtype=np.int64)
+    order = np.argsort(ids, kind="stable")
+    ids = ids[order]
+    size = int(ids.max()) + 1 if len(ids) else 0
+
+    present = np.zeros(size, dtype=bool)
+    present[ids] = True
+    np.save(os.path.join(directory, "present.npy"), present)
+
+    for name, values in columns.items():
+        values = np.asarray(values)[order]
+        if values.dtype.kind in "OUS":
+            labels, codes = np.unique(values.astype(str), return_inverse=True)
+            column = np.full(size, -1, dtype=np.int32)
+            column[ids] = codes
+            np.save(os.path.join(directory, f"{name}_labels.npy"), labels)
+        else:
+            dtype = np.int8 if name == "ratings" else values.dtype
+            column = np.full(size, -1, dtype=dtype)
+            column[ids] = values
+        np.save(os.path.join(directory, f"{name}.npy"), column)
+
+    # Text blob in ID order; missing IDs get empty slices
+    encoded = [texts[i].encode("utf-8") if isinstance(texts[i], str) else b"" for i in order]
+    lengths = np.zeros(size, dtype=np.int64)
+    lengths[ids] = [len(text) for text in encoded]
+    offsets = np.zeros(size + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    np.save(os.path.join(directory, "text_offsets.npy"), offsets)
+    with open(os.path.join(directory, "texts.bin"), "wb") as f:
+        for text in encoded:
+            f.write(text)
+
+    # Character span of every token, so snippets map token positions to text without re-tokenizing
+    spans = [token_spans(texts[i]) for i in order]
+    counts = np.zeros(size, dtype=np.int64)
+    counts[ids] = [len(review_spans) for review_spans in spans]
+    span_offsets = np.zeros(size + 1, dtype=np.int64)
+    np.cumsum(counts, out=span_offsets[1:])
+    np.save(os.path.join(directory, "span_offsets.npy"), span_offsets)
+    np.save(os.path.join(directory, "token_spans.npy"), np.concatenate([np.empty((0, 2), dtype=np.int32)] + spans))
+
+def token_spans(text):
+    ''' (start, end) character offsets of each token of a text, in the postings list's token order '''
+    if not isinstance(text, str):
+        return np.empty((0, 2), dtype=np.int32)
+    return np.array([match.span() for match in TOKEN_PATTERN.finditer(text)], dtype=np.int32).reshape(-1, 2)
+
+def rating_masks(ratings, threshold=RATING_THRESHOLD):
+    ''' Positive/negative membership arrays, indexed by review ID, from a ratings column '''
+    ratings = np.asarray(ratings)
+    return ratings > threshold, (ratings >= 0) & (ratings <= threshold)
+
+def ratings_array(review_metadata):
+    ''' Ratings indexed by review ID (-1 where missing) from a metadata dict '''
+    ratings = np.full(max(review_metadata, default=0) + 1, -1, dtype=np.int8)
+    for ID, data in review_metadata.items():
+        ratings[ID] = _as_rating(data.get("customer_review_rating"))
+    return ratings
+
+def sentiment_bitmaps_path(directory=STORE_DIR, threshold=RATING_THRESHOLD):
+    return os.path.join(directory, f"sentiment_gt{threshold}.npz")
+
+def write_sentiment_bitmaps(directory=STORE_DIR, threshold=RATING_THRESHOLD):
+    ''' Precompute the positive/negative rating memberships and persist them as compressed bitmaps '''
+    ratings = np.load(os.path.join(directory, "ratings.npy"), mmap_mode="r")
+    positive, negative = rating_masks(ratings, threshold)
+    np.savez_compressed(
+        sentiment_bitmaps_path(directory, threshold),
+        positive=np.packbits(positive), negative=np.packbits(negative), size=len(ratings)
+    )
+
+def lexicon_fingerprint(positive_words_filename="positive-words.txt", negative_words_filename="negative-words.txt"):
+    ''' Hash of both lexicon files and the matcher version; lexicon counts are stale when it changes '''
+    digest = hashlib.sha1(f"analysis {ANALYSIS_VERSION}\0".encode())
+    for filename in (positive_words_filename, negative_words_filename):
+        with open(filename, "rb") as f:
+            digest.update(f.read())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+def _corpus_digest(ids, lengths, blobs):
+    digest = hashlib.sha1(np.asarray(ids, dtype=np.int64).tobytes())
+    digest.update(np.asarray(lengths, dtype=np.int64).tobytes())
+    for blob in blobs:
+        digest.update(blob)
+    return digest.hexdigest()
+
+def corpus_fingerprint(ids, texts):
+    ''' Hash of review IDs and their texts, to tell whether lexicon counts were computed from this corpus '''
+    ids = np.asarray(ids, dtype=np.int64)
+    order = np.argsort(ids, kind="stable")
+    encoded = [texts[i].encode("utf-8") if isinstance(texts[i], str) else b"" for i in order]
+    return _corpus_digest(ids[order], [len(text) for text in encoded], [b"".join(encoded)])
+
+def store_corpus_fingerprint(directory=STORE_DIR, block_size=1 << 24):
+    ''' corpus_fingerprint of the reviews in a store, hashed straight from its text blob '''
+    ids = np.flatnonzero(np.load(os.path.join(directory, "present.npy")))
+    lengths = np.diff(np.load(os.path.join(directory, "text_offsets.npy")))[ids]
+    with open(os.path.join(directory, "texts.bin"), "rb") as f:
+        return _corpus_digest(ids, lengths, iter(lambda: f.read(block_size), b""))
+
+def count_tokens(texts):
+    ''' Number of tokens in each text, tokenized the same way as the postings list '''
+    return [len(tokenize(text)) if isinstance(text, str) else 0 for text in texts]
+
+def write_lexicon_counts(directory=STORE_DIR, positive_words_filename="positive-words.txt",
+                         negative_words_filename="negative-words.txt", chunk_size=10000, workers=None):
+    """
+    Computes per-review lexicon hit counts over the whole store in a process pool and saves them
+    with the lexicon and corpus fingerprints. Rerun whenever the lexicon files change.
+    Args:
+        directory (str): Directory of the store.
+        positive_words_filename (str): Positive lexicon file.
+        negative_words_filename (str): Negative lexicon file.
+        chunk_size (int): Number of reviews per worker task.
+        workers (int): Number of worker processes. Defaults to the CPU count; 1 runs in-process.
+    """
+    store = ReviewStore(directory)
+    ids = np.flatnonzero(store.present)
+    chunks = [store.texts(ids[i:i + chunk_size].tolist()) for i in range(0, len(ids), chunk_size)]
+    count_chunk = LexiconMatcher(load_lexicon(positive_words_filename), load_lexicon(negative_words_filename)).count_all
+    workers = workers or os.cpu_count() or 1
+    if workers > 1 and len(chunks) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(chunks))) as executor:
+            chunk_counts = list(executor.map(count_chunk, chunks))
+    else:
+        chunk_counts = [count_chunk(chunk) for chunk in chunks]
+
+    positive_counts = np.zeros(len(store.present), dtype=np.int32)
+    negative_counts = np.zeros(len(store.present), dtype=np.int32)
+    positive_counts[ids] = [count for positive, _ in chunk_counts for count in positive]
+    negative_counts[ids] = [count for _, negative in chunk_counts for count in negative]
+    np.save(os.path.join(directory, "positive_counts.npy"), positive_counts)
+    np.save(os.path.join(directory, "negative_counts.npy"), negative_counts)
+    with open(os.path.join(directory, "lexicon_counts.json"), "w", encoding="utf-8") as f:
+        json.dump({
+            "fingerprint": lexicon_fingerprint(positive_words_filename, negative_words_filename),
+            "corpus": store_corpus_fingerprint(directory),
+        }, f)
+
+class ReviewStore:
+    ''' Read-only view of a store written by write_review_store '''
+
+    def __init__(self, directory=STORE_DIR):
+        self.directory = directory
+        self.present = np.load(os.path.join(directory, "present.npy"), mmap_mode="r")
+        self._ratings = np.load(os.path.join(directory, "ratings.npy"), mmap_mode="r")
+        self._offsets = np.load(os.path.join(directory, "text_offsets.npy"), mmap_mode="r")
+        texts_filename = os.path.join(directory, "texts.bin")
+        if os.path.getsize(texts_filename) > 0:
+            with open(texts_filename, "rb") as f:
+                self._texts = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self._texts = b""
+        self._columns = {}
+        # Reviews appended through segments, and deleted ones
+        self._overlay = {}
+        self._deleted = set()
+        self._ids = None
+        self._overlay_ratings = None
+
+    def column(self, name):
+        ''' A column as a NumPy array indexed by review ID (opened lazily) '''
+        if name == "ratings":
+            return self.ratings
+        if name not in self._columns:
+            self._columns[name] = np.load(os.path.join(self.directory, f"{name}.npy"), mmap_mode="r")
+        return self._columns[name]
+
+    def labels(self, name):
+        ''' The distinct values of a string column, indexed by the column's codes '''
+        return np.load(os.path.join(self.directory, f"{name}_labels.npy"))
+
+    @property
+    def ratings(self):
+        ''' Ratings indexed by review ID (-1 where there is no review) '''
+        if not self._overlay and not self._deleted:
+            return self._ratings
+        if self._overlay_ratings is None:
+            size = max(len(self._ratings), max(self._overlay, default=0) + 1)
+            ratings = np.full(size, -1, dtype=np.int8)
+            ratings[:len(self._ratings)] = self._ratings
+            # Tombstones beyond the arrays (e.g. of an ID that was never indexed) have nothing to hide
+            deleted = np.fromiter(self._deleted, dtype=np.int64, count=len(self._deleted))
+            ratings[deleted[(deleted >= 0) & (deleted < size)]] = -1
+            for ID, data in self._overlay.items():
+                ratings[ID] = _as_rating(data.get("customer_review_rating"))
+            self._overlay_ratings = ratings
+        return self._overlay_ratings
+
+    def sentiment_masks(self, threshold=RATING_THRESHOLD):
+        ''' Positive/negative boolean arrays indexed by review ID, from the bitmaps when available '''
+        path = sentiment_bitmaps_path(self.directory, threshold)
+        if self._overlay or self._deleted or not os.path.exists(path):
+            return rating_masks(self.ratings, threshold)
+        with np.load(path) as bitmaps:
+            size = int(bitmaps["size"])
+            positive = np.unpackbits(bitmaps["positive"], count=size).astype(bool)
+            negative = np.unpackbits(bitmaps["negative"], count=size).astype(bool)
+        return positive, negative
+
+    def has_lexicon_counts(self, positive_words_filename="positive-words.txt", negative_words_filename="negative-words.txt", corpus=None):
+        """
+        True when lexicon counts exist and were computed from the current lexicon files.
+        Args:
+            positive_words_filename (str): Positive lexicon file.
+            negative_words_filename (str): Negative lexicon file.
+            corpus (str): corpus_fingerprint of the reviews the counts are for, when they are not
+                necessarily this store's own (e.g. a reviews_segment file read separately).
+        """
+        path = os.path.join(self.directory, "lexicon_counts.json")
+        if not os.path.exists(path):
+            return False
+        with open(path, "r", encoding="utf-8") as f:
+            fingerprints = json.load(f)
+        if corpus is not None and fingerprints.get("corpus") != corpus:
+            return False
+        return fingerprints["fingerprint"] == lexicon_fingerprint(positive_words_filename, negative_words_filename)
+
+    def lexicon_counts(self, ids):
+        """
+        Looks up precomputed lexicon hit counts.
+        Args:
+            ids (array-like): Review IDs.
+        Returns:
+            tuple: Positive and negative hit counts aligned with ids; -1 for reviews without
+                precomputed counts (appended through segments).
+        """
+        positive_counts = self.column("positive_counts")
+        negative_counts = self.column("negative_counts")
+        ids = np.asarray(ids, dtype=np.int64)
+        known = (ids < len(positive_counts)) & ~self.appended(ids)
+        positive = np.full(len(ids), -1, dtype=np.int64)
+        negative = np.full(len(ids), -1, dtype=np.int64)
+        positive[known] = positive_counts[ids[known]]
+        negative[known] = negative_counts[ids[known]]
+        return positive, negative
+
+    def doc_lengths(self, ids):
+        ''' Token count of each review, from the doc_lengths column when it was written '''
+        ids = np.asarray(ids, dtype=np.int64)
+        lengths = np.full(len(ids), -1, dtype=np.int64)
+        if os.path.exists(os.path.join(self.directory, "doc_lengths.npy")):
+            column = self.column("doc_lengths")
+            known = (ids < len(column)) & ~self.appended(ids)
+            lengths[known] = column[ids[known]]
+        # Appended reviews (and stores written before the column existed) are counted from their text
+        missing = np.flatnonzero(lengths < 0)
+        if len(missing):
+            lengths[missing] = count_tokens(self.texts(ids[missing].tolist()))
+        return lengths
+
+    def token_spans(self, ID):
+        ''' (start, end) character offsets of a review's tokens, indexed by token position '''
+        if ID not in self._overlay and os.path.exists(os.path.join(self.directory, "token_spans.npy")):
+            span_offsets = self.column("span_offsets")
+            if ID + 1 < len(span_offsets):
+                return self.column("token_spans")[span_offsets[ID]:span_offsets[ID + 1]]
+        return token_spans(self.text(ID))
+
+    def ids(self):
+        ''' Sorted array of every live review ID '''
+        if self._ids is None:
+            ids = set(np.flatnonzero(self.present).tolist()) - self._deleted
+            self._ids = np.array(sorted(ids | set(self._overlay)), dtype=np.int64)
+        return self._ids
+
+    def rating(self, ID):
+        if ID in self._overlay:
+            return self._overlay[ID].get("customer_review_rating")
+        rating = int(self._ratings[ID])
+        return rating if rating >= 0 else None
+
+    def text(self, ID):
+        ''' Decode a single review's text from the blob '''
+        if ID in self._overlay:
+            return self._overlay[ID].get("text", "")
+        start, end = self._offsets[ID], self._offsets[ID + 1]
+        return self._texts[start:end].decode("utf-8")
+
+    def texts(self, ids):
+        return [self.text(ID) for ID in ids]
+
+    def appended(self, ids):
+        ''' Boolean mask of the IDs served from appended segments rather than from the store's arrays '''
+        return np.isin(np.asarray(ids, dtype=np.int64), list(self._overlay))
+
+    def overlay(self, metadata, deleted=()):
+        ''' Layer segment metadata (dict keyed by ID) over the store and hide deleted IDs '''
+        for ID in deleted:
+            self._deleted.add(ID)
+            self._overlay.pop(ID, None)
+        self._overlay.update(metadata)
+        self._ids = None
+        self._overlay_ratings = None
+
+    def __contains__(self, ID):
+        if ID in self._overlay:
+            return True
+        return 0 <= ID < len(self.present) and bool(self.present[ID]) and ID not in self._deleted
+
+    def __len__(self):
+        return len(self.ids())
+
+    def __iter__(self):
+        return iter(self.ids().tolist())
+
+    def keys(self):
+        return self.ids().tolist()
+
+    def __getitem__(self, ID):
+        ''' dict-of-dicts compatibility: review_metadata[ID]["text"] '''
+        if ID not in self:
+            raise KeyError(ID)
+        return {"customer_review_rating": self.rating(ID), "text": self.text(ID)}
+
+    def get(self, ID, default=None):
+        return self[ID] if ID in self else default
+
+def _as_rating(rating):
+    try:
+        return int(rating)
+    except (TypeError, ValueError):
+        return -1
+
+def has_review_store(directory=STORE_DIR):
+    return os.path.exists(os.path.join(directory, "present.npy"))
+
+def load_review_metadata(directory=STORE_DIR, pickle_filename="review_metadata.pkl"):
+    ''' Open the columnar store when it has been generated, otherwise unpickle the metadata dict '''
+    if has_review_store(directory):
+        return ReviewStore(directory)
+    with open(pickle_filename, "rb") as f:
+        return pickle.load(f)
@@ -0,0 +1,317 @@
+import bisect
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+''' Per-stage latency, candidate-set size and memory metrics for the search path
+
+boolean_search_help wraps each stage of a query (artifact loading, opinion expansion, the
+Boolean step, M1/M2/M3, combining, ranking, snippets, and the shard fan-out) in a span:
+
+    with search_metrics.span("M1_result", len(result)) as span:
+        M1_result = ...
+        span.output(len(M1_result))
+
+Every span adds its duration, its input and output sizes (reviews in and out of a filter)
+and, with memory tracing on, the peak memory allocated inside it to histograms per stage.
+Metrics are off by default: a disabled or switched-off stage gets a shared no-op span, so
+the cost is one method call. Reports are JSON (count, sum, mean and p50/p95/p99 estimates
+per histogram) or Prometheus text exposition format.
+
+Memory tracing uses tracemalloc, which slows allocation-heavy code noticeably; peaks are
+process-wide, so concurrent queries on the query server's threads inflate each other's.
+'''
+
+# Upper bounds of the histogram buckets (an implicit +Inf bucket follows)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (0,) + tuple(step * 10 ** power for power in range(7) for step in (1, 2.5, 5))
+MEMORY_BUCKETS = tuple(1024 * 4 ** power for power in range(11))
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+# Histograms kept per stage: name, bucket bounds, Prometheus metric name and help text
+HISTOGRAMS = (
+    ("seconds", LATENCY_BUCKETS, "search_stage_seconds", "Time spent in each search stage."),
+    ("input", SIZE_BUCKETS, "search_stage_input_reviews", "Candidate reviews entering each search stage."),
+    ("output", SIZE_BUCKETS, "search_stage_output_reviews", "Candidate reviews leaving each search stage."),
+    ("peak_bytes", MEMORY_BUCKETS, "search_stage_peak_bytes", "Peak memory allocated inside each search stage."),
+)
+
+class Histogram:
+    """
+    Cumulative-bucket histogram, mergeable across processes.
+    Args:
+        bounds (tuple): Ascending upper bounds of the buckets.
+    """
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def merge(self, state):
+        ''' Add another histogram's state (as returned by state()) with the same bounds '''
+        self.counts = [count + other for count, other in zip(self.counts, state["counts"])]
+        self.count += state["count"]
+        self.sum += state["sum"]
+
+    def state(self):
+        return {"counts": list(self.counts), "count": self.count, "sum": self.sum}
+
+    def quantile(self, q):
+        ''' Upper bound of the bucket holding the q-quantile (None when empty; inf past the last bound) '''
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.bounds + (float("inf"),), self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def summary(self):
+        summary = {"count": self.count, "sum": self.sum, "mean": self.sum / self.count if self.count else None}
+        for q in QUANTILES:
+            summary[f"p{round(q * 100)}"] = self.quantile(q)
+        return summary
+
+class _NullSpan:
+    ''' The span handed out while a stage is not measured '''
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def output(self, size):
+        pass
+
+NULL_SPAN = _NullSpan()
+
+class Span:
+    ''' Times one run of a stage; see Metrics.span '''
+
+    def __init__(self, metrics, stage, input_size):
+        self.metrics = metrics
+        self.stage = stage
+        self.input_size = input_size
+        self.output_size = None
+        self.peak_bytes = None
+
+    def output(self, size):
+        ''' Record the number of reviews the stage produced '''
+        self.output_size = size
+
+    def __enter__(self):
+        if self.metrics.trace_memory and tracemalloc.is_tracing():
+            self._memory_start = self.metrics._enter_memory(self)
+        self._start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self._start_time
+        if self.metrics.trace_memory and tracemalloc.is_tracing():
+            self.peak_bytes = self.metrics._exit_memory(self, self._memory_start)
+        self.metrics.observe(self.stage, elapsed, self.input_size, self.output_size, self.peak_bytes)
+        return False
+
+class Metrics:
+    """
+    Registry of per-stage histograms. Disabled until enable() is called.
+    Safe to share between the query server's threads.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.stages = None
+        self.trace_memory = False
+        self._histograms = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def enable(self, stages=None, trace_memory=False):
+        """
+        Start recording.
+        Args:
+            stages (iterable): Record only these stages (None for all).
+            trace_memory (bool): Also record each stage's peak memory with tracemalloc.
+        """
+        self.stages = set(stages) if stages is not None else None
+        self.trace_memory = trace_memory
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.enabled = True
+
+    def disable(self):
+        ''' Stop recording; what was recorded so far is kept '''
+        self.enabled = False
+        if self.trace_memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self.trace_memory = False
+
+    def is_recording(self, stage):
+        return self.enabled and (self.stages is None or stage in self.stages)
+
+    def span(self, stage, input_size=None):
+        """
+        Context manager measuring one run of a stage.
+        Args:
+            stage (str): Stage name, e.g. "boolean" or "M2_result".
+            input_size (int): Reviews entering the stage, if it filters a candidate set.
+        Returns:
+            Span (or a no-op span when the stage is not recorded); call output(n) on it with
+            the number of reviews the stage produced.
+        """
+        if not self.enabled or (self.stages is not None and stage not in self.stages):
+            return NULL_SPAN
+        return Span(self, stage, input_size)
+
+    def timed(self, stage):
+        ''' Decorator running every call of a function inside a span for stage '''
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.span(stage):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def observe(self, stage, seconds, input_size=None, output_size=None, peak_bytes=None):
+        ''' Record one run of a stage measured elsewhere, e.g. a FilterPipeline trace step '''
+        if not self.is_recording(stage):
+            return
+        values = {"seconds": seconds, "input": input_size, "output": output_size, "peak_bytes": peak_bytes}
+        with self._lock:
+            histograms = self._stage_histograms(stage)
+            for name, value in values.items():
+                if value is not None:
+                    histograms[name].observe(value)
+
+    def _stage_histograms(self, stage):
+        if stage not in self._histograms:
+            self._histograms[stage] = {name: Histogram(bounds) for name, bounds, _, _ in HISTOGRAMS}
+        return self._histograms[stage]
+
+    def _enter_memory(self, span):
+        # Nested spans share tracemalloc's single peak: fold the peak so far into the
+        # enclosing spans before resetting it for this one
+        stack = getattr(self._local, "spans", None)
+        if stack is None:
+            stack = self._local.spans = []
+        current, peak = tracemalloc.get_traced_memory()
+        for enclosing in stack:
+            enclosing._peak = max(enclosing._peak, peak)
+        tracemalloc.reset_peak()
+        span._peak = current
+        stack.append(span)
+        return current
+
+    def _exit_memory(self, span, start):
+        stack = self._local.spans
+        stack.remove(span)
+        peak = max(span._peak, tracemalloc.get_traced_memory()[1])
+        for enclosing in stack:
+            enclosing._peak = max(enclosing._peak, peak)
+        return max(peak - start, 0)
+
+    def reset(self):
+        ''' Drop everything recorded so far '''
+        with self._lock:
+            self._histograms = {}
+
+    def _state(self):
+        return {stage: {name: histogram.state() for name, histogram in histograms.items()}
+                for stage, histograms in self._histograms.items()}
+
+    def state(self):
+        ''' Picklable copy of every histogram, for merging a worker process's metrics into another's '''
+        with self._lock:
+            return self._state()
+
+    def collect(self):
+        ''' state(), then reset() '''
+        with self._lock:
+            state = self._state()
+            self._histograms = {}
+        return state
+
+    def merge(self, state):
+        ''' Add the histograms of another Metrics' state() '''
+        with self._lock:
+            for stage, histograms in state.items():
+                for name, histogram_state in histograms.items():
+                    self._stage_histograms(stage)[name].merge(histogram_state)
+
+    def report(self):
+        """
+        Summary of every recorded stage.
+        Returns:
+            dict: stages: stage -> histogram name -> count, sum, mean, p50, p95, p99 (empty
+                histograms left out), plus the process's peak resident memory.
+        """
+        with self._lock:
+            stages = {
+                stage: {name: histogram.summary() for name, histogram in histograms.items() if histogram.count}
+                for stage, histograms in sorted(self._histograms.items())
+            }
+        return {"stages": stages, "process_peak_rss_bytes": peak_rss_bytes()}
+
+    def prometheus_text(self):
+        ''' Every histogram in Prometheus text exposition format '''
+        lines = []
+        with self._lock:
+            for name, bounds, metric, help_text in HISTOGRAMS:
+                lines.append(f"# HELP {metric} {help_text}")
+                lines.append(f"# TYPE {metric} histogram")
+                for stage, histograms in sorted(self._histograms.items()):
+                    histogram = histograms[name]
+                    if not histogram.count:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(bounds + (float("inf"),), histogram.counts):
+                        cumulative += count
+                        le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                        lines.append(f'{metric}_bucket{{stage="{stage}",le="{le}"}} {cumulative}')
+                    lines.append(f'{metric}_sum{{stage="{stage}"}} {histogram.sum:g}')
+                    lines.append(f'{metric}_count{{stage="{stage}"}} {histogram.count}')
+        rss = peak_rss_bytes()
+        if rss is not None:
+            lines.append("# HELP process_peak_rss_bytes Peak resident memory of the search process.")
+            lines.append("# TYPE process_peak_rss_bytes gauge")
+            lines.append(f"process_peak_rss_bytes {rss}")
+        return "\n".join(lines) + "\n"
+
+    def write_json(self, filename):
+        ''' Write report() to a JSON file (atomically) '''
+        _write_atomic(filename, json.dumps(self.report(), indent=2))
+
+    def write_prometheus(self, filename):
+        ''' Write prometheus_text() to a file (atomically), e.g. for node_exporter's textfile collector '''
+        _write_atomic(filename, self.prometheus_text())
+
+def peak_rss_bytes():
+    ''' Peak resident memory of this process in bytes (None where the resource module is unavailable) '''
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if os.uname().sysname == "Darwin" else peak * 1024
+
+def _write_atomic(filename, text):
+    tmp_filename = filename + ".tmp"
+    with open(tmp_filename, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_filename, filename)
@@ -0,0 +1,104 @@
+import numpy as np
+
+''' Opinion expansion: OR the --opinion word with more words of the same polarity
+
+    lexicon       every same-polarity lexicon word that occurs in the index, most frequent first
+    cooccurrence  the same-polarity lexicon words whose reviews overlap the opinion's the most
+                  (cosine of the two review sets, counted on a bitmap of the opinion's reviews)
+
+The expanded opinion can be hundreds of terms; QueryEngine ORs their postings with
+postings_ops.union_many in one k-way merge or bitmap pass. Both modes only need per-word
+counts (document frequencies, overlaps with the opinion), so a sharded index sums each
+shard's counts and expands exactly as a single index would.
+'''
+
+EXPANSION_MODES = ("lexicon", "cooccurrence")
+
+# Words added by cooccurrence when no limit is given (lexicon adds every word by default)
+DEFAULT_NEIGHBOURS = 20
+
+def lexicon_expansion(doc_freqs, opinion, limit=None):
+    """
+    Same-polarity lexicon words to OR with the opinion.
+    Args:
+        doc_freqs (dict): Document frequency of each lexicon word of the opinion's polarity.
+        opinion (str): The opinion word.
+        limit (int): Keep only this many, highest document frequency first (None for all).
+    Returns:
+        list: Words that occur in the index, highest document frequency first.
+    """
+    expansion = sorted(
+        (word for word, doc_freq in doc_freqs.items() if doc_freq > 0 and word != opinion),
+        key=lambda word: (-doc_freqs[word], word)
+    )
+    return expansion if limit is None else expansion[:limit]
+
+def cooccurrence_counts(index, opinion, words):
+    """
+    How often each candidate word occurs, alone and in the same review as the opinion.
+    Args:
+        index: Postings index (anything with get_postings).
+        opinion (str): The opinion word.
+        words (set): Candidate words, e.g. the lexicon words of the opinion's polarity.
+    Returns:
+        tuple: The opinion's document frequency, and a dict mapping each candidate that
+            occurs in the index to (document frequency, reviews shared with the opinion).
+            Words sharing no reviews are kept, so shards' document frequencies sum exactly.
+    """
+    reviews = index.get_postings(opinion)
+    member = np.zeros(int(reviews[-1]) + 1 if len(reviews) else 0, dtype=bool)
+    member[reviews] = True
+    counts = {}
+    for word in words:
+        if word == opinion:
+            continue
+        postings = index.get_postings(word)
+        if len(postings):
+            counts[word] = (len(postings), int(member[postings[:np.searchsorted(postings, len(member))]].sum()))
+    return len(reviews), counts
+
+def nearest_neighbours(opinion_freq, counts, limit=DEFAULT_NEIGHBOURS):
+    """
+    Nearest neighbours of the opinion by review co-occurrence, |A & B| / sqrt(|A| |B|).
+    Args:
+        opinion_freq (int): The opinion's document frequency.
+        counts (dict): Word -> (document frequency, reviews shared with the opinion), as
+            returned by cooccurrence_counts (summed over shards for a sharded index).
+        limit (int): Number of neighbours.
+    Returns:
+        list: Up to limit words, closest first.
+    """
+    scores = {word: overlap / np.sqrt(opinion_freq * doc_freq) for word, (doc_freq, overlap) in counts.items() if overlap}
+    return sorted(scores, key=lambda word: (-scores[word], word))[:limit]
+
+def expansion_candidates(opinion, positivity, lexicon, mode):
+    """
+    The lexicon words an expansion mode chooses from.
+    Raises:
+        ValueError: For an unknown mode, or an opinion that is in neither lexicon.
+    """
+    if mode not in EXPANSION_MODES:
+        raise ValueError(f"Unknown expansion '{mode}': use one of {', '.join(EXPANSION_MODES)}")
+    if positivity is None:
+        raise ValueError(f"Cannot expand '{opinion}': it is in neither opinion lexicon")
+    return lexicon.positive_words if positivity else lexicon.negative_words
+
+def expand_opinion(index, opinion, positivity, lexicon, mode, limit=None):
+    """
+    Words to OR with the opinion under an expansion mode.
+    Args:
+        index: Postings index.
+        opinion (str): The opinion word.
+        positivity (bool): The opinion's polarity, as determined from the lexicons.
+        lexicon (LexiconMatcher): The compiled positive/negative lexicons.
+        mode (str): "lexicon" or "cooccurrence".
+        limit (int): Most words to add (None: every lexicon word, or DEFAULT_NEIGHBOURS neighbours).
+    Returns:
+        list: The added words, best first; the opinion itself is not included.
+    Raises:
+        ValueError: For an unknown mode, or an opinion that is in neither lexicon.
+    """
+    words = expansion_candidates(opinion, positivity, lexicon, mode)
+    if mode == "lexicon":
+        return lexicon_expansion({word: index.doc_freq(word) for word in words}, opinion, limit)
+    return nearest_neighbours(*cooccurrence_counts(index, opinion, words), DEFAULT_NEIGHBOURS if limit is None else limit)
@@ -0,0 +1,88 @@
+import numpy as np
+
+''' Phrase and proximity matching over a positional postings index
+
+Every occurrence of a term is packed into a single sortable int64 key,
+review_id * POSITION_SPAN + token_position, so position-list intersection across
+all reviews at once reduces to sorted-array intersection and searchsorted.
+'''
+
+# Larger than any token position, so keys of different reviews never collide
+POSITION_SPAN = 1 << 32
+
+def occurrences(index, term):
+    ''' Sorted occurrence keys of a term across every review '''
+    indices, positions = index.get_positions(term)
+    if len(indices) == 0:
+        return np.empty(0, dtype=np.int64)
+    counts = [len(review_positions) for review_positions in positions]
+    return np.repeat(indices, counts) * POSITION_SPAN + np.concatenate(positions)
+
+def phrase_occurrences(index, terms):
+    """
+    Finds every occurrence of an exact phrase.
+    Args:
+        index: A positional index (PostingsReader or SegmentedIndex).
+        terms (list): The phrase, one token per element.
+    Returns:
+        np.ndarray: Sorted occurrence keys of the phrase's first token.
+    """
+    keys = occurrences(index, terms[0])
+    for offset, term in enumerate(terms[1:], start=1):
+        if len(keys) == 0:
+            break
+        # Shift each later token back onto the position where the phrase would start
+        keys = np.intersect1d(keys, occurrences(index, term) - offset, assume_unique=True)
+    return keys
+
+def near(keys_a, keys_b, window, span=1, span_b=1):
+    """
+    Keeps the occurrences in keys_a that have an occurrence in keys_b within window tokens.
+    Args:
+        keys_a (np.ndarray): Sorted occurrence keys.
+        keys_b (np.ndarray): Sorted occurrence keys.
+        window (int): Maximum distance in tokens.
+        span (int): Length in tokens of each keys_a occurrence (e.g. a phrase); distances
+            after it are measured from its last token.
+        span_b (int): Length in tokens of each keys_b occurrence; distances before keys_a are
+            measured from its last token.
+    Returns:
+        np.ndarray: The matching subset of keys_a.
+    """
+    if len(keys_a) == 0 or len(keys_b) == 0:
+        return np.empty(0, dtype=np.int64)
+    # Nearest neighbour of each key_a in keys_b, on either side
+    insert_at = np.searchsorted(keys_b, keys_a)
+    after = keys_b[np.minimum(insert_at, len(keys_b) - 1)]
+    before = keys_b[np.maximum(insert_at - 1, 0)]
+    after_distance = np.where(insert_at < len(keys_b), np.maximum(after - keys_a - (span - 1), 0), window + 1)
+    before_distance = np.where(insert_at > 0, np.maximum(keys_a - before - (span_b - 1), 0), window + 1)
+    return keys_a[np.minimum(after_distance, before_distance) <= window]
+
+def review_ids(keys):
+    ''' Sorted, unique review IDs of a set of occurrence keys '''
+    return np.unique(keys // POSITION_SPAN)
+
+def positional_filter(index, result, aspect1, aspect2, opinion, phrase=False, window=None):
+    """
+    Narrows a baseline result to reviews matching the aspect pair as a phrase and/or
+    mentioning the opinion within a window of the aspect.
+    Args:
+        index: A positional index (PostingsReader or SegmentedIndex).
+        result (list): Review IDs from the baseline Boolean search.
+        aspect1 (str): First word of the aspect.
+        aspect2 (str): Second word of the aspect.
+        opinion (str): The opinion word.
+        phrase (bool): Require "aspect1 aspect2" as an exact phrase.
+        window (int): Require the opinion within this many tokens of the aspect.
+    Returns:
+        list: The review IDs of result that satisfy the constraints.
+    """
+    if phrase:
+        aspect_keys = phrase_occurrences(index, [aspect1, aspect2])
+    else:
+        aspect_keys = np.union1d(occurrences(index, aspect1), occurrences(index, aspect2))
+    if window is not None:
+        aspect_keys = near(aspect_keys, occurrences(index, opinion), window, span=2 if phrase else 1)
+    matches = set(review_ids(aspect_keys).tolist())
+    return [ID for ID in result if ID in matches]
@@ -0,0 +1,374 @@
+import mmap
+import os
+import pickle
+import struct
+from itertools import chain
+import numpy as np
+
+''' Compact, memory-mapped on-disk postings list format
+
+Layout of an index file:
+    [header]        magic, version, flags, number of terms, offsets of the sections below
+    [postings]      per term: varint-encoded gaps between consecutive sorted review IDs
+    [positions]     optional, per term: varint per-review position counts, then the
+                    varint gaps between each review's sorted token positions
+    [frequencies]   optional, per term: varint term frequency in each review, aligned with
+                    the postings (written whenever positions are, for ranked retrieval)
+    [term blob]     every term, utf-8 encoded and concatenated in sorted order
+    [term table]    per term: fixed-width entry pointing into the term blob and the postings
+
+The term table is binary searched in place, so opening an index only maps the file;
+a term's postings are decoded when (and only when) a query asks for them.
+'''
+
+MAGIC = b"NLPIDX01"
+VERSION = 1
+
+HEADER = struct.Struct("<8sIIQQQ")      # magic, version, flags, num_terms, blob_offset, table_offset
+TERM_ENTRY = struct.Struct("<QIIQQ")    # term_offset, term_length, doc_freq, postings_offset, postings_length
+POSITIONAL_TERM_ENTRY = struct.Struct("<QIIQQQQ")   # TERM_ENTRY + positions_offset, positions_length
+
+# Header flags
+FLAG_POSITIONS = 1
+FLAG_FREQUENCIES = 2
+
+# Appended to a term entry when FLAG_FREQUENCIES is set: frequencies_offset, frequencies_length, max_tf
+FREQUENCY_FIELDS = "QQI"
+
+def term_entry_struct(flags):
+    ''' Term table entry layout for an index with the given header flags '''
+    fields = POSITIONAL_TERM_ENTRY.format if flags & FLAG_POSITIONS else TERM_ENTRY.format
+    if flags & FLAG_FREQUENCIES:
+        fields += FREQUENCY_FIELDS
+    return struct.Struct(fields)
+
+def varint_lengths(values):
+    ''' Number of LEB128 bytes each non-negative integer takes '''
+    values = np.asarray(values, dtype=np.uint64)
+    nbytes = np.ones(len(values), dtype=np.int64)
+    remaining = values >> np.uint64(7)
+    while remaining.any():
+        nbytes += remaining > 0
+        remaining >>= np.uint64(7)
+    return nbytes
+
+def encode_varints(values, nbytes=None):
+    """
+    Encodes non-negative integers as LEB128 varints (7 bits per byte, high bit = continuation).
+    Args:
+        values (array-like): Non-negative integers.
+        nbytes (np.ndarray): varint_lengths(values), if already computed.
+    Returns:
+        bytes: The encoded values.
+    """
+    values = np.asarray(values, dtype=np.uint64)
+    if len(values) == 0:
+        return b""
+
+    # Number of bytes needed by each value
+    if nbytes is None:
+        nbytes = varint_lengths(values)
+
+    out = np.empty(int(nbytes.sum()), dtype=np.uint8)
+    starts = np.cumsum(nbytes) - nbytes
+    for k in range(int(nbytes.max())):
+        mask = nbytes > k
+        byte = (values[mask] >> np.uint64(7 * k)) & np.uint64(0x7F)
+        byte |= np.where(nbytes[mask] > k + 1, np.uint64(0x80), np.uint64(0))
+        out[starts[mask] + k] = byte
+    return out.tobytes()
+
+def encode_runs(values, run_lengths):
+    """
+    Varint-encodes many consecutive runs of values (e.g. every term's postings) in one pass.
+    Args:
+        values (np.ndarray): Every run's values, concatenated.
+        run_lengths (np.ndarray): Number of values in each run.
+    Returns:
+        tuple: The encoded bytes, and the byte offset of each run within them (one more
+            entry than runs, ending with the total length).
+    """
+    nbytes = varint_lengths(values)
+    byte_ends = np.concatenate([[0], np.cumsum(nbytes)])
+    offsets = byte_ends[np.concatenate([[0], np.cumsum(run_lengths)])]
+    return encode_varints(values, nbytes), offsets
+
+def run_gaps(values, run_lengths):
+    ''' Gaps between consecutive values, restarting from 0 at the start of every run '''
+    gaps = np.diff(values, prepend=0)
+    starts = (np.cumsum(run_lengths) - run_lengths)[run_lengths > 0]
+    gaps[starts] = values[starts]
+    return gaps
+
+def flatten(sequences):
+    ''' Concatenate sequences of integers into one int64 array, with the length of each '''
+    lengths = np.fromiter(map(len, sequences), dtype=np.int64, count=len(sequences))
+    values = np.fromiter(chain.from_iterable(sequences), dtype=np.int64, count=int(lengths.sum()))
+    return values, lengths
+
+def decode_varints(buffer):
+    """
+    Decodes a buffer of LEB128 varints.
+    Args:
+        buffer (array-like of uint8): The encoded bytes.
+    Returns:
+        np.ndarray: The decoded values as uint64.
+    """
+    buffer = np.asarray(buffer, dtype=np.uint8)
+    if len(buffer) == 0:
+        return np.empty(0, dtype=np.uint64)
+
+    # Every byte without the continuation bit ends a value
+    ends = np.flatnonzero(buffer < 0x80)
+    starts = np.empty(len(ends), dtype=np.int64)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+
+    # Shift each byte by its position within its own value and sum per value
+    byte_position = np.arange(len(buffer)) - np.repeat(starts, ends - starts + 1)
+    shifted = (buffer & 0x7F).astype(np.uint64) << (np.uint64(7) * byte_position.astype(np.uint64))
+    return np.add.reduceat(shifted, starts)
+
+def encode_postings(indices):
+    ''' Delta-encode a sorted list of review IDs as varints '''
+    indices = np.asarray(indices, dtype=np.int64)
+    return encode_varints(np.diff(indices, prepend=0))
+
+def decode_postings(buffer):
+    ''' Decode a delta-encoded varint buffer back into sorted review IDs '''
+    return np.cumsum(decode_varints(buffer)).astype(np.int64)
+
+def encode_positions(positions):
+    ''' Encode one term's per-review position lists: all counts first, then the gaps within each review '''
+    counts = [len(review_positions) for review_positions in positions]
+    gaps = [np.diff(np.asarray(review_positions, dtype=np.int64), prepend=0) for review_positions in positions]
+    return encode_varints(np.concatenate([np.asarray(counts, dtype=np.int64)] + gaps))
+
+def decode_positions(buffer, doc_freq):
+    ''' Decode one term's positions back into a list of sorted position arrays, one per review '''
+    values = decode_varints(buffer).astype(np.int64)
+    counts, gaps = values[:doc_freq], values[doc_freq:]
+    # Running sum of the gaps, restarted at the first position of every review
+    totals = np.cumsum(gaps)
+    starts = np.cumsum(counts) - counts
+    restart = np.repeat(np.concatenate([[0], totals])[starts], counts)
+    return np.split(totals - restart, np.cumsum(counts)[:-1])
+
+def write_postings_list(postings_list, filename, positions_list=None, frequencies_list=None):
+    """
+    Writes a postings list to the binary index format.
+    Args:
+        postings_list (dict): Mapping term -> sorted list of review IDs.
+        filename (str): Path of the index file to write.
+        positions_list (dict): Optional mapping term -> list of token position lists,
+            aligned with the term's review IDs.
+        frequencies_list (dict): Optional mapping term -> term frequency in each of its reviews.
+            Derived from positions_list when omitted.
+    """
+    terms = sorted(postings_list)
+    if frequencies_list is None and positions_list is not None:
+        frequencies_list = {term: [len(review_positions) for review_positions in positions] for term, positions in positions_list.items()}
+    flags = (FLAG_POSITIONS if positions_list is not None else 0) | (FLAG_FREQUENCIES if frequencies_list is not None else 0)
+    entry_struct = term_entry_struct(flags)
+    tmp_filename = filename + ".tmp"
+    with open(tmp_filename, "wb") as f:
+        f.write(b"\0" * HEADER.size)
+
+        # Postings section: every term's gaps encoded in one pass, then sliced per term
+        postings, doc_freqs = flatten([postings_list[term] for term in terms])
+        encoded, offsets = encode_runs(run_gaps(postings, doc_freqs), doc_freqs)
+        entries = list(zip((f.tell() + offsets[:-1]).tolist(), np.diff(offsets).tolist(), doc_freqs.tolist()))
+        f.write(encoded)
+
+        # Positions section: per term, the position count of each of its reviews, then the
+        # gaps within each review
+        position_entries = []
+        if positions_list is not None:
+            review_positions = [review_positions for term in terms for review_positions in positions_list[term]]
+            positions, counts = flatten(review_positions)
+            gaps = run_gaps(positions, counts)
+            # Each term's values are its reviews' counts followed by their gaps
+            review_ends = np.cumsum(doc_freqs)
+            position_ends = np.concatenate([[0], np.cumsum(counts)])
+            num_positions = position_ends[review_ends] - position_ends[review_ends - doc_freqs]
+            run_lengths = doc_freqs + num_positions
+            run_starts = np.cumsum(run_lengths) - run_lengths
+            values = np.empty(int(run_lengths.sum()), dtype=np.int64)
+            values[np.repeat(run_starts - (review_ends - doc_freqs), doc_freqs) + np.arange(len(counts))] = counts
+            position_starts = np.cumsum(num_positions) - num_positions
+            values[np.repeat(run_starts + doc_freqs - position_starts, num_positions) + np.arange(len(gaps))] = gaps
+            encoded, offsets = encode_runs(values, run_lengths)
+            position_entries = list(zip((f.tell() + offsets[:-1]).tolist(), np.diff(offsets).tolist()))
+            f.write(encoded)
+
+        # Frequencies section
+        frequency_entries = []
+        if frequencies_list is not None:
+            frequencies, lengths = flatten([frequencies_list[term] for term in terms])
+            encoded, offsets = encode_runs(frequencies, lengths)
+            max_tfs = np.zeros(len(terms), dtype=np.int64)
+            nonempty = lengths > 0
+            if nonempty.any():
+                max_tfs[nonempty] = np.maximum.reduceat(frequencies, (np.cumsum(lengths) - lengths)[nonempty])
+            frequency_entries = list(zip((f.tell() + offsets[:-1]).tolist(), np.diff(offsets).tolist(), max_tfs.tolist()))
+            f.write(encoded)
+
+        # Term blob
+        blob_offset = f.tell()
+        term_offsets = []
+        for term in terms:
+            encoded_term = term.encode("utf-8")
+            term_offsets.append((f.tell() - blob_offset, len(encoded_term)))
+            f.write(encoded_term)
+
+        # Term table
+        table_offset = f.tell()
+        for i, ((term_offset, term_length), (postings_offset, postings_length, doc_freq)) in enumerate(zip(term_offsets, entries)):
+            fields = [term_offset, term_length, doc_freq, postings_offset, postings_length]
+            if positions_list is not None:
+                fields += position_entries[i]
+            if frequencies_list is not None:
+                fields += frequency_entries[i]
+            f.write(entry_struct.pack(*fields))
+
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, VERSION, flags, len(terms), blob_offset, table_offset))
+
+    # Replace atomically so readers never see a half-written index
+    os.replace(tmp_filename, filename)
+
+class PostingsReader:
+    ''' Read-only, memory-mapped view of an index written by write_postings_list '''
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.flags, self.num_terms, self._blob_offset, self._table_offset = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"'{filename}' is not a postings index (version {VERSION})")
+        self.has_positions = bool(self.flags & FLAG_POSITIONS)
+        self.has_frequencies = bool(self.flags & FLAG_FREQUENCIES)
+        self._entry_struct = term_entry_struct(self.flags)
+        # Frequency fields follow the positions fields when both are present
+        self._frequency_field = len(self._entry_struct.format.lstrip("<")) - len(FREQUENCY_FIELDS)
+
+    def __len__(self):
+        return self.num_terms
+
+    def __contains__(self, term):
+        return self._find(term) is not None
+
+    def _entry(self, i):
+        return self._entry_struct.unpack_from(self._mm, self._table_offset + i * self._entry_struct.size)
+
+    def _term_at(self, entry):
+        start = self._blob_offset + entry[0]
+        return self._mm[start:start + entry[1]]
+
+    def _find(self, term):
+        ''' Binary search the term table, returning the term's entry or None '''
+        key = term.encode("utf-8")
+        lo, hi = 0, self.num_terms
+        while lo < hi:
+            mid = (lo + hi) // 2
+            entry = self._entry(mid)
+            candidate = self._term_at(entry)
+            if candidate < key:
+                lo = mid + 1
+            elif candidate > key:
+                hi = mid
+            else:
+                return entry
+        return None
+
+    def doc_freq(self, term):
+        ''' Number of reviews containing the term, without decoding its postings '''
+        entry = self._find(term)
+        return entry[2] if entry is not None else 0
+
+    def _decode(self, entry):
+        buffer = np.frombuffer(self._mm, dtype=np.uint8, count=entry[4], offset=entry[3])
+        return decode_postings(buffer)
+
+    def get_postings(self, term):
+        ''' Sorted NumPy array of review IDs for a term (empty if absent) '''
+        entry = self._find(term)
+        if entry is None:
+            return np.empty(0, dtype=np.int64)
+        return self._decode(entry)
+
+    def get(self, term, default=None):
+        ''' dict.get equivalent: the sorted list of review IDs for a term '''
+        entry = self._find(term)
+        if entry is None:
+            return default
+        return self._decode(entry).tolist()
+
+    def get_indices(self, term):
+        ''' Retrieve the set of indices for a term from the postings list. '''
+        return set(self.get(term, []))
+
+    def get_positions(self, term):
+        """
+        Retrieves a term's review IDs together with its token positions in each review.
+        Args:
+            term (str): The term to look up.
+        Returns:
+            tuple: Sorted NumPy array of review IDs and a list of sorted position arrays aligned with it.
+        """
+        if not self.has_positions:
+            raise ValueError(f"'{self.filename}' was built without token positions")
+        entry = self._find(term)
+        if entry is None:
+            return np.empty(0, dtype=np.int64), []
+        buffer = np.frombuffer(self._mm, dtype=np.uint8, count=entry[6], offset=entry[5])
+        return self._decode(entry), decode_positions(buffer, entry[2])
+
+    def max_tf(self, term):
+        ''' Highest frequency of the term in any single review, without decoding anything '''
+        if not self.has_frequencies:
+            raise ValueError(f"'{self.filename}' was built without term frequencies")
+        entry = self._find(term)
+        return entry[self._frequency_field + 2] if entry is not None else 0
+
+    def get_frequencies(self, term):
+        """
+        Retrieves a term's review IDs together with its frequency in each review.
+        Args:
+            term (str): The term to look up.
+        Returns:
+            tuple: Sorted NumPy array of review IDs and the aligned int64 array of term frequencies.
+        """
+        if not self.has_frequencies:
+            raise ValueError(f"'{self.filename}' was built without term frequencies")
+        entry = self._find(term)
+        if entry is None:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        offset, length = entry[self._frequency_field], entry[self._frequency_field + 1]
+        buffer = np.frombuffer(self._mm, dtype=np.uint8, count=length, offset=offset)
+        return self._decode(entry), decode_varints(buffer).astype(np.int64)
+
+    def terms(self):
+        ''' Iterate over all terms in sorted order '''
+        for i in range(self.num_terms):
+            yield self._term_at(self._entry(i)).decode("utf-8")
+
+    def items(self):
+        ''' Iterate over (term, sorted list of review IDs), decoding every postings list '''
+        for i in range(self.num_terms):
+            entry = self._entry(i)
+            yield self._term_at(entry).decode("utf-8"), self._decode(entry).tolist()
+
+    def close(self):
+        self._mm.close()
+
+def load_postings_dict(filename):
+    ''' Load a whole postings list as a dict, from either a binary index or a pickle '''
+    if filename.endswith(".idx"):
+        reader = PostingsReader(filename)
+        postings_list = dict(reader.items())
+        reader.close()
+        return postings_list
+    with open(filename, "rb") as f:
+        return pickle.load(f)
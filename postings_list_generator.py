@@ -1,39 +1,165 @@
+import numpy as np
 import pandas as pd
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import heapq
+import os
 import pickle
-import re
+import time
+from postings_format import load_postings_dict, write_postings_list
+import segments
+import sharding
+from text_analysis import tokenize
+from metadata_store import STORE_DIR, count_tokens, to_review_ids, write_lexicon_counts, write_review_store, write_sentiment_bitmaps
 
-def create_postings_list(reviews_segment_df):
-    postings_list = defaultdict(set)  # Use set to avoid duplicate indices
+# Number of reviews tokenized and inverted by a single worker task
+CHUNK_SIZE = 10000
 
-    # Iterate over each review in the df
-    for index, row in reviews_segment_df.iterrows():
-        review_text = row['review_text']
-        
+# Record token positions in posting_list.idx for phrase and proximity queries
+RECORD_POSITIONS = True
+
+def _invert_chunk(chunk, positions=False):
+    """
+    Tokenizes and inverts one chunk of reviews. Runs inside a worker process.
+    Args:
+        chunk (list): List of tuples (review_id, review_text) in ascending ID order.
+        positions (bool): Also record the token positions of each term in each review.
+    Returns:
+        list: Term-sorted list of tuples (term, sorted list of review IDs, aligned list of
+            position lists or None).
+    """
+    chunk_postings = defaultdict(list)
+    chunk_positions = defaultdict(list)
+    for ID, review_text in chunk:
         # Tokenize
-        words = re.findall(r'\b\w+\b', review_text.lower())
-        
-        # Add each word to the postings list with the current review index
-        for word in words:
-            postings_list[word].add(index+2)
-    
-    # Convert defaultdict(set) to a regular dictionary with lists for saving, sort everything
-    postings_list = {word:sorted(list(indices)) for word, indices in sorted(postings_list.items())}
+        words = tokenize(review_text)
+        if positions:
+            review_positions = defaultdict(list)
+            for position, word in enumerate(words):
+                review_positions[word].append(position)
+            for word, word_positions in review_positions.items():
+                chunk_postings[word].append(ID)
+                chunk_positions[word].append(word_positions)
+        else:
+            # Count each term once per review
+            for word in set(words):
+                chunk_postings[word].append(ID)
+    return sorted(
+        (term, indices, chunk_positions[term] if positions else None)
+        for term, indices in chunk_postings.items()
+    )
+
+def _merge_chunk_postings(chunk_results):
+    """
+    K-way merges the term-sorted runs of every chunk into the final postings list in one pass.
+    Chunks cover ascending, disjoint ID ranges, so the ID lists of a term are concatenated in chunk order.
+    Args:
+        chunk_results (list): Output of _invert_chunk for each chunk, in chunk order.
+    Returns:
+        tuple: Postings list mapping term -> sorted list of review IDs, and positions list
+            mapping term -> aligned position lists (empty if positions were not recorded).
+    """
+    runs = [
+        ((term, chunk_no, indices, positions) for term, indices, positions in result)
+        for chunk_no, result in enumerate(chunk_results)
+    ]
+    postings_list = {}
+    positions_list = {}
+    for term, _, indices, positions in heapq.merge(*runs):
+        if term in postings_list:
+            postings_list[term].extend(indices)
+            if positions is not None:
+                positions_list[term].extend(positions)
+        else:
+            postings_list[term] = indices
+            if positions is not None:
+                positions_list[term] = positions
+    return postings_list, positions_list
+
+def create_postings_list(reviews_segment_df, chunk_size=CHUNK_SIZE, workers=None, positions=False):
+    """
+    Builds the postings list by tokenizing and inverting chunks of the corpus in a process pool.
+    Args:
+        reviews_segment_df (DataFrame): The reviews segment.
+        chunk_size (int): Number of reviews per worker task.
+        workers (int): Number of worker processes. Defaults to the CPU count; 1 runs in-process.
+        positions (bool): Also record token positions for phrase and proximity queries.
+    Returns:
+        dict: Postings list mapping term -> sorted list of review IDs (index + 2).
+            With positions=True, a tuple of the postings list and a dict mapping
+            term -> list of token position lists aligned with the term's review IDs.
+    """
+    start_time = time.time()
+
+    # Pair every review text with its ID, sorted so that chunks cover disjoint ID ranges
+    reviews = sorted(zip(
+        to_review_ids(reviews_segment_df.index).tolist(),
+        reviews_segment_df["review_text"].tolist()
+    ))
+    chunks = [reviews[i:i + chunk_size] for i in range(0, len(reviews), chunk_size)]
+
+    # Invert each chunk, in parallel when there is more than one chunk to do
+    invert_chunk = partial(_invert_chunk, positions=positions)
+    workers = workers or os.cpu_count() or 1
+    if workers > 1 and len(chunks) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(chunks))) as executor:
+            chunk_results = list(executor.map(invert_chunk, chunks))
+    else:
+        chunk_results = [invert_chunk(chunk) for chunk in chunks]
+
+    postings_list, positions_list = _merge_chunk_postings(chunk_results)
+
+    elapsed = time.time() - start_time
+    print(f"Indexed {len(reviews)} reviews in {elapsed:.2f} seconds "
+          f"({len(reviews) / max(elapsed, 1e-9):.0f} docs/sec)")
+    if positions:
+        return postings_list, positions_list
     return postings_list
 
 def create_review_metadata(reviews_segment_df):
     """
     Create a metadata dictionary for reviews, keyed by review index.
     """
-    metadata = {}
+    ratings = reviews_segment_df["customer_review_rating"] if "customer_review_rating" in reviews_segment_df else None
+    texts = reviews_segment_df["review_text"] if "review_text" in reviews_segment_df else None
 
-    for index, row in reviews_segment_df.iterrows():
-        metadata[index+2] = {
-            "customer_review_rating": row.get("customer_review_rating", None), 
-            "text": row.get("review_text", ""),  
+    metadata = {}
+    for position, ID in enumerate(to_review_ids(reviews_segment_df.index).tolist()):
+        metadata[ID] = {
+            "customer_review_rating": ratings.iat[position] if ratings is not None else None,
+            "text": texts.iat[position] if texts is not None else "",
         }
     return metadata
 
+def create_review_store(reviews_segment_df, directory=STORE_DIR):
+    ''' Write the columnar review metadata store (ratings, document lengths, customer IDs, lazily decoded texts) '''
+    columns = {
+        "ratings": pd.to_numeric(reviews_segment_df["customer_review_rating"], errors="coerce").fillna(-1).astype(int).to_numpy(),
+        "doc_lengths": np.asarray(count_tokens(reviews_segment_df["review_text"].tolist()), dtype=np.int32),
+    }
+    if "customer_id" in reviews_segment_df:
+        columns["customer_id"] = reviews_segment_df["customer_id"].astype(str).to_numpy()
+    write_review_store(
+        to_review_ids(reviews_segment_df.index),
+        reviews_segment_df["review_text"].tolist(),
+        directory,
+        **columns
+    )
+
+def build_shard(reviews_segment_df, directory):
+    ''' Write one shard's postings (posting_list.idx) and review store with its sentiment bitmaps and lexicon counts '''
+    if RECORD_POSITIONS:
+        postings_list, positions_list = create_postings_list(reviews_segment_df, positions=True)
+    else:
+        postings_list, positions_list = create_postings_list(reviews_segment_df), None
+    write_postings_list(postings_list, os.path.join(directory, "posting_list.idx"), positions_list)
+
+    store_directory = os.path.join(directory, STORE_DIR)
+    create_review_store(reviews_segment_df, store_directory)
+    write_sentiment_bitmaps(store_directory)
+    write_lexicon_counts(store_directory)
+
 def run_diagnostic(posting_filename, metadata_fileame):
     # Read data into variable
     with open("reviews_segment.pkl", "rb") as f:
@@ -46,10 +172,9 @@ def run_diagnostic(posting_filename, metadata_fileame):
     print(f"reviews segment sample: {reviews_segment_df.head()}")
 
     # Read data into variable
-    with open("posting_list.pkl", "rb") as f:
-        posting_list = pickle.load(f)
+    posting_list = load_postings_dict(posting_filename)
     # Check the structure of posting_list
-    print(f"posting_list.pkl: {type(posting_list)}")
+    print(f"{posting_filename}: {type(posting_list)}")
     # Create DF from Pickle
     posting_list_df = pd.DataFrame(list(posting_list.items()), columns=["Word", "Review_IDs"])
     # Sample posting list
@@ -103,34 +228,46 @@ def custom_diagnostic(posting_list_df, review_metadata_df):
 
 def main():
 
-    # Regenerate posting_list.pkl and review_metadata.pkl, or run diagnostic
-    diagnostic:bool = None
-    while(diagnostic == None):
-        user_input = input("Regenerate: 0\nDiagnostic: 1\nPlease enter 0 or 1: ")
+    # Regenerate posting_list.idx and review_metadata.pkl, run diagnostic, or maintain segments
+    mode:str = None
+    while(mode == None):
+        user_input = input("Regenerate: 0\nDiagnostic: 1\nAppend reviews: 2\nCompact segments: 3\nDelete reviews: 4\nRecount lexicon hits: 5\nRegenerate sharded: 6\nPlease enter 0-6: ")
         if user_input == '0':
             print("Regenerating... \n")
-            diagnostic = False
+            mode = "regenerate"
         elif user_input == '1':
             print("Running Diagnostic...\n")
-            diagnostic = True
+            mode = "diagnostic"
+        elif user_input == '2':
+            mode = "append"
+        elif user_input == '3':
+            mode = "compact"
+        elif user_input == '4':
+            mode = "delete"
+        elif user_input == '5':
+            mode = "lexicon"
+        elif user_input == '6':
+            mode = "shard"
         elif user_input == 'exit':
             return -1
         else:
             print("Invalid Input\n")
             continue
 
-    if not diagnostic:
+    if mode == "regenerate":
         # Load the reviews_segment
         reviews_segment_df = pd.read_pickle("reviews_segment.pkl")
         
         # Create the postings list
-        postings_list = create_postings_list(reviews_segment_df)
+        if RECORD_POSITIONS:
+            postings_list, positions_list = create_postings_list(reviews_segment_df, positions=True)
+        else:
+            postings_list, positions_list = create_postings_list(reviews_segment_df), None
         
-        # Save the postings list to a file
-        with open("posting_list.pkl", "wb") as f:
-            pickle.dump(postings_list, f)
+        # Save the postings list to the memory-mapped binary index
+        write_postings_list(postings_list, "posting_list.idx", positions_list)
         
-        print("Postings list created and saved as 'posting_list.pkl'")
+        print("Postings list created and saved as 'posting_list.idx'")
 
         # Create the review metadata
         review_metadata = create_review_metadata(reviews_segment_df)
@@ -141,13 +278,73 @@ def main():
 
         print("Metadata saved as 'review_metadata.pkl'")
 
+        # Create the columnar metadata store used by the search and classifier
+        create_review_store(reviews_segment_df)
+        write_sentiment_bitmaps()
+        write_lexicon_counts()
+
+        print(f"Columnar metadata store saved in '{STORE_DIR}'")
+
         # Check ID consistency
         postings_indices = set(index for indices in postings_list.values() for index in indices)
         metadata_indices = set(review_metadata.keys())
         assert postings_indices == metadata_indices, "Index mismatch detected!"
+
+        # reviews_segment.pkl is the source of truth, so appended segments are superseded
+        if segments.load_manifest() is not None:
+            segments.reset_segments()
+            print(f"Cleared appended segments in '{segments.SEGMENTS_DIR}'")
+
+        # The search uses shards whenever they exist, so drop them for the unsharded index
+        if sharding.load_manifest() is not None:
+            sharding.reset_shards()
+            print(f"Cleared shards in '{sharding.SHARDS_DIR}'")
+    elif mode == "shard":
+        num_shards = int(input("Number of shards: "))
+        reviews_segment_df = pd.read_pickle("reviews_segment.pkl")
+
+        # Partition by review ID range; each shard gets its own postings, store and sentiment arrays
+        manifest = sharding.write_shards(reviews_segment_df, num_shards, build_shard)
+        for shard in manifest["shards"]:
+            print(f"Shard '{shard['name']}': reviews {shard['first_id']}-{shard['last_id']} ({shard['num_reviews']})")
+        print(f"{len(manifest['shards'])} shards saved in '{sharding.SHARDS_DIR}'")
+
+        if segments.load_manifest() is not None:
+            segments.reset_segments()
+            print(f"Cleared appended segments in '{segments.SEGMENTS_DIR}'")
+    elif mode == "append":
+        new_reviews_filename = input("Pickle of new reviews to append: ")
+        new_reviews_df = pd.read_pickle(new_reviews_filename)
+        name = segments.append_reviews(new_reviews_df, create_postings_list, create_review_metadata, positions=RECORD_POSITIONS)
+        print(f"Appended {len(new_reviews_df)} reviews as segment '{name}'")
+        for merged_name in segments.maybe_merge():
+            print(f"Merged segments into '{merged_name}'")
+    elif mode == "compact":
+        manifest = segments.load_manifest()
+        if manifest is None or not manifest["segments"]:
+            print("No segments to compact")
+            return
+        merged_name = segments.merge_segments([segment["name"] for segment in manifest["segments"]])
+        print(f"Compacted {len(manifest['segments'])} segments into '{merged_name}'")
+    elif mode == "delete":
+        user_input = input("Review IDs to delete (comma separated): ")
+        ids = [int(ID) for ID in user_input.split(",") if ID.strip()]
+        deleted = segments.delete_reviews(ids)
+        print(f"Recorded tombstones for {len(deleted)} reviews")
+        skipped = sorted(set(ids) - set(deleted))
+        if skipped:
+            print(f"Skipped IDs that are not live reviews: {', '.join(map(str, skipped))}")
+    elif mode == "lexicon":
+        # Rebuild hook for edited positive-words.txt / negative-words.txt
+        write_lexicon_counts()
+        print(f"Lexicon counts recomputed in '{STORE_DIR}'")
+        manifest = sharding.load_manifest()
+        for shard in (manifest or {"shards": []})["shards"]:
+            write_lexicon_counts(os.path.join(sharding.shard_directory(shard["name"]), STORE_DIR))
+        if manifest is not None:
+            print(f"Lexicon counts recomputed in every shard of '{sharding.SHARDS_DIR}'")
     else:
-        run_diagnostic('posting_list.pkl', 'review_metadata.pkl')
+        run_diagnostic('posting_list.idx', 'review_metadata.pkl')
 
 if __name__ == "__main__":
     main()
-
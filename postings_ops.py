@@ -0,0 +1,119 @@
+import numpy as np
+
+''' Boolean operations on sorted NumPy arrays of review IDs
+
+Every operation takes and returns sorted, duplicate-free int64 arrays, so results stay
+ordered end to end and never go through Python sets.
+'''
+
+# Above this length ratio, binary-search the short list into the long one instead of merging
+SKIP_RATIO = 32
+
+# union_many ORs into a bitmap when the inputs hold at least this share of the ID range
+BITMAP_DENSITY = 1 / 16
+
+EMPTY = np.empty(0, dtype=np.int64)
+
+def as_postings(indices):
+    ''' Coerce a list or array of review IDs to the int64 array the operations expect '''
+    return np.asarray(indices, dtype=np.int64)
+
+def intersect(a, b):
+    """
+    Intersects two sorted postings arrays.
+    When one is much shorter, each of its IDs is located in the longer one by binary search
+    (skipping over the long list); otherwise the two are merged linearly.
+    Args:
+        a (np.ndarray): Sorted review IDs.
+        b (np.ndarray): Sorted review IDs.
+    Returns:
+        np.ndarray: Sorted IDs present in both.
+    """
+    if len(a) > len(b):
+        a, b = b, a
+    if len(a) == 0:
+        return EMPTY
+    if len(a) * SKIP_RATIO < len(b):
+        found = np.searchsorted(b, a)
+        found[found == len(b)] = len(b) - 1
+        return a[b[found] == a]
+    return np.intersect1d(a, b, assume_unique=True)
+
+def union(a, b):
+    """
+    Unions two sorted postings arrays.
+    The concatenation is two sorted runs, which the stable sort merges in linear time.
+    Args:
+        a (np.ndarray): Sorted review IDs.
+        b (np.ndarray): Sorted review IDs.
+    Returns:
+        np.ndarray: Sorted IDs present in either.
+    """
+    if len(a) == 0:
+        return b
+    if len(b) == 0:
+        return a
+    merged = np.concatenate([a, b])
+    merged.sort(kind="stable")
+    keep = np.empty(len(merged), dtype=bool)
+    keep[0] = True
+    np.not_equal(merged[1:], merged[:-1], out=keep[1:])
+    return merged[keep]
+
+def difference(a, b):
+    ''' Sorted IDs of a that are not in b '''
+    if len(a) == 0 or len(b) == 0:
+        return a
+    found = np.searchsorted(b, a)
+    found[found == len(b)] = len(b) - 1
+    return a[b[found] != a]
+
+def intersect_many(postings):
+    """
+    Intersects any number of sorted postings arrays, smallest document frequency first,
+    stopping as soon as the running intersection is empty.
+    Args:
+        postings (list): Sorted review ID arrays.
+    Returns:
+        np.ndarray: Sorted IDs present in all of them.
+    """
+    if not postings:
+        return EMPTY
+    postings = sorted(postings, key=len)
+    result = postings[0]
+    for other in postings[1:]:
+        if len(result) == 0:
+            break
+        result = intersect(result, other)
+    return result
+
+def union_many(postings):
+    """
+    Unions any number of sorted postings arrays in one pass, however many there are.
+    Dense inputs are ORed into a bitmap over the ID range. Otherwise all the arrays are
+    concatenated and merged by a stable sort, which finds the sorted runs and merges them
+    k-way (O(n log k), like a heap merge but in C), then duplicates are dropped.
+    Args:
+        postings (list): Sorted review ID arrays.
+    Returns:
+        np.ndarray: Sorted IDs present in any of them.
+    """
+    postings = [other for other in postings if len(other)]
+    if len(postings) <= 2:
+        result = EMPTY
+        for other in postings:
+            result = union(result, other)
+        return result
+    total = sum(len(other) for other in postings)
+    size = max(int(other[-1]) for other in postings) + 1
+    if total >= size * BITMAP_DENSITY:
+        bitmap = np.zeros(size, dtype=bool)
+        for other in postings:
+            bitmap[other] = True
+        return np.flatnonzero(bitmap).astype(np.int64, copy=False)
+    merged = np.concatenate(postings)
+    merged.sort(kind="stable")
+    keep = np.empty(len(merged), dtype=bool)
+    keep[0] = True
+    np.not_equal(merged[1:], merged[:-1], out=keep[1:])
+    return merged[keep]
@@ -0,0 +1,33 @@
+import json
+import urllib.error
+import urllib.request
+
+''' Thin client for query_server.py. Standard library only, so it starts instantly. '''
+
+DEFAULT_SERVER = "http://127.0.0.1:8765"
+
+def search(server=DEFAULT_SERVER, timeout=300, **query):
+    """
+    Sends one query to a running query server.
+    Args:
+        server (str): Base URL of the server.
+        timeout (float): Seconds to wait for the answer.
+        **query: aspect1, aspect2, opinion, method and the optional phrase, near, rating_threshold.
+    Returns:
+        dict: Review ID lists keyed by stage, as returned by boolean_search_help.run_query.
+    Raises:
+        ValueError: If the server rejected the query.
+    """
+    request = urllib.request.Request(
+        server.rstrip("/") + "/search",
+        data=json.dumps(query).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+        method="POST",
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return json.loads(response.read().decode("utf-8"))
+    except urllib.error.HTTPError as e:
+        if e.code == 400:
+            raise ValueError(json.loads(e.read().decode("utf-8"))["error"])
+        raise
@@ -0,0 +1,351 @@
+import re
+from positional import near, occurrences, phrase_occurrences, review_ids
+from postings_ops import EMPTY, as_postings, difference, intersect, union_many
+import text_analysis
+
+''' Boolean query language with a cost-based planner
+
+Grammar (operators are upper case; terms are matched lower case):
+
+    expression := and_expr ("OR" and_expr)*
+    and_expr   := not_expr (["AND"] not_expr)*        adjacent operands are ANDed
+    not_expr   := "NOT" not_expr | near_expr
+    near_expr  := primary ("NEAR/" n primary)*        within n words; positional index only
+    primary    := term | '"' phrase '"' | "(" expression ")"
+
+    e.g. (battery OR charge) AND (life NEAR/3 short) AND NOT refund
+
+parse() builds an operator tree, plan() reorders it using document frequencies so the most
+selective operands run first, and QueryEngine.execute() evaluates it over sorted postings
+arrays, short-circuiting as soon as an intersection is empty.
+'''
+
+class Term:
+    def __init__(self, term):
+        self.term = term
+
+    def __repr__(self):
+        return self.term
+
+class Phrase:
+    def __init__(self, terms):
+        self.terms = terms
+
+    def __repr__(self):
+        return '"' + " ".join(self.terms) + '"'
+
+class Near:
+    def __init__(self, left, right, window):
+        self.left = left
+        self.right = right
+        self.window = window
+
+    def __repr__(self):
+        return f"({self.left!r} NEAR/{self.window} {self.right!r})"
+
+class And:
+    def __init__(self, children):
+        self.children = children
+
+    def __repr__(self):
+        return "(" + " AND ".join(repr(child) for child in self.children) + ")"
+
+class Or:
+    def __init__(self, children):
+        self.children = children
+
+    def __repr__(self):
+        return "(" + " OR ".join(repr(child) for child in self.children) + ")"
+
+class Not:
+    def __init__(self, child):
+        self.child = child
+
+    def __repr__(self):
+        return f"NOT {self.child!r}"
+
+TOKEN_PATTERN = re.compile(r'\s*(?:(\()|(\))|"([^"]*)"|NEAR/(\d+)|(\w+))')
+
+def tokenize(query):
+    ''' Split a query into (kind, value) tokens '''
+    tokens = []
+    position = 0
+    query = query.strip()
+    while position < len(query):
+        match = TOKEN_PATTERN.match(query, position)
+        if match is None or match.end() == position:
+            raise ValueError(f"Unexpected character in query at position {position}: {query[position:]!r}")
+        open_paren, close_paren, phrase, window, word = match.groups()
+        if open_paren:
+            tokens.append(("(", None))
+        elif close_paren:
+            tokens.append((")", None))
+        elif phrase is not None:
+            tokens.append(("PHRASE", text_analysis.tokenize(phrase)))
+        elif window is not None:
+            tokens.append(("NEAR", int(window)))
+        elif word in ("AND", "OR", "NOT"):
+            tokens.append((word, None))
+        else:
+            tokens.append(("TERM", word.lower()))
+        position = match.end()
+    return tokens
+
+class _Parser:
+    ''' Recursive-descent parser over the token list '''
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.position = 0
+
+    def peek(self):
+        return self.tokens[self.position][0] if self.position < len(self.tokens) else None
+
+    def take(self, kind=None):
+        if kind is not None and self.peek() != kind:
+            raise ValueError(f"Expected {kind} in query, found {self.peek() or 'end of query'}")
+        token = self.tokens[self.position]
+        self.position += 1
+        return token
+
+    def expression(self):
+        children = [self.and_expr()]
+        while self.peek() == "OR":
+            self.take()
+            children.append(self.and_expr())
+        return children[0] if len(children) == 1 else Or(children)
+
+    def and_expr(self):
+        children = [self.not_expr()]
+        while self.peek() in ("AND", "NOT", "TERM", "PHRASE", "("):
+            if self.peek() == "AND":
+                self.take()
+            children.append(self.not_expr())
+        return children[0] if len(children) == 1 else And(children)
+
+    def not_expr(self):
+        if self.peek() == "NOT":
+            self.take()
+            return Not(self.not_expr())
+        return self.near_expr()
+
+    def near_expr(self):
+        node = self.primary()
+        while self.peek() == "NEAR":
+            window = self.take()[1]
+            right = self.primary()
+            if not isinstance(node, (Term, Phrase)) or not isinstance(right, (Term, Phrase)):
+                raise ValueError("NEAR only joins terms and quoted phrases")
+            node = Near(node, right, window)
+        return node
+
+    def primary(self):
+        kind = self.peek()
+        if kind == "TERM":
+            return Term(self.take()[1])
+        if kind == "PHRASE":
+            terms = self.take()[1]
+            if not terms:
+                raise ValueError("Empty phrase in query")
+            return Term(terms[0]) if len(terms) == 1 else Phrase(terms)
+        if kind == "(":
+            self.take()
+            node = self.expression()
+            self.take(")")
+            return node
+        raise ValueError(f"Expected a term, phrase or '(' in query, found {kind or 'end of query'}")
+
+def parse(query):
+    ''' Parse a query string into an operator tree '''
+    parser = _Parser(tokenize(query))
+    if parser.peek() is None:
+        raise ValueError("Empty query")
+    node = parser.expression()
+    if parser.peek() is not None:
+        raise ValueError(f"Unexpected {parser.peek()} in query")
+    return node
+
+def method_expression(method, aspect1, aspect2, opinion, expansion=()):
+    ''' The fixed method1/method2/method3 shapes as operator trees; expansion words are ORed with the opinion '''
+    opinion = Or([Term(opinion)] + [Term(word) for word in expansion]) if expansion else Term(opinion)
+    if method == "method1":
+        return Or([Term(aspect1), Term(aspect2), opinion])
+    if method == "method2":
+        return And([Term(aspect1), Term(aspect2), opinion])
+    if method == "method3":
+        return And([Or([Term(aspect1), Term(aspect2)]), opinion])
+    raise ValueError("The method is not supported")
+
+def canonical(node):
+    ''' Equivalent tree with nested AND/OR flattened and operands deduplicated and sorted, so equal queries compare equal '''
+    if isinstance(node, Not):
+        return Not(canonical(node.child))
+    if not isinstance(node, (And, Or)):
+        return node
+    children = {}
+    for child in (canonical(child) for child in node.children):
+        for operand in (child.children if type(child) is type(node) else [child]):
+            children[repr(operand)] = operand
+    if len(children) == 1:
+        return next(iter(children.values()))
+    return type(node)([children[key] for key in sorted(children)])
+
+def query_terms(node):
+    ''' Every term of a tree, left to right (including those under NOT) '''
+    if isinstance(node, Term):
+        return [node.term]
+    if isinstance(node, Phrase):
+        return list(node.terms)
+    if isinstance(node, Near):
+        return query_terms(node.left) + query_terms(node.right)
+    if isinstance(node, Not):
+        return query_terms(node.child)
+    return [term for child in node.children for term in query_terms(child)]
+
+def has_positional(node):
+    ''' Whether a tree contains a phrase or NEAR, which need an index with token positions '''
+    if isinstance(node, (Phrase, Near)):
+        return True
+    if isinstance(node, Not):
+        return has_positional(node.child)
+    if isinstance(node, (And, Or)):
+        return any(has_positional(child) for child in node.children)
+    return False
+
+def positive_terms(node):
+    ''' Terms a matching review must or may contain, i.e. every term not under NOT (used for ranking) '''
+    if isinstance(node, Not):
+        return []
+    if isinstance(node, (And, Or)):
+        return [term for child in node.children for term in positive_terms(child)]
+    return query_terms(node)
+
+class QueryEngine:
+    """
+    Plans and executes operator trees over a postings index.
+    Args:
+        index: PostingsReader, SegmentedIndex or a postings dict.
+        universe (function): Returns the sorted array of every live review ID; only called
+            for NOT without a positive operand to subtract from.
+    """
+
+    def __init__(self, index, universe):
+        self.index = index
+        self.universe = universe
+        self._num_reviews = None
+
+    def postings(self, term):
+        if hasattr(self.index, "get_postings"):
+            return self.index.get_postings(term)
+        return as_postings(self.index.get(term, []))
+
+    def doc_freq(self, term):
+        if hasattr(self.index, "doc_freq"):
+            return self.index.doc_freq(term)
+        return len(self.index.get(term, []))
+
+    def num_reviews(self):
+        if self._num_reviews is None:
+            self._num_reviews = len(self.universe())
+        return self._num_reviews
+
+    def estimate(self, node):
+        ''' Estimated number of matching reviews (exact for single terms) '''
+        if isinstance(node, Term):
+            return self.doc_freq(node.term)
+        if isinstance(node, Phrase):
+            return min(self.doc_freq(term) for term in node.terms)
+        if isinstance(node, Near):
+            return min(self.estimate(node.left), self.estimate(node.right))
+        if isinstance(node, Not):
+            return max(self.num_reviews() - self.estimate(node.child), 0)
+        estimates = [self.estimate(child) for child in node.children]
+        if isinstance(node, And):
+            positive = [estimate for child, estimate in zip(node.children, estimates) if not isinstance(child, Not)]
+            return min(positive) if positive else min(estimates)
+        return min(sum(estimates), self.num_reviews())
+
+    def matches_nothing(self, node):
+        ''' True only when a tree certainly matches no review (estimates alone are upper bounds) '''
+        if isinstance(node, Term):
+            return self.doc_freq(node.term) == 0
+        if isinstance(node, Phrase):
+            return any(self.doc_freq(term) == 0 for term in node.terms)
+        if isinstance(node, Near):
+            return self.matches_nothing(node.left) or self.matches_nothing(node.right)
+        if isinstance(node, Not):
+            return False
+        if isinstance(node, And):
+            return any(self.matches_nothing(child) for child in node.children if not isinstance(child, Not))
+        return all(self.matches_nothing(child) for child in node.children)
+
+    def plan(self, node):
+        """
+        Cost-based rewrite: flattens nested AND/OR, drops OR operands that match nothing,
+        and orders AND operands so the rarest positive operand runs first and exclusions last.
+        """
+        if isinstance(node, Not):
+            return Not(self.plan(node.child))
+        if not isinstance(node, (And, Or)):
+            return node
+        children = []
+        for child in (self.plan(child) for child in node.children):
+            if type(child) is type(node):
+                children.extend(child.children)
+            else:
+                children.append(child)
+        if isinstance(node, Or):
+            children = [child for child in children if not self.matches_nothing(child)] or children[:1]
+            return Or(sorted(children, key=self.estimate))
+        positive = sorted((child for child in children if not isinstance(child, Not)), key=self.estimate)
+        negative = sorted((child for child in children if isinstance(child, Not)), key=lambda child: -self.estimate(child.child))
+        return And(positive + negative)
+
+    def occurrences(self, node):
+        if isinstance(node, Term):
+            return occurrences(self.index, node.term)
+        return phrase_occurrences(self.index, node.terms)
+
+    def evaluate(self, node):
+        ''' Sorted array of review IDs matching a (planned) tree '''
+        if isinstance(node, Term):
+            return self.postings(node.term)
+        if isinstance(node, Phrase):
+            return review_ids(self.occurrences(node))
+        if isinstance(node, Near):
+            left_span = len(node.left.terms) if isinstance(node.left, Phrase) else 1
+            right_span = len(node.right.terms) if isinstance(node.right, Phrase) else 1
+            keys = near(self.occurrences(node.left), self.occurrences(node.right), node.window, left_span, right_span)
+            return review_ids(keys)
+        if isinstance(node, Not):
+            return difference(self.universe(), self.evaluate(node.child))
+        if isinstance(node, Or):
+            return union_many([self.evaluate(child) for child in node.children])
+
+        # AND: short-circuit on any operand known to match nothing, then on empty intermediates
+        positive = [child for child in node.children if not isinstance(child, Not)]
+        negative = [child for child in node.children if isinstance(child, Not)]
+        if any(self.matches_nothing(child) for child in positive):
+            return EMPTY
+        result = self.evaluate(positive[0]) if positive else self.universe()
+        for child in positive[1:]:
+            if len(result) == 0:
+                return EMPTY
+            result = intersect(result, self.evaluate(child))
+        for child in negative:
+            if len(result) == 0:
+                return EMPTY
+            result = difference(result, self.evaluate(child.child))
+        return result
+
+    def execute(self, node):
+        """
+        Plan and evaluate a tree.
+        Returns:
+            np.ndarray: Sorted review IDs.
+        Raises:
+            ValueError: For a phrase or NEAR over an index without token positions.
+        """
+        if not getattr(self.index, "has_positions", False) and has_positional(node):
+            raise ValueError("Quoted phrases and NEAR need posting_list.idx built with token positions")
+        return self.evaluate(self.plan(node))
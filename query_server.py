@@ -0,0 +1,116 @@
+import argparse
+import json
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from query_client import DEFAULT_SERVER
+import boolean_search_help
+
+''' Long-running local query service
+
+Importing boolean_search_help loads the index, metadata, model and lexicons once; every
+request after that only pays for the search itself. Each client connection is handled on
+its own thread.
+
+    POST /search   {"aspect1": "audio", "aspect2": "quality", "opinion": "poor", "method": "method1",
+                    "phrase": false, "near": null, "rating_threshold": 3}
+                   or {"query": "(battery OR charge) AND NOT refund", "opinion": "poor"}
+                   optionally ranked: {..., "top_k": 10, "classifier_boost": 0.5, "ratio_boost": 0.5}
+                   optionally expanded: {..., "expand": "lexicon" | "cooccurrence", "expand_limit": 50}
+                   -> {"result": [...], "combined_result": [...], "elapsed": 0.012,
+                       "pipeline": [{"stage": "M1_result", "input": 412, "output": 198, ...}, ...]}
+                      ("stage_outputs": true returns M1_result, M2_result and M3_result instead of "pipeline")
+                      (+ "ranked_result", "ranked_scores" when top_k is given,
+                       + "snippets": [{"ID": 17, "snippet": "...", "highlights": [[4, 9], ...]}, ...] with "snippets": true,
+                       + "expansion": ["awful", ...] with "expand")
+    GET  /health   -> {"status": "ok"}
+    GET  /stats    -> hit/miss counters of the postings and result caches
+    GET  /metrics  -> per-stage latency and candidate-set histograms in Prometheus text format
+                      (started with --metrics); /metrics.json -> the same as a JSON report
+'''
+
+QUERY_FIELDS = (
+    "aspect1", "aspect2", "opinion", "method", "phrase", "near", "rating_threshold", "query",
+    "top_k", "classifier_boost", "ratio_boost", "stage_outputs", "snippets", "expand", "expand_limit",
+)
+
+class QueryHandler(BaseHTTPRequestHandler):
+
+    def _send_json(self, status, payload):
+        self._send(status, json.dumps(payload).encode("utf-8"), "application/json")
+
+    def _send(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._send_json(200, {"status": "ok"})
+        elif self.path == "/stats":
+            self._send_json(200, boolean_search_help.cache_stats())
+        elif self.path in ("/metrics", "/metrics.json"):
+            metrics = boolean_search_help.search_metrics
+            if not metrics.enabled:
+                self._send_json(404, {"error": "Metrics are off: start the server with --metrics"})
+                return
+            boolean_search_help.collect_shard_metrics()
+            if self.path == "/metrics":
+                self._send(200, metrics.prometheus_text().encode("utf-8"), "text/plain; version=0.0.4")
+            else:
+                self._send_json(200, metrics.report())
+        else:
+            self._send_json(404, {"error": f"Unknown path '{self.path}'"})
+
+    def do_POST(self):
+        if self.path != "/search":
+            self._send_json(404, {"error": f"Unknown path '{self.path}'"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            query = json.loads(self.rfile.read(length).decode("utf-8"))
+            query = {field: query[field] for field in QUERY_FIELDS if query.get(field) is not None}
+            start_time = time.time()
+            results = boolean_search_help.run_query(**query)
+            results["elapsed"] = time.time() - start_time
+        except (ValueError, TypeError, KeyError) as e:
+            self._send_json(400, {"error": str(e)})
+            return
+        self._send_json(200, results)
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+def serve(host="127.0.0.1", port=8765, quiet=False):
+    ''' Serve queries until interrupted '''
+    server = ThreadingHTTPServer((host, port), QueryHandler)
+    server.quiet = quiet
+    print(f"Query server listening on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+def main():
+    default_host, default_port = DEFAULT_SERVER.rsplit("//", 1)[1].split(":")
+    parser = argparse.ArgumentParser(description="Serve boolean search queries from artifacts loaded once.")
+    parser.add_argument("--host", type=str, default=default_host, help="Interface to listen on")
+    parser.add_argument("--port", type=int, default=int(default_port), help="Port to listen on")
+    parser.add_argument("--quiet", action="store_true", help="Do not log each request")
+    parser.add_argument("--metrics", action="store_true", help="Record per-stage metrics and serve them on /metrics")
+    parser.add_argument("--metrics-stages", type=str, default=None, help="Comma-separated stages to record (default all)")
+    parser.add_argument("--trace-memory", action="store_true", help="Also record each stage's peak memory (tracemalloc, slower)")
+    args = parser.parse_args()
+    if args.metrics:
+        try:
+            boolean_search_help.search_metrics.enable(boolean_search_help.parse_metric_stages(args.metrics_stages), args.trace_memory)
+        except ValueError as e:
+            parser.error(str(e))
+    serve(args.host, args.port, args.quiet)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+import math
+import numpy as np
+from postings_ops import EMPTY
+
+''' BM25 top-k ranking with MaxScore pruning
+
+Scores are accumulated term at a time, highest-impact term first. Each term has an upper
+bound on what it can add to any review (from its idf and the max_tf stored in the index),
+and each boost (e.g. classifier probability) adds at most its weight. Once the k-th best
+score so far beats the bounds of everything still to come, no new review can reach the
+top-k, so later terms only update the surviving candidates, and candidates that can no
+longer catch up are dropped before the next term or boost is applied. Boosts, the
+expensive part, are therefore only computed for the few candidates that are left.
+'''
+
+# BM25 parameters (Robertson/Sparck Jones defaults)
+K1 = 1.2
+B = 0.75
+
+DEFAULT_TOP_K = 10
+
+def bm25_idf(doc_freq, num_reviews):
+    ''' Non-negative BM25 inverse document frequency '''
+    return math.log(1 + (num_reviews - doc_freq + 0.5) / (doc_freq + 0.5))
+
+class BM25Ranker:
+    """
+    Ranks reviews for a bag of query terms with BM25 plus optional boosts.
+    Args:
+        index: PostingsReader or SegmentedIndex; term frequencies are used when it stores them,
+            otherwise every occurrence counts once.
+        doc_lengths (function): Maps an array of review IDs to their token counts.
+        num_reviews (int): Number of live reviews.
+        avg_doc_length (float): Mean token count of a review.
+        k1 (float): Term frequency saturation.
+        b (float): Strength of the document length normalization.
+        doc_freqs (dict): Collection-wide document frequency per term, overriding the index's
+            own (a shard ranks with the whole corpus's statistics so its scores compare across shards).
+    """
+
+    def __init__(self, index, doc_lengths, num_reviews, avg_doc_length, k1=K1, b=B, doc_freqs=None):
+        self.index = index
+        self.doc_lengths = doc_lengths
+        self.num_reviews = num_reviews
+        self.avg_doc_length = max(avg_doc_length, 1e-9)
+        self.k1 = k1
+        self.b = b
+        self.doc_freqs = doc_freqs
+        self.has_frequencies = getattr(index, "has_frequencies", False)
+
+    def _saturation(self, frequencies, lengths):
+        norm = self.k1 * (1 - self.b + self.b * lengths / self.avg_doc_length)
+        return frequencies * (self.k1 + 1) / (frequencies + norm)
+
+    def idf(self, term):
+        doc_freq = self.doc_freqs[term] if self.doc_freqs is not None else self.index.doc_freq(term)
+        return bm25_idf(doc_freq, self.num_reviews)
+
+    def upper_bound(self, term):
+        """
+        Most the term can add to any review's score, without decoding its postings.
+        A review holding the term tf times has at least tf tokens, and the saturation is
+        increasing in tf under that constraint, so the bound is reached at tf = max_tf.
+        """
+        max_tf = self.index.max_tf(term) if self.has_frequencies else 1
+        return self.idf(term) * float(self._saturation(max_tf, max_tf))
+
+    def term_scores(self, term, restrict=None):
+        ''' Review IDs containing the term (within restrict) and the term's BM25 contribution to each '''
+        if self.has_frequencies:
+            indices, frequencies = self.index.get_frequencies(term)
+        else:
+            indices = self.index.get_postings(term)
+            frequencies = np.ones(len(indices), dtype=np.int64)
+        if restrict is not None and len(indices):
+            # Binary search each allowed ID in the postings, so a short restrict list stays cheap
+            found = np.searchsorted(indices, restrict)
+            matched = found < len(indices)
+            matched[matched] = indices[found[matched]] == restrict[matched]
+            indices, frequencies = indices[found[matched]], frequencies[found[matched]]
+        return indices, self.idf(term) * self._saturation(frequencies, self.doc_lengths(indices))
+
+    def top_k(self, terms, k=DEFAULT_TOP_K, restrict=None, boosts=(), prune=True):
+        """
+        Finds the k highest scoring reviews.
+        Args:
+            terms (list): Query terms; duplicates and unknown terms are ignored.
+            k (int): Number of reviews to return.
+            restrict (np.ndarray): Optional sorted review IDs the results must come from
+                (e.g. the baseline Boolean result).
+            boosts (list): (weight, function) pairs; the function maps an array of review IDs
+                to values in [0, 1], and weight * value is added to the score.
+            prune (bool): Apply MaxScore pruning. False scores every candidate exhaustively.
+        Returns:
+            tuple: Review IDs and their scores, best first (ties broken by lower ID).
+        """
+        terms = [term for term in dict.fromkeys(terms) if self.index.doc_freq(term) > 0]
+        bounds = {term: self.upper_bound(term) for term in terms}
+        terms.sort(key=lambda term: -bounds[term])
+        boosts = [(weight, boost) for weight, boost in boosts if weight > 0]
+        if k <= 0 or not terms:
+            return EMPTY, np.empty(0)
+
+        # Bound on what the stages from each one onwards can still add (terms, then boosts);
+        # summed afresh rather than subtracted so the last bound is exactly 0
+        stage_bounds = [bounds[term] for term in terms] + [weight for weight, _ in boosts]
+        suffix_bounds = [sum(stage_bounds[i:]) for i in range(len(stage_bounds) + 1)]
+        candidates, scores = EMPTY, np.empty(0)
+        threshold = -np.inf
+
+        for stage, term in enumerate(terms):
+            remaining = suffix_bounds[stage]
+            if prune and len(candidates) >= k and threshold > remaining:
+                # Nothing outside the current candidates can reach the top-k any more,
+                # so only the candidates' postings are looked up and scored
+                indices, contributions = self.term_scores(term, candidates)
+                scores[np.searchsorted(candidates, indices)] += contributions
+            else:
+                indices, contributions = self.term_scores(term, restrict)
+                merged = np.union1d(candidates, indices)
+                merged_scores = np.zeros(len(merged))
+                merged_scores[np.searchsorted(merged, candidates)] = scores
+                merged_scores[np.searchsorted(merged, indices)] += contributions
+                candidates, scores = merged, merged_scores
+            if prune:
+                candidates, scores, threshold = self._prune(candidates, scores, k, suffix_bounds[stage + 1])
+
+        for stage, (weight, boost) in enumerate(boosts, start=len(terms)):
+            scores = scores + weight * np.asarray(boost(candidates), dtype=np.float64)
+            if prune:
+                candidates, scores, threshold = self._prune(candidates, scores, k, suffix_bounds[stage + 1])
+
+        order = np.lexsort((candidates, -scores))[:k]
+        return candidates[order], scores[order]
+
+    def _prune(self, candidates, scores, k, remaining):
+        ''' Drop candidates that cannot reach the current k-th best score; returns the new threshold '''
+        if len(candidates) < k:
+            return candidates, scores, -np.inf
+        threshold = np.partition(scores, len(scores) - k)[len(scores) - k]
+        keep = scores + remaining >= threshold
+        return candidates[keep], scores[keep], threshold
@@ -0,0 +1,130 @@
+import csv
+import json
+import os
+import numpy as np
+
+''' Streaming export of search results with their review data attached
+
+Results are written a page (PAGE_SIZE reviews) at a time: each page's ratings, texts and
+per-method flags are looked up directly by review ID, written out, and dropped before the
+next page is read, so memory stays flat however large the result is.
+
+    ID, rating, text, <flag>..., [<column>...], [score]
+
+JSONL and CSV need nothing beyond the standard library; Parquet needs pyarrow.
+'''
+
+PAGE_SIZE = 1000
+
+EXPORT_FORMATS = {".jsonl": "jsonl", ".json": "jsonl", ".csv": "csv", ".parquet": "parquet"}
+
+def export_format(filename):
+    ''' Export format implied by a file's extension '''
+    extension = os.path.splitext(filename)[1].lower()
+    if extension not in EXPORT_FORMATS:
+        raise ValueError(f"Cannot export to '{filename}': use one of {', '.join(EXPORT_FORMATS)}")
+    return EXPORT_FORMATS[extension]
+
+def _ratings(review_metadata, ids):
+    ''' Ratings of ids (None where missing), by direct lookup '''
+    if hasattr(review_metadata, "rating"):
+        return [review_metadata.rating(ID) for ID in ids]
+    return [review_metadata[ID].get("customer_review_rating") for ID in ids]
+
+def _texts(review_metadata, ids):
+    if hasattr(review_metadata, "texts"):
+        return review_metadata.texts(ids)
+    return [review_metadata[ID]["text"] for ID in ids]
+
+def review_pages(ids, review_metadata, flags=None, scores=None, page_size=PAGE_SIZE, columns=None):
+    """
+    Yields the export rows of a result one page at a time.
+    Args:
+        ids (array-like): Review IDs in output order.
+        review_metadata: ReviewStore or metadata dict.
+        flags (dict): Column name -> function mapping an array of review IDs to a boolean mask,
+            e.g. whether each review passes M1.
+        scores (array-like): Optional score per ID (ranked results).
+        page_size (int): Reviews per page.
+        columns (dict): Further column name -> function mapping an array of review IDs to a
+            list of values, e.g. snippets.
+    Yields:
+        dict: Column name -> list of values for one page.
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    for start in range(0, len(ids), page_size):
+        page_ids = ids[start:start + page_size]
+        page_id_list = page_ids.tolist()
+        page = {
+            "ID": page_id_list,
+            "rating": _ratings(review_metadata, page_id_list),
+            "text": _texts(review_metadata, page_id_list),
+        }
+        for name, flag in (flags or {}).items():
+            page[name] = np.asarray(flag(page_ids), dtype=bool).tolist()
+        for name, column in (columns or {}).items():
+            page[name] = list(column(page_ids))
+        if scores is not None:
+            page["score"] = np.asarray(scores[start:start + page_size], dtype=np.float64).tolist()
+        yield page
+
+def _page_rows(page):
+    columns = list(page)
+    return [dict(zip(columns, values)) for values in zip(*page.values())]
+
+def export_results(ids, filename, review_metadata, flags=None, scores=None, page_size=PAGE_SIZE, columns=None):
+    """
+    Streams a result to a JSONL, CSV or Parquet file, page by page.
+    The file is written under a temporary name and moved into place when complete.
+    Args:
+        ids (array-like): Review IDs in output order.
+        filename (str): Output path; the extension picks the format (.jsonl, .csv, .parquet).
+        review_metadata: ReviewStore or metadata dict.
+        flags (dict): Column name -> function mapping review IDs to a boolean mask.
+        scores (array-like): Optional score per ID.
+        page_size (int): Reviews per page.
+        columns (dict): Further column name -> function mapping review IDs to a list of values.
+    Returns:
+        int: Number of reviews written.
+    """
+    file_format = export_format(filename)
+    tmp_filename = filename + ".tmp"
+    pages = review_pages(ids, review_metadata, flags, scores, page_size, columns)
+    written = 0
+
+    if file_format == "parquet":
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ValueError("Parquet export needs pyarrow (pip install pyarrow); use .jsonl or .csv instead")
+        writer = None
+        try:
+            for page in pages:
+                table = pa.Table.from_pydict(page)
+                if writer is None:
+                    writer = pq.ParquetWriter(tmp_filename, table.schema)
+                writer.write_table(table)
+                written += len(page["ID"])
+        finally:
+            if writer is not None:
+                writer.close()
+        if writer is None:
+            # Empty result: still leave a valid file with just the ID column
+            pq.write_table(pa.Table.from_pydict({"ID": pa.array([], type=pa.int64())}), tmp_filename)
+    else:
+        with open(tmp_filename, "w", encoding="utf-8", newline="") as f:
+            writer = None
+            for page in pages:
+                if file_format == "jsonl":
+                    for row in _page_rows(page):
+                        f.write(json.dumps(row, ensure_ascii=False) + "\n")
+                else:
+                    if writer is None:
+                        writer = csv.DictWriter(f, fieldnames=list(page))
+                        writer.writeheader()
+                    writer.writerows(_page_rows(page))
+                written += len(page["ID"])
+
+    os.replace(tmp_filename, filename)
+    return written
@@ -0,0 +1,146 @@
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+''' Memory-bounded LRU caches for the search path
+
+boolean_search_help keeps two of these: decoded postings per term (CachedPostings) and
+finished stage results per normalized query. Both are emptied whenever artifact_stamp()
+reports that an index, metadata or model file was regenerated.
+'''
+
+def sizeof(value):
+    ''' Approximate memory footprint of a cached value in bytes '''
+    if hasattr(value, "nbytes"):
+        return int(value.nbytes)
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(sizeof(item) for item in value)
+    return sys.getsizeof(value)
+
+class LRUCache:
+    """
+    Least-recently-used cache bounded by entry count and/or approximate bytes, with hit/miss counters.
+    Safe to share between the query server's threads.
+    Args:
+        max_items (int): Evict beyond this many entries (None for no limit).
+        max_bytes (int): Evict beyond this many bytes, as measured by sizeof (None for no limit).
+    """
+
+    def __init__(self, max_items=None, max_bytes=None):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][0]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        size = sizeof(value)
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[1]
+            # A value larger than the whole budget is not worth evicting everything for
+            if self.max_bytes is not None and size > self.max_bytes:
+                return
+            self._entries[key] = (value, size)
+            self._bytes += size
+            while self._entries and (
+                (self.max_items is not None and len(self._entries) > self.max_items)
+                or (self.max_bytes is not None and self._bytes > self.max_bytes)
+            ):
+                self._bytes -= self._entries.popitem(last=False)[1][1]
+                self.evictions += 1
+
+    def get_or_compute(self, key, compute):
+        ''' Cached value of key, computing and storing it on a miss '''
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        ''' Hit/miss counters and current size '''
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+class CachedPostings:
+    """
+    Wraps a postings index so decoded postings, positions and frequencies are served from an LRU cache.
+    Anything other than those lookups is passed straight through.
+    Args:
+        index: PostingsReader or SegmentedIndex.
+        cache (LRUCache): Shared cache of decoded terms.
+    """
+
+    def __init__(self, index, cache):
+        self.index = index
+        self.cache = cache
+
+    def __getattr__(self, name):
+        return getattr(self.index, name)
+
+    def get_postings(self, term):
+        return self.cache.get_or_compute(("postings", term), lambda: self.index.get_postings(term))
+
+    def get_positions(self, term):
+        return self.cache.get_or_compute(("positions", term), lambda: self.index.get_positions(term))
+
+    def get_frequencies(self, term):
+        return self.cache.get_or_compute(("frequencies", term), lambda: self.index.get_frequencies(term))
+
+    def get(self, term, default=None):
+        postings = self.get_postings(term)
+        return postings.tolist() if len(postings) else default
+
+    def get_indices(self, term):
+        return set(self.get_postings(term).tolist())
+
+def artifact_stamp(paths):
+    """
+    Cheap fingerprint of the files (and directory contents) the search depends on.
+    Args:
+        paths (list): Files or directories; missing ones are recorded as missing.
+    Returns:
+        tuple: (path, size, modification time) of every file; changes whenever one is regenerated.
+    """
+    stamp = []
+    for path in paths:
+        if os.path.isdir(path):
+            files = sorted(os.path.join(path, name) for name in os.listdir(path))
+        else:
+            files = [path]
+        for filename in files:
+            try:
+                status = os.stat(filename)
+                stamp.append((filename, status.st_size, status.st_mtime_ns))
+            except FileNotFoundError:
+                stamp.append((filename, None, None))
+    return tuple(stamp)
@@ -0,0 +1,357 @@
+import json
+import math
+import os
+import pickle
+import shutil
+import numpy as np
+from postings_format import PostingsReader, write_postings_list
+from metadata_store import to_segment_index
+
+''' Segment-based incremental indexing
+
+The full rebuild in postings_list_generator produces the base index (posting_list.idx,
+review_metadata.pkl). Reviews added afterwards are written into small immutable segments
+under SEGMENTS_DIR, recorded in manifest.json in the order they were created:
+
+    {
+        "next_id": 5002,
+        "next_segment": 3,
+        "segments": [{"name": "seg_000001", "num_reviews": 40}, ...],
+        "tombstones": {"base": [17, 18], "seg_000001": [4991]}
+    }
+
+Segments are never modified. Deleting a live review records a tombstone against every segment
+created before the delete; updating a review tombstones the old copy and appends the new
+one under the same ID. merge_segments compacts segments into one, dropping tombstoned
+reviews, and maybe_merge applies a tiered merge policy in the style of a log-structured index.
+Tombstones are sets of IDs in memory (load_manifest) and sorted lists on disk (save_manifest).
+'''
+
+SEGMENTS_DIR = "segments"
+MANIFEST = "manifest.json"
+BASE = "base"
+
+# Merge once this many segments fall into the same size tier
+MERGE_FACTOR = 4
+
+def manifest_path(segments_dir=SEGMENTS_DIR):
+    return os.path.join(segments_dir, MANIFEST)
+
+def load_manifest(segments_dir=SEGMENTS_DIR):
+    ''' Load the segment manifest, or None if no segments have been written '''
+    path = manifest_path(segments_dir)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    manifest["tombstones"] = {name: set(ids) for name, ids in manifest["tombstones"].items()}
+    return manifest
+
+def save_manifest(manifest, segments_dir=SEGMENTS_DIR):
+    ''' Atomically replace the segment manifest '''
+    os.makedirs(segments_dir, exist_ok=True)
+    tmp_path = manifest_path(segments_dir) + ".tmp"
+    tombstones = {name: sorted(ids) for name, ids in manifest["tombstones"].items()}
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(dict(manifest, tombstones=tombstones), f, indent=2)
+    os.replace(tmp_path, manifest_path(segments_dir))
+
+def new_manifest(base_metadata_filename="review_metadata.pkl"):
+    ''' Start a manifest whose appended IDs continue after the base index '''
+    with open(base_metadata_filename, "rb") as f:
+        base_metadata = pickle.load(f)
+    return {
+        "next_id": max(base_metadata, default=1) + 1,
+        "next_segment": 1,
+        "segments": [],
+        "tombstones": {},
+    }
+
+def reset_segments(segments_dir=SEGMENTS_DIR):
+    ''' Drop every segment, e.g. after a full rebuild of the base index '''
+    if os.path.isdir(segments_dir):
+        shutil.rmtree(segments_dir)
+
+def segment_files(name, segments_dir=SEGMENTS_DIR):
+    ''' Paths of a segment's postings index and metadata '''
+    directory = os.path.join(segments_dir, name)
+    return os.path.join(directory, "posting_list.idx"), os.path.join(directory, "review_metadata.pkl")
+
+def write_segment(manifest, postings_list, review_metadata, segments_dir=SEGMENTS_DIR, positions_list=None):
+    """
+    Writes a new immutable segment and registers it as the newest one in the manifest.
+    Args:
+        manifest (dict): The segment manifest. Updated in place but not saved.
+        postings_list (dict): Mapping term -> sorted list of review IDs.
+        review_metadata (dict): Metadata keyed by review ID.
+        segments_dir (str): Directory holding the segments.
+        positions_list (dict): Optional token positions aligned with the postings.
+    Returns:
+        str: Name of the new segment.
+    """
+    name = f"seg_{manifest['next_segment']:06d}"
+    manifest["next_segment"] += 1
+    postings_filename, metadata_filename = segment_files(name, segments_dir)
+    os.makedirs(os.path.dirname(postings_filename), exist_ok=True)
+    write_postings_list(postings_list, postings_filename, positions_list)
+    with open(metadata_filename, "wb") as f:
+        pickle.dump(review_metadata, f)
+    manifest["segments"].append({"name": name, "num_reviews": len(review_metadata)})
+    return name
+
+def live_ids(manifest, segments_dir=SEGMENTS_DIR, base_metadata_filename="review_metadata.pkl"):
+    ''' Set of every review ID in the base index or a segment that has not been deleted '''
+    with open(base_metadata_filename, "rb") as f:
+        ids = set(pickle.load(f)) - manifest["tombstones"].get(BASE, set())
+    for segment in manifest["segments"]:
+        with open(segment_files(segment["name"], segments_dir)[1], "rb") as f:
+            ids |= set(pickle.load(f)) - manifest["tombstones"].get(segment["name"], set())
+    return ids
+
+def _tombstone(manifest, ID):
+    ''' Hide an ID in the base and in every existing segment '''
+    for name in [BASE] + [segment["name"] for segment in manifest["segments"]]:
+        manifest["tombstones"].setdefault(name, set()).add(ID)
+
+def append_reviews(new_reviews_df, create_postings_list, create_review_metadata, segments_dir=SEGMENTS_DIR, ids=None, positions=False):
+    """
+    Indexes new reviews into a fresh segment without touching the base index.
+    Args:
+        new_reviews_df (DataFrame): New reviews in the reviews_segment.pkl schema.
+        create_postings_list (function): Postings builder from postings_list_generator.
+        create_review_metadata (function): Metadata builder from postings_list_generator.
+        segments_dir (str): Directory holding the segments.
+        ids (list): Explicit IDs for the reviews (updates). New IDs are assigned when None.
+        positions (bool): Record token positions in the segment.
+    Returns:
+        str: Name of the new segment.
+    """
+    manifest = load_manifest(segments_dir) or new_manifest()
+
+    # Give the new reviews their IDs through the usual index+2 convention
+    new_reviews_df = new_reviews_df.reset_index(drop=True)
+    if ids is None:
+        ids = list(range(manifest["next_id"], manifest["next_id"] + len(new_reviews_df)))
+    else:
+        # Only IDs that are live have an old copy to hide; the others are simply added
+        live = live_ids(manifest, segments_dir)
+        for ID in ids:
+            if ID in live:
+                _tombstone(manifest, ID)
+    new_reviews_df.index = to_segment_index(ids)
+    manifest["next_id"] = max([manifest["next_id"] - 1] + list(ids)) + 1
+
+    if positions:
+        postings_list, positions_list = create_postings_list(new_reviews_df, positions=True)
+    else:
+        postings_list, positions_list = create_postings_list(new_reviews_df), None
+    review_metadata = create_review_metadata(new_reviews_df)
+
+    # Check ID consistency of the new segment only
+    postings_indices = set(index for indices in postings_list.values() for index in indices)
+    assert postings_indices <= set(review_metadata.keys()), "Index mismatch detected!"
+
+    name = write_segment(manifest, postings_list, review_metadata, segments_dir, positions_list)
+    save_manifest(manifest, segments_dir)
+    return name
+
+def update_reviews(updated_reviews_df, ids, create_postings_list, create_review_metadata, segments_dir=SEGMENTS_DIR, positions=False):
+    ''' Replace existing reviews: tombstone the old copies and append the new text under the same IDs '''
+    return append_reviews(updated_reviews_df, create_postings_list, create_review_metadata, segments_dir, ids=list(ids), positions=positions)
+
+def delete_reviews(ids, segments_dir=SEGMENTS_DIR):
+    """
+    Deletes reviews by recording tombstones; the data is dropped at the next merge or rebuild.
+    Args:
+        ids (list): Review IDs to delete. IDs that are not live (never indexed or already
+            deleted) are skipped.
+        segments_dir (str): Directory holding the segments.
+    Returns:
+        list: The IDs that were deleted.
+    """
+    manifest = load_manifest(segments_dir) or new_manifest()
+    live = live_ids(manifest, segments_dir)
+    deleted = sorted(set(int(ID) for ID in ids) & live)
+    for ID in deleted:
+        _tombstone(manifest, ID)
+    save_manifest(manifest, segments_dir)
+    return deleted
+
+def merge_segments(names, segments_dir=SEGMENTS_DIR):
+    """
+    Compacts the given segments into a single new segment, dropping tombstoned reviews.
+    Args:
+        names (list): Names of the segments to merge.
+        segments_dir (str): Directory holding the segments.
+    Returns:
+        str: Name of the merged segment.
+    """
+    manifest = load_manifest(segments_dir)
+    names = [segment["name"] for segment in manifest["segments"] if segment["name"] in set(names)]
+
+    readers = [PostingsReader(segment_files(name, segments_dir)[0]) for name in names]
+    keep_positions = all(reader.has_positions for reader in readers)
+
+    # Collect each term's live (ID, positions) pairs; later segments override earlier ones
+    merged = {}
+    merged_metadata = {}
+    for name, reader in zip(names, readers):
+        tombstones = manifest["tombstones"].get(name, set())
+        for term in reader.terms():
+            if keep_positions:
+                indices, positions = reader.get_positions(term)
+                pairs = zip(indices.tolist(), positions)
+            else:
+                pairs = ((ID, None) for ID in reader.get_postings(term).tolist())
+            term_postings = merged.setdefault(term, {})
+            term_postings.update((ID, positions) for ID, positions in pairs if ID not in tombstones)
+        reader.close()
+        with open(segment_files(name, segments_dir)[1], "rb") as f:
+            segment_metadata = pickle.load(f)
+        merged_metadata.update({ID: data for ID, data in segment_metadata.items() if ID not in tombstones})
+
+    merged_postings = {}
+    merged_positions = {} if keep_positions else None
+    for term, term_postings in merged.items():
+        if not term_postings:
+            continue
+        indices = sorted(term_postings)
+        merged_postings[term] = indices
+        if keep_positions:
+            merged_positions[term] = [term_postings[ID].tolist() for ID in indices]
+    merged_name = write_segment(manifest, merged_postings, merged_metadata, segments_dir, merged_positions)
+
+    # The merged segment takes the place of the oldest input
+    merged_entry = manifest["segments"].pop()
+    position = [segment["name"] for segment in manifest["segments"]].index(names[0])
+    manifest["segments"] = [segment for segment in manifest["segments"] if segment["name"] not in names]
+    manifest["segments"].insert(position, merged_entry)
+    for name in names:
+        manifest["tombstones"].pop(name, None)
+    save_manifest(manifest, segments_dir)
+
+    for name in names:
+        shutil.rmtree(os.path.join(segments_dir, name), ignore_errors=True)
+    return merged_name
+
+def maybe_merge(segments_dir=SEGMENTS_DIR, merge_factor=MERGE_FACTOR):
+    """
+    Tiered merge policy: whenever merge_factor segments share a size tier, merge them.
+    Tier = floor(log_merge_factor(num_reviews)), so merged segments move up a tier.
+    Returns:
+        list: Names of the segments created by merging.
+    """
+    merged = []
+    while True:
+        manifest = load_manifest(segments_dir)
+        if manifest is None:
+            return merged
+        tiers = {}
+        for segment in manifest["segments"]:
+            tier = int(math.log(max(segment["num_reviews"], 1), merge_factor))
+            tiers.setdefault(tier, []).append(segment["name"])
+        full_tiers = [names for names in tiers.values() if len(names) >= merge_factor]
+        if not full_tiers:
+            return merged
+        merged.append(merge_segments(full_tiers[0][:merge_factor], segments_dir))
+
+class SegmentedIndex:
+    ''' Query view over the base postings and every live segment, with tombstones applied '''
+
+    def __init__(self, base, segments_dir=SEGMENTS_DIR):
+        self.base = base
+        self.manifest = load_manifest(segments_dir) or {"segments": [], "tombstones": {}}
+        self.readers = [
+            PostingsReader(segment_files(segment["name"], segments_dir)[0])
+            for segment in self.manifest["segments"]
+        ]
+        self.tombstones = [
+            np.array(sorted(self.manifest["tombstones"].get(name, set())), dtype=np.int64)
+            for name in [BASE] + [segment["name"] for segment in self.manifest["segments"]]
+        ]
+
+    @property
+    def has_positions(self):
+        return getattr(self.base, "has_positions", False) and all(reader.has_positions for reader in self.readers)
+
+    @property
+    def has_frequencies(self):
+        return getattr(self.base, "has_frequencies", False) and all(reader.has_frequencies for reader in self.readers)
+
+    def __contains__(self, term):
+        return len(self.get_postings(term)) > 0
+
+    def doc_freq(self, term):
+        ''' Upper bound on the number of live reviews containing the term '''
+        base_freq = self.base.doc_freq(term) if hasattr(self.base, "doc_freq") else len(self.base.get(term, []))
+        return base_freq + sum(reader.doc_freq(term) for reader in self.readers)
+
+    def get_postings(self, term):
+        ''' Sorted NumPy array of live review IDs for a term across all segments '''
+        parts = []
+        sources = [np.asarray(self.base.get(term, []), dtype=np.int64)]
+        sources += [reader.get_postings(term) for reader in self.readers]
+        for indices, tombstones in zip(sources, self.tombstones):
+            if len(tombstones):
+                indices = indices[~np.isin(indices, tombstones)]
+            parts.append(indices)
+        # An updated review can appear in more than one segment under the same ID
+        return np.unique(np.concatenate(parts))
+
+    def get_positions(self, term):
+        ''' Live review IDs and aligned token positions for a term across all segments '''
+        if not self.has_positions:
+            raise ValueError("The index or one of its segments was built without token positions")
+        positions_by_id = {}
+        for source, tombstones in zip([self.base] + self.readers, self.tombstones):
+            indices, positions = source.get_positions(term)
+            live = ~np.isin(indices, tombstones)
+            positions_by_id.update((ID, positions[i]) for i, ID in enumerate(indices.tolist()) if live[i])
+        indices = sorted(positions_by_id)
+        return np.array(indices, dtype=np.int64), [positions_by_id[ID] for ID in indices]
+
+    def max_tf(self, term):
+        ''' Upper bound on the term's frequency in any single live review '''
+        return max(source.max_tf(term) for source in [self.base] + self.readers)
+
+    def get_frequencies(self, term):
+        ''' Live review IDs and aligned term frequencies for a term across all segments '''
+        if not self.has_frequencies:
+            raise ValueError("The index or one of its segments was built without term frequencies")
+        frequencies_by_id = {}
+        for source, tombstones in zip([self.base] + self.readers, self.tombstones):
+            indices, frequencies = source.get_frequencies(term)
+            live = ~np.isin(indices, tombstones)
+            frequencies_by_id.update(zip(indices[live].tolist(), frequencies[live].tolist()))
+        indices = sorted(frequencies_by_id)
+        return np.array(indices, dtype=np.int64), np.array([frequencies_by_id[ID] for ID in indices], dtype=np.int64)
+
+    def get(self, term, default=None):
+        postings = self.get_postings(term)
+        return postings.tolist() if len(postings) else default
+
+    def get_indices(self, term):
+        ''' Retrieve the set of indices for a term from the postings list. '''
+        return set(self.get_postings(term).tolist())
+
+def load_live_metadata(base_metadata, segments_dir=SEGMENTS_DIR):
+    ''' Overlay every live segment's metadata on the base metadata, dropping deleted reviews '''
+    manifest = load_manifest(segments_dir)
+    if manifest is None:
+        return base_metadata
+    deleted = manifest["tombstones"].get(BASE, set())
+    live_metadata = {}
+    for segment in manifest["segments"]:
+        tombstones = manifest["tombstones"].get(segment["name"], set())
+        with open(segment_files(segment["name"], segments_dir)[1], "rb") as f:
+            segment_metadata = pickle.load(f)
+        live_metadata.update({ID: data for ID, data in segment_metadata.items() if ID not in tombstones})
+
+    # The columnar store keeps segment reviews in an overlay rather than in its arrays
+    if hasattr(base_metadata, "overlay"):
+        base_metadata.overlay(live_metadata, deleted)
+        return base_metadata
+    for ID in deleted:
+        base_metadata.pop(ID, None)
+    base_metadata.update(live_metadata)
+    return base_metadata
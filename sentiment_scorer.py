@@ -0,0 +1,170 @@
+import hashlib
+import json
+import os
+import re
+import numpy as np
+from text_analysis import tokenize
+
+''' NumPy-only inference for the sentiment classifier
+
+classifier.save_artifacts exports the trained TfidfVectorizer and MultinomialNB as plain
+arrays (sentiment_scorer.npz): the vocabulary, the IDF weights, the per-class feature
+log-probabilities and class log-priors, and the analyzer settings. SentimentScorer rebuilds
+the TF-IDF features of a batch of texts and the Naive Bayes decision from them with a sparse
+dot product (np.bincount over the nonzero entries), in the same order of operations as
+sklearn, so its predictions match the pickled model's exactly. boolean_search_help uses it
+for M2 when it is current, without importing sklearn or unpickling the model.
+
+The prediction cache of classifier.main lives here too, for the same reason.
+'''
+
+SCORER_FILENAME = "sentiment_scorer.npz"
+
+# Tokenizers a bundle can name (the vectorizer's tokenizer when it is not its token_pattern)
+TOKENIZERS = {"text_analysis.tokenize": tokenize}
+
+def artifact_fingerprint(model_filename="sentiment_classifier.pkl", tfidf_filename="tfidf_vectorizer.pkl"):
+    ''' Hash of the saved model and vectorizer; cached predictions are stale when it changes '''
+    digest = hashlib.sha1()
+    for filename in (model_filename, tfidf_filename):
+        with open(filename, "rb") as f:
+            digest.update(f.read())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+def load_prediction_cache(cache_filename="sentiment_cache.npz", model_filename="sentiment_classifier.pkl", tfidf_filename="tfidf_vectorizer.pkl"):
+    """
+    Loads cached predictions if they were made by the current model and vectorizer.
+    Returns:
+        tuple: Predictions (int8, -1 = not scored) and positive-class probabilities indexed by
+            review ID, or None if the cache is missing or stale.
+    """
+    if not os.path.exists(cache_filename):
+        return None
+    with np.load(cache_filename) as cache:
+        if str(cache["fingerprint"]) != artifact_fingerprint(model_filename, tfidf_filename):
+            return None
+        return cache["predictions"], cache["probabilities"]
+
+def export_scorer(model, tfidf, tokenizer_name=None, scorer_filename=SCORER_FILENAME, fingerprint=""):
+    """
+    Saves the arrays SentimentScorer needs.
+    Args:
+        model (MultinomialNB): Trained model.
+        tfidf (TfidfVectorizer): Fitted word-analyzer vectorizer without a custom preprocessor.
+        tokenizer_name (str): Key in TOKENIZERS of the vectorizer's tokenizer (None for its token_pattern).
+        scorer_filename (str): Where to save the bundle.
+        fingerprint (str): artifact_fingerprint of the pickles the bundle was exported from.
+    """
+    terms = sorted(tfidf.vocabulary_, key=tfidf.vocabulary_.get)
+    stop_words = tfidf.get_stop_words()
+    settings = {
+        "lowercase": tfidf.lowercase, "token_pattern": tfidf.token_pattern, "tokenizer": tokenizer_name,
+        "stop_words": sorted(stop_words) if stop_words is not None else None, "ngram_range": list(tfidf.ngram_range),
+        "binary": tfidf.binary, "sublinear_tf": tfidf.sublinear_tf, "norm": tfidf.norm, "use_idf": tfidf.use_idf,
+    }
+    np.savez(
+        scorer_filename, terms=np.array(terms, dtype=str), idf=tfidf.idf_ if tfidf.use_idf else np.empty(0),
+        feature_log_prob=model.feature_log_prob_, class_log_prior=model.class_log_prior_, classes=model.classes_,
+        settings=json.dumps(settings), fingerprint=fingerprint,
+    )
+
+def load_scorer(scorer_filename=SCORER_FILENAME, model_filename="sentiment_classifier.pkl", tfidf_filename="tfidf_vectorizer.pkl"):
+    ''' The exported SentimentScorer, or None if it is missing or was not exported from the current model and vectorizer '''
+    if not os.path.exists(scorer_filename):
+        return None
+    with np.load(scorer_filename, allow_pickle=False) as bundle:
+        if str(bundle["fingerprint"]) != artifact_fingerprint(model_filename, tfidf_filename):
+            return None
+        return SentimentScorer({name: bundle[name] for name in bundle.files})
+
+class SentimentScorer:
+    """
+    TF-IDF + multinomial Naive Bayes inference on NumPy arrays.
+    Args:
+        bundle (dict): Arrays saved by export_scorer.
+    """
+
+    def __init__(self, bundle):
+        settings = json.loads(str(bundle["settings"]))
+        self.vocabulary = {term: column for column, term in enumerate(bundle["terms"].tolist())}
+        self.idf = bundle["idf"] if settings["use_idf"] else None
+        self.feature_log_prob = bundle["feature_log_prob"]
+        self.class_log_prior = bundle["class_log_prior"]
+        self.classes_ = bundle["classes"]
+        self.lowercase = settings["lowercase"]
+        if settings["tokenizer"] is not None:
+            self.tokenize = TOKENIZERS[settings["tokenizer"]]
+        else:
+            self.tokenize = re.compile(settings["token_pattern"]).findall
+        self.stop_words = frozenset(settings["stop_words"]) if settings["stop_words"] is not None else None
+        self.ngram_range = tuple(settings["ngram_range"])
+        self.binary = settings["binary"]
+        self.sublinear_tf = settings["sublinear_tf"]
+        self.norm = settings["norm"]
+
+    def analyze(self, text):
+        ''' The terms of a text, as the vectorizer's word analyzer produces them '''
+        tokens = self.tokenize(text.lower() if self.lowercase else text)
+        if self.stop_words is not None:
+            tokens = [token for token in tokens if token not in self.stop_words]
+        min_n, max_n = self.ngram_range
+        if max_n == 1:
+            return tokens
+        terms = list(tokens) if min_n == 1 else []
+        for n in range(max(min_n, 2), min(max_n, len(tokens)) + 1):
+            terms.extend(" ".join(tokens[i:i + n]) for i in range(len(tokens) - n + 1))
+        return terms
+
+    def features(self, texts):
+        """
+        TF-IDF features of texts in coordinate form.
+        Args:
+            texts (list): Raw review texts.
+        Returns:
+            tuple: Row (text index), column and value of every nonzero entry, ordered by row then
+                column like the vectorizer's CSR matrix.
+        """
+        vocabulary = self.vocabulary
+        rows, columns = [], []
+        for row, text in enumerate(texts):
+            text_columns = [vocabulary[term] for term in self.analyze(text) if term in vocabulary]
+            rows.extend([row] * len(text_columns))
+            columns.extend(text_columns)
+
+        # Count each (row, column) pair; np.unique sorts them by row, then column
+        keys, counts = np.unique(np.array(rows, dtype=np.int64) * len(vocabulary) + np.array(columns, dtype=np.int64),
+                                 return_counts=True)
+        rows, columns = np.divmod(keys, len(vocabulary))
+        values = np.ones(len(keys)) if self.binary else counts.astype(np.float64)
+        if self.sublinear_tf:
+            values = np.log(values) + 1
+        if self.idf is not None:
+            values *= self.idf[columns]
+        if self.norm is not None:
+            if self.norm == "l2":
+                norms = np.sqrt(np.bincount(rows, weights=values * values, minlength=len(texts)))
+            else:
+                norms = np.bincount(rows, weights=np.abs(values), minlength=len(texts))
+            norms[norms == 0] = 1
+            values /= norms[rows]
+        return rows, columns, values
+
+    def joint_log_likelihood(self, texts):
+        ''' Per-class joint log-likelihood of each text, shape (len(texts), number of classes) '''
+        rows, columns, values = self.features(texts)
+        likelihood = np.empty((len(texts), len(self.classes_)))
+        for i, feature_log_prob in enumerate(self.feature_log_prob):
+            likelihood[:, i] = np.bincount(rows, weights=values * feature_log_prob[columns], minlength=len(texts))
+        return likelihood + self.class_log_prior
+
+    def predict(self, texts):
+        ''' Predicted class of each text '''
+        return self.classes_[np.argmax(self.joint_log_likelihood(texts), axis=1)]
+
+    def predict_proba(self, texts):
+        ''' Class probabilities of each text, in the order of classes_ '''
+        likelihood = self.joint_log_likelihood(texts)
+        highest = likelihood.max(axis=1, keepdims=True)
+        log_total = highest + np.log(np.exp(likelihood - highest).sum(axis=1, keepdims=True))
+        return np.exp(likelihood - log_total)
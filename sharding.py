@@ -0,0 +1,338 @@
+import json
+import os
+import shutil
+import threading
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from metadata_store import STORE_DIR, ReviewStore, to_review_ids
+
+''' Document-partitioned sharded index with scatter-gather querying
+
+postings_list_generator can split the corpus by review ID range into N shards instead of
+building one index. Every shard is a complete, self-contained index over its own reviews,
+with review IDs unchanged:
+
+    shards/
+        shards.json        {"shards": [{"name": "shard_000", "first_id": 2, "last_id": 2501,
+                                         "num_reviews": 2500}, ...]}
+        shard_000/
+            posting_list.idx
+            review_store/  ratings, sentiment bitmaps, lexicon counts, texts, ...
+        shard_001/
+        ...
+
+The model, vectorizer, prediction cache and lexicons stay shared in the working directory.
+When shards.json exists, boolean_search_help becomes a coordinator: ShardCoordinator keeps
+one worker process per shard with that shard's artifacts loaded, fans each query out to all
+of them at once, and every worker runs the Boolean step and M1/M2/M3 on its own reviews.
+Shards cover ascending, disjoint ID ranges, so their sorted results merge by concatenation;
+ranked results merge by score. Anything that needs collection-wide statistics (BM25 idf and
+average length, opinion expansion) is gathered from the shards first and sent along with the
+query, so a sharded search returns the same results as one index over the whole corpus.
+Segments (appended reviews) apply to the unsharded index only.
+'''
+
+SHARDS_DIR = "shards"
+MANIFEST = "shards.json"
+
+def manifest_path(shards_dir=SHARDS_DIR):
+    return os.path.join(shards_dir, MANIFEST)
+
+def load_manifest(shards_dir=SHARDS_DIR):
+    ''' Load the shard manifest, or None if the index is not sharded '''
+    path = manifest_path(shards_dir)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def save_manifest(manifest, shards_dir=SHARDS_DIR):
+    ''' Atomically replace the shard manifest '''
+    os.makedirs(shards_dir, exist_ok=True)
+    tmp_path = manifest_path(shards_dir) + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, manifest_path(shards_dir))
+
+def reset_shards(shards_dir=SHARDS_DIR):
+    ''' Drop every shard, e.g. after an unsharded rebuild '''
+    if os.path.isdir(shards_dir):
+        shutil.rmtree(shards_dir)
+
+def shard_directory(name, shards_dir=SHARDS_DIR):
+    return os.path.join(shards_dir, name)
+
+def shard_ranges(ids, num_shards):
+    """
+    Splits review IDs into contiguous ranges holding about the same number of reviews.
+    Args:
+        ids (array-like): Review IDs.
+        num_shards (int): Number of ranges wanted.
+    Returns:
+        list: (first ID, last ID) of each non-empty range, in ascending order.
+    """
+    ids = np.unique(np.asarray(ids, dtype=np.int64))
+    return [(int(part[0]), int(part[-1])) for part in np.array_split(ids, max(1, num_shards)) if len(part)]
+
+def write_shards(reviews_segment_df, num_shards, build_shard, shards_dir=SHARDS_DIR):
+    """
+    Partitions the corpus by review ID range and builds every shard.
+    Args:
+        reviews_segment_df (DataFrame): The reviews segment.
+        num_shards (int): Number of shards.
+        build_shard (function): Writes one shard's index and review store, given its part of
+            reviews_segment_df and its directory (from postings_list_generator).
+        shards_dir (str): Directory holding the shards.
+    Returns:
+        dict: The new manifest.
+    """
+    reset_shards(shards_dir)
+    ids = to_review_ids(reviews_segment_df.index)
+    manifest = {"shards": []}
+    for number, (first_id, last_id) in enumerate(shard_ranges(ids, num_shards)):
+        name = f"shard_{number:03d}"
+        shard_df = reviews_segment_df[(ids >= first_id) & (ids <= last_id)]
+        directory = shard_directory(name, shards_dir)
+        os.makedirs(directory, exist_ok=True)
+        build_shard(shard_df, directory)
+        manifest["shards"].append({"name": name, "first_id": first_id, "last_id": last_id, "num_reviews": len(shard_df)})
+    # The manifest goes last, so a half-written set of shards is never searched
+    save_manifest(manifest, shards_dir)
+    return manifest
+
+class ShardedReviews:
+    """
+    Read-only view over every shard's ReviewStore, with the ReviewStore interface the search,
+    exporter and classifier use; each review ID is routed to the shard whose range holds it.
+    Args:
+        manifest (dict): The shard manifest.
+        shards_dir (str): Directory holding the shards.
+    """
+
+    def __init__(self, manifest, shards_dir=SHARDS_DIR):
+        self.first_ids = np.array([shard["first_id"] for shard in manifest["shards"]], dtype=np.int64)
+        self.stores = [
+            ReviewStore(os.path.join(shard_directory(shard["name"], shards_dir), STORE_DIR))
+            for shard in manifest["shards"]
+        ]
+        self._ids = None
+
+    def _shard_numbers(self, ids):
+        return np.maximum(np.searchsorted(self.first_ids, ids, side="right") - 1, 0)
+
+    def _store(self, ID):
+        return self.stores[int(self._shard_numbers([ID])[0])]
+
+    def _gather(self, ids, lookup):
+        ''' Apply lookup (store, ids) -> array or tuple of arrays per shard and reassemble in the order of ids '''
+        ids = np.asarray(ids, dtype=np.int64)
+        numbers = self._shard_numbers(ids)
+        outputs = None
+        for number in np.unique(numbers).tolist():
+            selected = numbers == number
+            parts = lookup(self.stores[number], ids[selected])
+            single = not isinstance(parts, tuple)
+            parts = (parts,) if single else parts
+            if outputs is None:
+                outputs = [np.empty(len(ids), dtype=np.asarray(part).dtype) for part in parts]
+            for output, part in zip(outputs, parts):
+                output[selected] = part
+        if outputs is None:
+            # No IDs: any store returns correctly typed empty arrays
+            return lookup(self.stores[0], ids)
+        return outputs[0] if single else tuple(outputs)
+
+    @property
+    def ratings(self):
+        ''' Ratings indexed by review ID (-1 where there is no review) '''
+        size = max((len(store.ratings) for store in self.stores), default=0)
+        ratings = np.full(size, -1, dtype=np.int8)
+        for store in self.stores:
+            present = np.flatnonzero(np.asarray(store.ratings) >= 0)
+            ratings[present] = store.ratings[present]
+        return ratings
+
+    def sentiment_masks(self, threshold):
+        ''' Positive/negative boolean arrays indexed by review ID, ORed over the shards '''
+        masks = [store.sentiment_masks(threshold) for store in self.stores]
+        size = max((len(positive) for positive, _ in masks), default=0)
+        positive, negative = np.zeros(size, dtype=bool), np.zeros(size, dtype=bool)
+        for shard_positive, shard_negative in masks:
+            positive[:len(shard_positive)] |= shard_positive
+            negative[:len(shard_negative)] |= shard_negative
+        return positive, negative
+
+    def has_lexicon_counts(self, *lexicon_filenames):
+        return all(store.has_lexicon_counts(*lexicon_filenames) for store in self.stores)
+
+    def lexicon_counts(self, ids):
+        return self._gather(ids, lambda store, shard_ids: store.lexicon_counts(shard_ids))
+
+    def doc_lengths(self, ids):
+        return self._gather(ids, lambda store, shard_ids: store.doc_lengths(shard_ids))
+
+    def appended(self, ids):
+        ''' Shards hold no appended reviews '''
+        return np.zeros(len(ids), dtype=bool)
+
+    def token_spans(self, ID):
+        return self._store(ID).token_spans(ID)
+
+    def ids(self):
+        ''' Sorted array of every review ID (the shards' ranges are ascending) '''
+        if self._ids is None:
+            self._ids = np.concatenate([np.empty(0, dtype=np.int64)] + [store.ids() for store in self.stores])
+        return self._ids
+
+    def rating(self, ID):
+        return self._store(ID).rating(ID)
+
+    def text(self, ID):
+        return self._store(ID).text(ID)
+
+    def texts(self, ids):
+        return [self.text(ID) for ID in ids]
+
+    def __contains__(self, ID):
+        return bool(self.stores) and ID in self._store(ID)
+
+    def __len__(self):
+        return len(self.ids())
+
+    def __iter__(self):
+        return iter(self.ids().tolist())
+
+    def keys(self):
+        return self.ids().tolist()
+
+    def __getitem__(self, ID):
+        return self._store(ID)[ID]
+
+    def get(self, ID, default=None):
+        return self[ID] if ID in self else default
+
+def load_sharded_reviews(shards_dir=SHARDS_DIR):
+    ''' ShardedReviews over the current shards, or None if the index is not sharded '''
+    manifest = load_manifest(shards_dir)
+    return ShardedReviews(manifest, shards_dir) if manifest is not None else None
+
+def _load_shard(directory):
+    ''' Worker initializer: load one shard's artifacts into this process's boolean_search_help '''
+    import boolean_search_help
+    boolean_search_help.load_search_artifacts(directory)
+
+def _call_shard(function_name, kwargs):
+    import boolean_search_help
+    return getattr(boolean_search_help, function_name)(**kwargs)
+
+class ShardCoordinator:
+    """
+    One long-lived worker process per shard, each with its shard's artifacts loaded.
+    Workers start on the first scatter, so building a coordinator is cheap.
+    Args:
+        manifest (dict): The shard manifest.
+        shards_dir (str): Directory holding the shards.
+    """
+
+    def __init__(self, manifest, shards_dir=SHARDS_DIR):
+        self.shards = manifest["shards"]
+        self.directories = [shard_directory(shard["name"], shards_dir) for shard in self.shards]
+        self._executors = None
+        self._lock = threading.Lock()
+
+    def _start(self):
+        with self._lock:
+            if self._executors is None:
+                self._executors = [
+                    ProcessPoolExecutor(max_workers=1, initializer=_load_shard, initargs=(directory,))
+                    for directory in self.directories
+                ]
+        return self._executors
+
+    def scatter(self, function_name, **kwargs):
+        """
+        Runs a boolean_search_help function on every shard in parallel.
+        Args:
+            function_name (str): Name of the function, e.g. "shard_search".
+            **kwargs: Its arguments, the same for every shard.
+        Returns:
+            list: Each shard's return value, in shard (ID range) order. The first exception
+                raised by a shard is re-raised here.
+        """
+        futures = [executor.submit(_call_shard, function_name, kwargs) for executor in self._start()]
+        return [future.result() for future in futures]
+
+    def close(self):
+        with self._lock:
+            for executor in self._executors or []:
+                executor.shutdown(wait=False, cancel_futures=True)
+            self._executors = None
+
+def merge_statistics(shard_statistics):
+    """
+    Sums the per-shard counts returned by boolean_search_help.shard_statistics.
+    Returns:
+        dict: num_reviews, total_length, doc_freqs, opinion_freq and cooccurrence for the whole corpus.
+    """
+    merged = {"num_reviews": 0, "total_length": 0, "doc_freqs": {}, "opinion_freq": 0, "cooccurrence": {}}
+    for statistics in shard_statistics:
+        merged["num_reviews"] += statistics["num_reviews"]
+        merged["total_length"] += statistics["total_length"]
+        merged["opinion_freq"] += statistics["opinion_freq"]
+        for term, doc_freq in statistics["doc_freqs"].items():
+            merged["doc_freqs"][term] = merged["doc_freqs"].get(term, 0) + doc_freq
+        for word, (doc_freq, overlap) in statistics["cooccurrence"].items():
+            total_freq, total_overlap = merged["cooccurrence"].get(word, (0, 0))
+            merged["cooccurrence"][word] = (total_freq + doc_freq, total_overlap + overlap)
+    return merged
+
+# Outputs that are sorted review ID lists; a shard's IDs all precede the next shard's
+ID_LIST_OUTPUTS = ("result", "M1_result", "M2_result", "M3_result", "combined_result")
+
+def merge_shard_results(shard_results, top_k=None):
+    """
+    Gathers every shard's run_query output into the output of one search over the whole corpus.
+    Args:
+        shard_results (list): Each shard's shard_search output, in shard order.
+        top_k (int): Number of ranked reviews to keep, when ranked.
+    Returns:
+        dict: The merged run_query output.
+    """
+    # M3 keeps every review when none of them has an agreeing lexicon ratio. That is decided
+    # over the whole baseline: a shard that fell back must not when another shard has matches
+    if any(results["M3_passes"] for results in shard_results):
+        for results in shard_results:
+            if not results["M3_passes"] and results["result"]:
+                results["combined_result"] = []
+                if "M3_result" in results:
+                    results["M3_result"] = []
+
+    merged = {}
+    for name in ID_LIST_OUTPUTS:
+        if name in shard_results[0]:
+            merged[name] = [ID for results in shard_results for ID in results[name]]
+
+    if "pipeline" in shard_results[0]:
+        # Per-stage totals over the shards; shards run in parallel, so elapsed is the slowest one
+        stages = {}
+        for results in shard_results:
+            for step in results["pipeline"]:
+                total = stages.setdefault(step["stage"], {"stage": step["stage"], "input": 0, "output": 0, "cost": 0.0, "elapsed": 0.0})
+                total["input"] += step["input"]
+                total["output"] += step["output"]
+                total["cost"] += step["cost"]
+                total["elapsed"] = max(total["elapsed"], step["elapsed"])
+        merged["pipeline"] = list(stages.values())
+
+    if top_k is not None:
+        ids = np.array([ID for results in shard_results for ID in results["ranked_result"]], dtype=np.int64)
+        scores = np.array([score for results in shard_results for score in results["ranked_scores"]], dtype=np.float64)
+        order = np.lexsort((ids, -scores))[:top_k]
+        merged["ranked_result"] = ids[order].tolist()
+        merged["ranked_scores"] = scores[order].tolist()
+
+    if "snippets" in shard_results[0]:
+        snippets = {snippet["ID"]: snippet for results in shard_results for snippet in results["snippets"]}
+        hits = merged.get("ranked_result", merged["combined_result"])
+        merged["snippets"] = [snippets[ID] for ID in hits]
+    return merged
@@ -0,0 +1,136 @@
+import numpy as np
+from metadata_store import token_spans
+from postings_ops import EMPTY
+
+''' Query-term snippets with highlight offsets
+
+For each hit, the token positions of the query terms come from the positional index and
+are mapped to characters through the review store's token_spans, so neither step
+re-tokenizes the review. The snippet is the SNIPPET_TOKENS-token window holding the most
+distinct query terms (then the most matches), cut from the text on token boundaries.
+'''
+
+# Tokens in a snippet window, and how many of them come before its first match
+SNIPPET_TOKENS = 24
+LEAD_TOKENS = 6
+
+ELLIPSIS = "..."
+
+def match_positions(index, terms, ids):
+    """
+    Token positions of the query terms in each of a set of reviews, from the positional index.
+    Args:
+        index: A positional index (PostingsReader or SegmentedIndex).
+        terms (list): Query terms.
+        ids (np.ndarray): Sorted review IDs.
+    Returns:
+        list: One (positions, term numbers) pair of aligned arrays per ID, sorted by position.
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    per_review = [([], []) for _ in range(len(ids))]
+    for term_number, term in enumerate(dict.fromkeys(terms)):
+        indices, positions = index.get_positions(term)
+        if len(indices) == 0:
+            continue
+        # Binary search the term's postings for the IDs; only their position arrays are used
+        found = np.searchsorted(indices, ids)
+        hits = np.flatnonzero(indices[np.minimum(found, len(indices) - 1)] == ids)
+        for i in hits.tolist():
+            review_positions = np.asarray(positions[found[i]], dtype=np.int64)
+            per_review[i][0].append(review_positions)
+            per_review[i][1].append(np.full(len(review_positions), term_number))
+    matches = []
+    for positions, term_numbers in per_review:
+        if not positions:
+            matches.append((EMPTY, EMPTY))
+            continue
+        positions, term_numbers = np.concatenate(positions), np.concatenate(term_numbers)
+        order = np.argsort(positions, kind="stable")
+        matches.append((positions[order], term_numbers[order]))
+    return matches
+
+def best_window(positions, term_numbers, window=SNIPPET_TOKENS):
+    ''' First token of the window of the given width covering the most distinct terms, then the most matches '''
+    if len(positions) == 0:
+        return 0
+    best_start, best_key = 0, None
+    ends = np.searchsorted(positions, positions + window)
+    for i in range(len(positions)):
+        key = (len(set(term_numbers[i:ends[i]].tolist())), ends[i] - i)
+        if best_key is None or key > best_key:
+            best_start, best_key = int(positions[i]), key
+    return best_start
+
+def make_snippet(text, spans, matches, window=SNIPPET_TOKENS, lead=LEAD_TOKENS):
+    """
+    Cuts one snippet out of a review.
+    Args:
+        text (str): The review text.
+        spans (np.ndarray): (start, end) character offsets of each token of the review.
+        matches (tuple): Sorted token positions of the query terms in the review and the
+            aligned term numbers, as returned by match_positions.
+        window (int): Tokens in the snippet.
+        lead (int): Tokens shown before the first match.
+    Returns:
+        dict: snippet (str) and highlights, a list of [start, end] character offsets into snippet.
+    """
+    if len(spans) == 0:
+        return {"snippet": "", "highlights": []}
+    positions, term_numbers = matches
+    first = best_window(positions, term_numbers, window)
+    first = max(0, min(first - lead, len(spans) - window))
+    last = min(len(spans), first + window) - 1
+
+    start, end = int(spans[first][0]), int(spans[last][1])
+    prefix = ELLIPSIS if first > 0 else ""
+    suffix = ELLIPSIS if last < len(spans) - 1 else ""
+    snippet = prefix + text[start:end] + suffix
+
+    shown = positions[(positions >= first) & (positions <= last)]
+    shift = len(prefix) - start
+    highlights = [[int(spans[p][0]) + shift, int(spans[p][1]) + shift] for p in shown.tolist()]
+    return {"snippet": snippet, "highlights": highlights}
+
+def make_snippets(index, review_metadata, terms, ids, window=SNIPPET_TOKENS):
+    """
+    Snippets for a list of hits.
+    Args:
+        index: Postings index; positional when possible, otherwise reviews are tokenized to find the terms.
+        review_metadata: ReviewStore or metadata dict.
+        terms (list): Query terms to highlight.
+        ids (list): Review IDs, in output order.
+        window (int): Tokens per snippet.
+    Returns:
+        list: One dict (ID, snippet, highlights) per ID, in the given order.
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    order = np.argsort(ids, kind="stable")
+    positional = getattr(index, "has_positions", False)
+    if positional:
+        sorted_matches = match_positions(index, terms, ids[order])
+        matches = [None] * len(ids)
+        for i, match in zip(order.tolist(), sorted_matches):
+            matches[i] = match
+
+    term_numbers = {term: number for number, term in enumerate(dict.fromkeys(terms))}
+    snippets = []
+    for i, ID in enumerate(ids.tolist()):
+        text = review_metadata[ID]["text"]
+        spans = review_metadata.token_spans(ID) if hasattr(review_metadata, "token_spans") else token_spans(text)
+        if positional:
+            review_matches = matches[i]
+        else:
+            # No positional index: find the terms among the review's tokens instead
+            words = [text[start:end].lower() for start, end in spans.tolist()]
+            found = [(p, term_numbers[word]) for p, word in enumerate(words) if word in term_numbers]
+            review_matches = tuple(np.array(column, dtype=np.int64) for column in zip(*found)) if found else (EMPTY, EMPTY)
+        snippets.append({"ID": ID, **make_snippet(text, spans, review_matches, window)})
+    return snippets
+
+def highlight(snippet, marker="**"):
+    ''' Render a snippet with its highlights wrapped in marker, e.g. for printing '''
+    text, out, last = snippet["snippet"], [], 0
+    for start, end in snippet["highlights"]:
+        out.append(text[last:start] + marker + text[start:end] + marker)
+        last = end
+    return "".join(out) + text[last:]
@@ -0,0 +1,154 @@
+from itertools import compress
+import re
+
+''' Shared text analysis: the tokenizer and the compiled opinion lexicon matcher
+
+Indexing (postings_list_generator), the classifier's preprocessing, M3's lexicon ratios,
+the index-time lexicon counts (metadata_store) and customer profiling (M4) all tokenize
+through tokenize() here, so a review is split into the same tokens everywhere, and count
+lexicon hits through one LexiconMatcher.
+
+Benchmark against the previous per-call-site code: python _bench_text_analysis.py
+'''
+
+# Bump whenever tokenize or LexiconMatcher changes what they count: index-time lexicon
+# counts computed by an older version are then treated as stale
+ANALYSIS_VERSION = 4
+
+# Same tokens as r'\b\w+\b' (a maximal run of word characters is always bounded), found faster
+TOKEN_PATTERN = re.compile(r'\w+')
+
+# A lexicon entry the tokenizer can produce: word tokens joined by hyphens or whitespace
+# (e.g. "cost-effective"). Entries such as "a+" or "f**k" can never match a token sequence
+LEXICON_ENTRY_PATTERN = re.compile(r'\w+(?:[\s-]+\w+)*')
+
+WHITESPACE = re.compile(r'\s+')
+
+def separator_key(separator):
+    ''' The text between two tokens as multi-word entries match it: runs of whitespace count as one space '''
+    return WHITESPACE.sub(" ", separator)
+
+def tokenize(text):
+    ''' Lowercased word tokens of a text, as indexed by the postings list '''
+    return TOKEN_PATTERN.findall(text.lower())
+
+def load_lexicon(filename):
+    ''' Load an opinion lexicon file into a set of entries (";" lines are comments) '''
+    with open(filename, "r", encoding="utf-8") as f:
+        return {line.strip() for line in f if line.strip() and not line.startswith(";")}
+
+class LexiconMatcher:
+    """
+    Counts positive and negative opinion lexicon hits in a text in one pass over its tokens.
+    Single-word entries are set lookups. Multi-word entries ("well-made", "cost-effective")
+    are compiled into a trie over tokens keyed by their first token, walked only from the
+    positions where such a first token occurs. The text between the tokens must match the
+    entry's own separator too, so "set-up" matches "set-up" but not "set up". Matching is
+    leftmost-longest: a multi-word entry counts once and its tokens are not counted again on
+    their own, so "cost-effective" is one positive hit, not two; every other lexicon token is
+    one hit.
+    Args:
+        positive_words (iterable): Positive lexicon entries.
+        negative_words (iterable): Negative lexicon entries.
+    """
+
+    def __init__(self, positive_words, negative_words):
+        self.positive_words = set()
+        self.negative_words = set()
+        # first token -> nested {(separator, next token): node}; a node's None key holds its (positive, negative) hits
+        self.phrases = {}
+        for polarity, entries in enumerate((positive_words, negative_words)):
+            for entry in entries:
+                entry = entry.strip().lower()
+                if not LEXICON_ENTRY_PATTERN.fullmatch(entry):
+                    continue
+                tokens = TOKEN_PATTERN.findall(entry)
+                if len(tokens) == 1:
+                    (self.positive_words, self.negative_words)[polarity].add(tokens[0])
+                    continue
+                separators = map(separator_key, TOKEN_PATTERN.split(entry)[1:-1])
+                node = self.phrases.setdefault(tokens[0], {})
+                for key in zip(separators, tokens[1:]):
+                    node = node.setdefault(key, {})
+                hits = node.get(None, (0, 0))
+                node[None] = (hits[0] + (polarity == 0), hits[1] + (polarity == 1))
+        # Every token that can start a hit, so the rest of the text is skipped in one C-level pass
+        self._starts = self.positive_words | self.negative_words | self.phrases.keys()
+
+    def __contains__(self, word):
+        return word in self.positive_words or word in self.negative_words
+
+    def count_tokens(self, tokens, separators=None):
+        """
+        Counts the hits in a tokenized text.
+        Args:
+            tokens (list): The text's tokens.
+            separators (list): The text between each token and the next; multi-word entries are
+                only matched when it is given.
+        Returns:
+            tuple: (positive, negative) hits.
+        """
+        starts = list(filter(self._starts.__contains__, tokens))
+        positive = sum(map(self.positive_words.__contains__, starts))
+        negative = sum(map(self.negative_words.__contains__, starts))
+        if separators is not None and self.phrases and not self.phrases.keys().isdisjoint(starts):
+            matched_until = 0
+            for start in compress(range(len(tokens)), map(self.phrases.__contains__, tokens)):
+                if start < matched_until:
+                    continue
+                # Walk the trie as far as the tokens go, remembering the longest entry passed
+                node = self.phrases[tokens[start]]
+                position = start + 1
+                longest = None
+                while True:
+                    if None in node:
+                        longest = (position, node[None])
+                    if position == len(tokens):
+                        break
+                    node = node.get((separator_key(separators[position - 1]), tokens[position]))
+                    if node is None:
+                        break
+                    position += 1
+                if longest is None:
+                    continue
+                # The entry replaces the single-word hits of the tokens it covers
+                matched_until, hits = longest
+                covered = tokens[start:matched_until]
+                positive += hits[0] - sum(map(self.positive_words.__contains__, covered))
+                negative += hits[1] - sum(map(self.negative_words.__contains__, covered))
+        return positive, negative
+
+    def count(self, text):
+        ''' (positive, negative) hits in a text '''
+        text = text.lower()
+        tokens = TOKEN_PATTERN.findall(text)
+        if self.phrases and not self.phrases.keys().isdisjoint(tokens):
+            # Splitting on the tokens leaves the text before, between and after them
+            return self.count_tokens(tokens, TOKEN_PATTERN.split(text)[1:-1])
+        return self.count_tokens(tokens)
+
+    def count_all(self, texts):
+        """
+        Counts the hits of many texts.
+        Args:
+            texts (list): Review texts.
+        Returns:
+            tuple: Lists of positive and negative hit counts aligned with texts.
+        """
+        positive_counts = []
+        negative_counts = []
+        for text in texts:
+            positive, negative = self.count(text)
+            positive_counts.append(positive)
+            negative_counts.append(negative)
+        return positive_counts, negative_counts
+
+    def ratio(self, text):
+        ''' Positive share of the text's lexicon hits, or None without any '''
+        positive, negative = self.count(text)
+        total = positive + negative
+        return positive / total if total else None
+
+def load_lexicon_matcher(positive_words_filename="positive-words.txt", negative_words_filename="negative-words.txt"):
+    ''' LexiconMatcher compiled from the two lexicon files '''
+    return LexiconMatcher(load_lexicon(positive_words_filename), load_lexicon(negative_words_filename))